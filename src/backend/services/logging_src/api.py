@@ -1,11 +1,11 @@
-import os
-import csv
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Query
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel
-from typing import Any, Dict, Optional
-
-app = FastAPI()
+from typing import Any, Dict, Literal, Optional
+from log_writer import LogWriter
+from log_reader import read_page
+from log_query import LogFilter, aggregate_logs, query_logs
 
 class LogPayload(BaseModel):
     date: Optional[str] = None
@@ -16,36 +16,48 @@ class LogPayload(BaseModel):
     params: Optional[Dict[str, Any]] = None
     body: Optional[Any] = None
 
-def append_log_to_csv(log: LogPayload, filename: str = "log.csv"):
-    fieldnames = ['date', 'method', 'url', 'headers', 'query', 'params', 'body']
-    file_exists = os.path.isfile(filename)
-    with open(filename, 'a', newline='') as csvfile:
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-        if not file_exists or os.stat(filename).st_size == 0:
-            writer.writeheader()
-        writer.writerow({
-            field: str(getattr(log, field, None)) if getattr(log, field, None) is not None else "NULL"
-            for field in fieldnames
-        })
+log_writer = LogWriter()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    log_writer.start()
+    yield
+    log_writer.close()
+
+app = FastAPI(lifespan=lifespan)
 
 
 @app.post("/log")
 def add_log_event(payload: LogPayload):
-    append_log_to_csv(payload)
+    log_writer.write(payload)
 
 
 @app.get("/logs")
 def get_logs(
     limit: int = Query(10, ge=1,le=100),
-    offset: int = Query(0, ge=0)
+    offset: int = Query(0, ge=0),
+    newest_first: bool = False,
+    method: Optional[str] = None,
+    url: Optional[str] = Query(None, description="URL prefix"),
+    since: Optional[str] = Query(None, description="ISO date, inclusive"),
+    until: Optional[str] = Query(None, description="ISO date, exclusive")
+):
+    log_filter = LogFilter(method, url, since, until)
+    if log_filter.is_empty():
+        paginated_logs, total = read_page(offset, limit, newest_first)
+    else:
+        paginated_logs, total = query_logs(log_filter, offset, limit, newest_first)
+    return JSONResponse(content={"logs": paginated_logs, "total": total})
+
+
+@app.get("/logs/stats")
+def get_log_stats(
+    group_by: Literal["url", "method"] = "url",
+    bucket: Optional[Literal["minute", "hour", "day"]] = None,
+    method: Optional[str] = None,
+    url: Optional[str] = Query(None, description="URL prefix"),
+    since: Optional[str] = Query(None, description="ISO date, inclusive"),
+    until: Optional[str] = Query(None, description="ISO date, exclusive")
 ):
-    fieldnames = ['date', 'method', 'url', 'headers', 'query', 'params', 'body']
-    logs = []
-    filename = "log.csv"
-    if os.path.isfile(filename):
-        with open(filename, newline='') as csvfile:
-            reader = csv.DictReader(csvfile, fieldnames=fieldnames)
-            next(reader, None)
-            logs = list(reader)
-    paginated_logs = logs[offset:offset+limit]
-    return JSONResponse(content={"logs": paginated_logs, "total": len(logs)})
\ No newline at end of file
+    counts = aggregate_logs(LogFilter(method, url, since, until), group_by, bucket)
+    return JSONResponse(content={"counts": counts})
@@ -0,0 +1,79 @@
+'''
+Sidecar offset index for log segments.
+Next to every line-based segment the writer keeps `<segment>.idx`, a flat array of
+uint64 byte offsets of every `index_every`-th row. The spacing is recorded in the
+segment's .meta.json together with the row count and a summary of every indexed block.
+Readers seek to the nearest indexed row instead of parsing the segment from the start,
+and skip blocks whose summary rules out a match.
+'''
+
+import os
+from array import array
+from typing import BinaryIO, Iterator
+
+INDEX_EVERY = int(os.getenv("LOG_INDEX_EVERY", "1000"))
+
+def index_path(segment: str) -> str:
+    return segment + ".idx"
+
+def read_index(segment: str) -> array:
+    offsets = array("Q")
+    try:
+        with open(index_path(segment), "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return offsets
+    # ignore a torn trailing entry
+    offsets.frombytes(data[:len(data) - len(data) % offsets.itemsize])
+    return offsets
+
+def append_index(segment: str, offsets: list[int]):
+    if offsets:
+        with open(index_path(segment), "ab") as f:
+            f.write(array("Q", offsets).tobytes())
+
+def write_index(path: str, offsets: list[int]):
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(array("Q", offsets).tobytes())
+    os.replace(tmp, path)
+
+def row_offsets(stream: BinaryIO, quoted: bool) -> Iterator[int]:
+    """
+    Yield the byte offset at which every record of a line-based stream starts.
+    With `quoted` (CSV), newlines inside double-quoted fields do not end a record.
+    """
+    pos = 0
+    start = None
+    in_quotes = False
+    for line in stream:
+        if start is None:
+            if not line.strip():
+                pos += len(line)
+                continue
+            start = pos
+        pos += len(line)
+        if quoted and line.count(b'"') % 2:
+            in_quotes = not in_quotes
+        if not in_quotes:
+            yield start
+            start = None
+
+def new_block() -> dict:
+    """
+    Summary of one indexed block, kept in the segment's .meta.json: the date range of
+    its rows, rows without a date, and rows per method.
+    """
+    return {"min_date": None, "max_date": None, "undated": 0, "methods": {}}
+
+def add_to_block(block: dict, row: dict):
+    date = row.get("date")
+    if date and date != "NULL":
+        if block["min_date"] is None or date < block["min_date"]:
+            block["min_date"] = date
+        if block["max_date"] is None or date > block["max_date"]:
+            block["max_date"] = date
+    else:
+        block["undated"] += 1
+    method = row.get("method") or "NULL"
+    block["methods"][method] = block["methods"].get(method, 0) + 1
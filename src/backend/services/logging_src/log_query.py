@@ -0,0 +1,143 @@
+'''
+Filtered queries and aggregates over the log segments.
+Every indexed block has a summary in its segment's .meta.json (date range, undated rows
+and rows per method), so a query only reads the blocks that can hold matching rows, and
+per-method counts for blocks wholly inside the date range come from the summaries alone.
+'''
+
+import math
+from collections import Counter
+from typing import Iterator, NamedTuple
+from log_reader import read_rows, segment_rows, with_segments
+from log_writer import LOG_DIR, LOG_FORMAT, read_meta
+
+# ISO 8601 prefix length for each time bucket
+BUCKETS = {"minute": 16, "hour": 13, "day": 10}
+
+class LogFilter(NamedTuple):
+    """
+    Row filter. Dates are ISO 8601 strings compared as text, `since` inclusive and
+    `until` exclusive, so "2025-08-01" selects from the start of that day.
+    """
+    method: str | None = None
+    url_prefix: str | None = None
+    since: str | None = None
+    until: str | None = None
+
+    def is_empty(self) -> bool:
+        return not any(self)
+
+    def _dated(self) -> bool:
+        return self.since is not None or self.until is not None
+
+    def matches(self, row: dict) -> bool:
+        if self.method is not None and (row.get("method") or "").upper() != self.method.upper():
+            return False
+        if self.url_prefix is not None and not (row.get("url") or "").startswith(self.url_prefix):
+            return False
+        if self._dated():
+            date = row.get("date")
+            if not date or date == "NULL":
+                return False
+            if self.since is not None and date < self.since:
+                return False
+            if self.until is not None and date >= self.until:
+                return False
+        return True
+
+    def may_match(self, block: dict) -> bool:
+        """
+        False only if the block summary proves no row in the block matches.
+        """
+        if self.method is not None and not any(m.upper() == self.method.upper() for m in block["methods"]):
+            return False
+        if self._dated():
+            if block["min_date"] is None:
+                return False
+            if self.since is not None and block["max_date"] < self.since:
+                return False
+            if self.until is not None and block["min_date"] >= self.until:
+                return False
+        return True
+
+    def covers_dates(self, block: dict) -> bool:
+        """
+        True if every row of the block passes the date part of the filter.
+        """
+        if not self._dated():
+            return True
+        return (block["undated"] == 0 and block["min_date"] is not None
+                and (self.since is None or block["min_date"] >= self.since)
+                and (self.until is None or block["max_date"] < self.until))
+
+def _blocks(segments, log_filter: LogFilter, newest_first: bool, fmt: str) -> Iterator[tuple[str, int, int, dict | None]]:
+    """
+    Yield `(segment, start, count, summary)` for every block that may hold matching rows.
+    Segments without block summaries are yielded whole with a summary of None.
+    """
+    order = reversed if newest_first else iter
+    for segment in order(segments):
+        meta = read_meta(segment)
+        n = segment_rows(segment, fmt)
+        every = meta.get("index_every")
+        blocks = meta.get("blocks")
+        if not every or blocks is None or len(blocks) != math.ceil(n / every):
+            yield segment, 0, n, None
+            continue
+        for b in order(range(len(blocks))):
+            if log_filter.may_match(blocks[b]):
+                yield segment, b * every, min(every, n - b * every), blocks[b]
+
+def query_logs(log_filter: LogFilter, offset: int, limit: int, newest_first: bool = False,
+               directory: str = LOG_DIR, fmt: str = LOG_FORMAT) -> tuple[list[dict], int]:
+    """
+    Return `(rows, total)` for one page of the rows matching `log_filter`.
+    """
+    def read(segments):
+        page = []
+        total = 0
+        for segment, start, count, _ in _blocks(segments, log_filter, newest_first, fmt):
+            rows = read_rows(segment, start, count, fmt)
+            if newest_first:
+                rows.reverse()
+            for row in rows:
+                if log_filter.matches(row):
+                    if offset <= total < offset + limit:
+                        page.append(row)
+                    total += 1
+        return page, total
+    return with_segments(read, directory, fmt)
+
+def _group_key(row: dict, group_by: str) -> str:
+    if group_by == "url":
+        return (row.get("url") or "NULL").split("?")[0]
+    return row.get(group_by) or "NULL"
+
+def aggregate_logs(log_filter: LogFilter, group_by: str = "url", bucket: str | None = None,
+                   directory: str = LOG_DIR, fmt: str = LOG_FORMAT) -> list[dict]:
+    """
+    Count matching rows per `group_by` value ("url" without its query string, or "method"),
+    optionally per time bucket ("minute", "hour" or "day"). Sorted by bucket, then count.
+    """
+    def read(segments):
+        counts = Counter()
+        for segment, start, count, block in _blocks(segments, log_filter, False, fmt):
+            if (group_by == "method" and bucket is None and block is not None
+                    and log_filter.url_prefix is None and log_filter.covers_dates(block)):
+                for method, n in block["methods"].items():
+                    if log_filter.method is None or method.upper() == log_filter.method.upper():
+                        counts[None, method] += n
+                continue
+            for row in read_rows(segment, start, count, fmt):
+                if log_filter.matches(row):
+                    key = (row.get("date") or "NULL")[:BUCKETS[bucket]] if bucket else None
+                    counts[key, _group_key(row, group_by)] += 1
+        return counts
+    counts = with_segments(read, directory, fmt)
+    results = []
+    for (key, value), n in sorted(counts.items(), key=lambda item: (item[0][0] or "", -item[1], item[0][1])):
+        entry = {group_by: value, "count": n}
+        if bucket:
+            entry["bucket"] = key
+        results.append(entry)
+    return results
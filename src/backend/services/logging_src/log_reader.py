@@ -0,0 +1,90 @@
+'''
+Paged reads over the log segments.
+Row counts come from each segment's .meta.json and pages are read by seeking through
+the sidecar offset index, so serving a page costs O(page size) instead of O(log size)
+and newest-first pages are as cheap as oldest-first ones.
+'''
+
+import gzip
+from itertools import islice
+from log_index import read_index, row_offsets
+from log_writer import FORMATS, LOG_DIR, LOG_FORMAT, list_segments, read_meta
+
+def segment_rows(segment: str, fmt: str = LOG_FORMAT) -> int:
+    """
+    Number of rows in a segment, counted by a scan only if it has no metadata yet.
+    """
+    meta = read_meta(segment)
+    if "rows" in meta:
+        return meta["rows"]
+    if segment.endswith(".parquet"):
+        import pyarrow.parquet as pq
+        return pq.ParquetFile(segment).metadata.num_rows
+    opener = gzip.open if segment.endswith(".gz") else open
+    line_format = FORMATS[fmt]
+    with opener(segment, "rb") as f:
+        count = sum(1 for _ in row_offsets(f, line_format.quoted))
+    return max(count - 1, 0) if line_format.header() else count
+
+def read_rows(segment: str, start: int, count: int, fmt: str = LOG_FORMAT) -> list[dict]:
+    """
+    Rows `start` to `start + count` of one segment.
+    """
+    meta = read_meta(segment)
+    every = meta.get("index_every")
+    if segment.endswith(".parquet"):
+        import pyarrow.parquet as pq
+        pf = pq.ParquetFile(segment)
+        if not every:
+            return pf.read().slice(start, count).to_pylist()
+        first, last = start // every, min((start + count - 1) // every, pf.num_row_groups - 1)
+        return pf.read_row_groups(range(first, last + 1)).slice(start - first * every, count).to_pylist()
+
+    offsets = read_index(segment) if every else []
+    block = min(start // every, len(offsets) - 1) if offsets else -1
+    with open(segment, "rb") as f:
+        if block >= 0:
+            f.seek(offsets[block])
+            skip = start - block * every
+        else:
+            skip = start
+        stream = gzip.GzipFile(fileobj=f) if segment.endswith(".gz") else f
+        rows = FORMATS[fmt].decode(stream, header=block < 0)
+        return list(islice(rows, skip, skip + count))
+
+def with_segments(read, directory: str = LOG_DIR, fmt: str = LOG_FORMAT):
+    """
+    Call `read(segments)` on the current segment list, listing again if a segment is
+    rotated or compressed away while it is being read.
+    """
+    for attempt in range(3):
+        try:
+            return read(list_segments(directory, fmt))
+        except FileNotFoundError:
+            if attempt == 2:
+                raise
+
+def read_page(offset: int, limit: int, newest_first: bool = False, directory: str = LOG_DIR,
+              fmt: str = LOG_FORMAT) -> tuple[list[dict], int]:
+    """
+    Return `(rows, total)` for one page over all segments, oldest first or newest first.
+    """
+    return with_segments(lambda segments: _read_page(segments, offset, limit, newest_first, fmt), directory, fmt)
+
+def _read_page(segments, offset, limit, newest_first, fmt):
+    counts = [segment_rows(segment, fmt) for segment in segments]
+    total = sum(counts)
+    if newest_first:
+        lo, hi = max(total - offset - limit, 0), max(total - offset, 0)
+    else:
+        lo, hi = min(offset, total), min(offset + limit, total)
+    rows = []
+    base = 0
+    for segment, n in zip(segments, counts):
+        start, end = max(lo, base), min(hi, base + n)
+        if start < end:
+            rows.extend(read_rows(segment, start - base, end - start, fmt))
+        base += n
+    if newest_first:
+        rows.reverse()
+    return rows, total
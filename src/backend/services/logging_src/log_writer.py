@@ -0,0 +1,435 @@
+'''
+Buffered, rotating log writer for the logging service.
+`/log` only puts the row on an in-process queue. A background thread drains the queue
+in batches and appends each batch with a single write while holding an exclusive lock
+on `log.lock`, so several uvicorn workers can share one log directory. The active
+segment is rotated by size or age, and rotated segments can be gzip-compressed or
+converted to Parquet.
+'''
+
+import csv
+import fcntl
+import gzip
+import io
+import json
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Iterator
+from log_index import INDEX_EVERY, add_to_block, append_index, index_path, new_block, read_index, row_offsets, write_index
+
+FIELDNAMES = ['date', 'method', 'url', 'headers', 'query', 'params', 'body']
+
+LOG_DIR = os.getenv("LOG_DIR", ".")
+# csv, jsonl, or parquet (written as jsonl, converted on rotation; needs pyarrow)
+LOG_FORMAT = os.getenv("LOG_FORMAT", "csv")
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(64 * 1024 * 1024)))
+LOG_MAX_AGE = float(os.getenv("LOG_MAX_AGE", "86400"))
+LOG_COMPRESS = os.getenv("LOG_COMPRESS", "0") == "1"
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", "500"))
+LOG_FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_INTERVAL", "1.0"))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "100000"))
+
+def to_row(log) -> dict[str, str]:
+    """
+    Flatten a log payload to the string columns every format stores ("NULL" when missing).
+    """
+    return {
+        field: str(getattr(log, field, None)) if getattr(log, field, None) is not None else "NULL"
+        for field in FIELDNAMES
+    }
+
+class CsvFormat:
+    extension = "csv"
+    quoted = True
+
+    def header(self) -> bytes:
+        return self.encode([dict(zip(FIELDNAMES, FIELDNAMES))])[0]
+
+    def encode(self, rows: list[dict]) -> list[bytes]:
+        """
+        Encode each row separately so the writer knows where every row starts.
+        """
+        buf = io.StringIO(newline='')
+        writer = csv.DictWriter(buf, fieldnames=FIELDNAMES)
+        encoded = []
+        for row in rows:
+            writer.writerow(row)
+            encoded.append(buf.getvalue().encode())
+            buf.seek(0)
+            buf.truncate()
+        return encoded
+
+    def decode(self, stream, header: bool = True) -> Iterator[dict]:
+        reader = csv.DictReader(io.TextIOWrapper(stream, newline=''), fieldnames=FIELDNAMES)
+        if header:
+            next(reader, None)
+        yield from reader
+
+class JsonlFormat:
+    extension = "jsonl"
+    quoted = False
+
+    def header(self) -> bytes:
+        return b""
+
+    def encode(self, rows: list[dict]) -> list[bytes]:
+        return [(json.dumps(row) + "\n").encode() for row in rows]
+
+    def decode(self, stream, header: bool = True) -> Iterator[dict]:
+        for line in io.TextIOWrapper(stream):
+            if line.strip():
+                yield json.loads(line)
+
+FORMATS = {"csv": CsvFormat(), "jsonl": JsonlFormat(), "parquet": JsonlFormat()}
+
+def meta_path(segment: str) -> str:
+    return segment + ".meta.json"
+
+def read_meta(segment: str) -> dict:
+    try:
+        with open(meta_path(segment)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def write_meta(segment: str, meta: dict):
+    tmp = meta_path(segment) + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(meta, f)
+    os.replace(tmp, meta_path(segment))
+
+def active_path(directory: str = LOG_DIR, fmt: str = LOG_FORMAT) -> str:
+    return os.path.join(directory, f"log.{FORMATS[fmt].extension}")
+
+def list_segments(directory: str = LOG_DIR, fmt: str = LOG_FORMAT) -> list[str]:
+    """
+    Every segment oldest first, ending with the active one.
+    A rotated segment that is still being compressed or converted is listed once.
+    """
+    extension = FORMATS[fmt].extension
+    names = set(os.listdir(directory)) if os.path.isdir(directory) else set()
+    rotated = []
+    for name in names:
+        if not name.startswith("log-") or name.endswith((".meta.json", ".idx", ".tmp")):
+            continue
+        base = name.removesuffix(".gz").removesuffix(".parquet")
+        if base == name and (name + ".gz" in names or name.removesuffix(f".{extension}") + ".parquet" in names):
+            continue
+        rotated.append(name)
+    segments = [os.path.join(directory, name) for name in sorted(rotated)]
+    active = active_path(directory, fmt)
+    if os.path.exists(active):
+        segments.append(active)
+    return segments
+
+def iter_segment(segment: str, fmt: str = LOG_FORMAT) -> Iterator[dict]:
+    """
+    Yield the rows of one segment, whatever its encoding.
+    """
+    if segment.endswith(".parquet"):
+        import pyarrow.parquet as pq
+        yield from pq.read_table(segment).to_pylist()
+        return
+    opener = gzip.open if segment.endswith(".gz") else open
+    with opener(segment, "rb") as stream:
+        yield from FORMATS[fmt].decode(stream)
+
+class LogWriter:
+    """
+    Queue plus background thread that batches rows into the active segment.
+    `write` never touches the disk; call `start` once and `close` on shutdown.
+    """
+    def __init__(self, directory: str = LOG_DIR, fmt: str = LOG_FORMAT, max_bytes: int = LOG_MAX_BYTES,
+                 max_age: float = LOG_MAX_AGE, compress: bool = LOG_COMPRESS, batch_size: int = LOG_BATCH_SIZE,
+                 flush_interval: float = LOG_FLUSH_INTERVAL, queue_size: int = LOG_QUEUE_SIZE,
+                 index_every: int = INDEX_EVERY):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown log format {fmt!r}, expected one of {sorted(FORMATS)}")
+        if fmt == "parquet":
+            import pyarrow  # noqa: F401 -- fail at startup rather than at the first rotation
+        self.directory = directory
+        self.fmt = fmt
+        self.format = FORMATS[fmt]
+        self.path = active_path(directory, fmt)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.compress = compress
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.index_every = index_every
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._pending = []
+        self._file = None
+        self._lock_file = None
+        self._thread = None
+        self._stopping = threading.Event()
+        self._progress = threading.Condition()
+        self._enqueued = 0
+        self._written = 0
+        self.dropped = 0
+        # set while rows are in the segment but its sidecars or rotation are not done; see _catch_up
+        self._behind = False
+        # a rotated segment still to be compressed or converted
+        self._converting = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self._lock_file = open(os.path.join(self.directory, "log.lock"), "a")
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+
+    def write(self, log):
+        """
+        Queue one log payload. When the queue is full the row is dropped and counted
+        rather than blocking the request.
+        """
+        try:
+            self._queue.put_nowait(to_row(log))
+        except queue.Full:
+            with self._progress:
+                self.dropped += 1
+                first = self.dropped == 1
+            if first:
+                print("Log queue is full, dropping log rows")
+            return
+        with self._progress:
+            self._enqueued += 1
+
+    def flush(self, timeout: float | None = None) -> bool:
+        """
+        Wait until every row queued so far is on disk. Returns False on timeout.
+        """
+        with self._progress:
+            target = self._enqueued
+            return self._progress.wait_for(lambda: self._written >= target, timeout)
+
+    def close(self, timeout: float | None = None):
+        """
+        Write out everything still queued and stop the background thread.
+        """
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._thread.join(timeout)
+        self._thread = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._lock_file.close()
+
+    def _run(self):
+        while True:
+            stopping = self._stopping.is_set()
+            try:
+                if self._behind:
+                    self._catch_up()
+                self._fill_batch(block=not stopping)
+                if self._pending:
+                    self._write_batch()
+                else:
+                    self._maybe_rotate_idle()
+            except Exception as e:
+                print(f"Error writing logs, retrying: {e}")
+                time.sleep(self.flush_interval)
+                continue
+            if stopping and not self._pending and not self._behind and self._queue.empty():
+                return
+
+    def _fill_batch(self, block: bool):
+        try:
+            if not self._pending and block:
+                self._pending.append(self._queue.get(timeout=self.flush_interval))
+            while len(self._pending) < self.batch_size:
+                self._pending.append(self._queue.get_nowait())
+        except queue.Empty:
+            pass
+
+    @contextmanager
+    def _locked(self):
+        fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _open_active(self):
+        """
+        (Re)open the active segment if another process rotated it away from under us.
+        """
+        if self._file is not None:
+            try:
+                current = os.stat(self.path).st_ino
+            except FileNotFoundError:
+                current = None
+            if current == os.fstat(self._file.fileno()).st_ino:
+                return
+            self._file.close()
+        self._file = open(self.path, "ab")
+
+    def _rebuild_index(self, size: int) -> dict:
+        """
+        Re-index the active segment from scratch, e.g. a log.csv written before the
+        index existed or one whose last write never reached the sidecars.
+        """
+        with open(self.path, "rb") as f:
+            starts = row_offsets(f, self.format.quoted)
+            if self.format.header():
+                next(starts, None)
+            offsets = []
+            rows = 0
+            for rows, offset in enumerate(starts, 1):
+                if (rows - 1) % self.index_every == 0:
+                    offsets.append(offset)
+        blocks = []
+        for i, row in enumerate(iter_segment(self.path, self.fmt)):
+            if i % self.index_every == 0:
+                blocks.append(new_block())
+            add_to_block(blocks[-1], row)
+        write_index(index_path(self.path), offsets)
+        meta = {**read_meta(self.path), "rows": rows, "bytes": size, "index_every": self.index_every, "blocks": blocks}
+        meta.setdefault("created", time.time())
+        write_meta(self.path, meta)
+        return meta
+
+    def _write_batch(self):
+        rows = self._pending
+        with self._locked():
+            self._open_active()
+            # other processes append too, so only the file itself knows the current size
+            size = os.fstat(self._file.fileno()).st_size
+            meta = read_meta(self.path)
+            chunks = self.format.encode(rows)
+            header = b""
+            if size == 0:
+                header = self.format.header()
+                meta = {"created": time.time(), "rows": 0, "bytes": 0, "index_every": self.index_every, "blocks": []}
+                write_index(index_path(self.path), [])
+            elif meta.get("bytes") != size or meta.get("index_every") != self.index_every or "blocks" not in meta:
+                meta = self._rebuild_index(size)
+            pos = size + len(header)
+            offsets = []
+            blocks = meta.setdefault("blocks", [])
+            for i, (row, chunk) in enumerate(zip(rows, chunks)):
+                if (meta["rows"] + i) % self.index_every == 0:
+                    offsets.append(pos)
+                    blocks.append(new_block())
+                add_to_block(blocks[-1], row)
+                pos += len(chunk)
+            self._file.write(header + b"".join(chunks))
+            self._file.flush()
+            # the rows are in the segment: if a step below fails, only the steps are redone
+            self._pending = []
+            self._behind = True
+            with self._progress:
+                self._written += len(rows)
+                self._progress.notify_all()
+            append_index(self.path, offsets)
+            meta["rows"] += len(rows)
+            meta["bytes"] = pos
+            write_meta(self.path, meta)
+            if self._due(meta, pos):
+                self._rotate()
+            self._behind = False
+
+    def _due(self, meta: dict, size: int) -> bool:
+        return size >= self.max_bytes or time.time() - meta["created"] >= self.max_age
+
+    def _catch_up(self):
+        """
+        Redo what a batch left undone after its rows reached the segment: bring the index
+        and meta up to date with the file, then rotate, compress or convert as due.
+        """
+        with self._locked():
+            if self._converting is not None:
+                self._convert(self._converting)
+            else:
+                self._open_active()
+                size = os.fstat(self._file.fileno()).st_size
+                meta = read_meta(self.path)
+                if size and (meta.get("bytes") != size or meta.get("index_every") != self.index_every or "blocks" not in meta):
+                    meta = self._rebuild_index(size)
+                if size and self._due(meta, size):
+                    self._rotate()
+        self._behind = False
+
+    def _maybe_rotate_idle(self):
+        meta = read_meta(self.path)
+        if not meta.get("rows") or time.time() - meta.get("created", time.time()) < self.max_age:
+            return
+        with self._locked():
+            self._open_active()
+            meta = read_meta(self.path)
+            if meta.get("rows") and time.time() - meta.get("created", time.time()) >= self.max_age:
+                self._rotate()
+
+    def _rotate(self):
+        """
+        Move the active segment aside under a timestamped name, then compress or convert it.
+        Called with the lock held.
+        """
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+        rotated = os.path.join(self.directory, f"log-{stamp}.{self.format.extension}")
+        # sidecars first: a listed segment always has its meta and index
+        for sidecar in (meta_path, index_path):
+            if os.path.exists(sidecar(self.path)):
+                os.replace(sidecar(self.path), sidecar(rotated))
+        os.replace(self.path, rotated)
+        self._file.close()
+        self._file = None
+        self._convert(rotated)
+
+    def _convert(self, rotated: str):
+        """
+        Compress or convert a rotated segment as configured. Safe to call again after a failure.
+        """
+        self._converting = rotated
+        # a previous attempt may have got as far as removing the source
+        if os.path.exists(rotated):
+            if self.fmt == "parquet":
+                self._finish(rotated, rotated.removesuffix(f".{self.format.extension}") + ".parquet", self._to_parquet)
+            elif self.compress:
+                self._finish(rotated, rotated + ".gz", self._gzip)
+        self._converting = None
+
+    def _finish(self, source: str, target: str, convert):
+        tmp = target + ".tmp"
+        convert(source, tmp)
+        write_meta(target, read_meta(source))
+        os.replace(tmp, target)
+        for path in (source, meta_path(source), index_path(source)):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _gzip(self, source: str, target: str):
+        """
+        Compress one gzip member per indexed block, so the target's index can hold member
+        offsets and readers can still seek. Concatenated members are a valid gzip file.
+        """
+        offsets = read_index(source)
+        size = os.path.getsize(source)
+        bounds = [0] + [o for o in offsets if o > 0] + [size]
+        indexed = set(offsets)
+        member_offsets = []
+        with open(source, "rb") as src, open(target, "wb") as dst:
+            for start, end in zip(bounds, bounds[1:]):
+                if start in indexed:
+                    member_offsets.append(dst.tell())
+                src.seek(start)
+                dst.write(gzip.compress(src.read(end - start)))
+        write_index(index_path(target.removesuffix(".tmp")), member_offsets)
+
+    def _to_parquet(self, source: str, target: str):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        rows = list(iter_segment(source, self.fmt))
+        table = pa.table({field: [row[field] for row in rows] for field in FIELDNAMES})
+        # one row group per indexed block, so readers can fetch a page by row group
+        pq.write_table(table, target, row_group_size=read_meta(source).get("index_every", self.index_every),
+                       compression="gzip" if self.compress else "snappy")
@@ -0,0 +1,103 @@
+import os
+import pytest
+import log_reader
+import log_writer
+from log_index import add_to_block, new_block, read_index
+from log_writer import FORMATS, LogWriter, active_path, iter_segment, read_meta, to_row
+
+class Log:
+    def __init__(self, url: str, method: str = "GET"):
+        self.date = "2025-08-01T00:00:00Z"
+        self.method = method
+        self.url = url
+        self.headers = {"a": 'b,"c"\n'}
+        self.query = None
+        self.params = {}
+        self.body = None
+
+def write_logs(directory: str, fmt: str, logs: list[Log]):
+    writer = LogWriter(directory, fmt, index_every=2, flush_interval=0.01)
+    writer.start()
+    for log in logs:
+        writer.write(log)
+    writer.close()
+
+def expected_blocks(rows: list[dict], every: int) -> list[dict]:
+    blocks = []
+    for i, row in enumerate(rows):
+        if i % every == 0:
+            blocks.append(new_block())
+        add_to_block(blocks[-1], row)
+    return blocks
+
+def check_segment(directory: str, fmt: str, urls: list[str]):
+    path = active_path(directory, fmt)
+    rows = list(iter_segment(path, fmt))
+    assert [row["url"] for row in rows] == urls
+    meta = read_meta(path)
+    assert meta["rows"] == len(urls)
+    assert meta["bytes"] == os.path.getsize(path)
+    assert meta["blocks"] == expected_blocks(rows, 2)
+    assert len(read_index(path)) == len(meta["blocks"])
+    for offset in range(len(urls)):
+        for limit in (1, 2, 3):
+            page, total = log_reader.read_page(offset, limit, False, directory, fmt)
+            assert total == len(urls)
+            assert [row["url"] for row in page] == urls[offset:offset + limit]
+
+@pytest.mark.parametrize("fmt", ["csv", "jsonl"])
+def test_write_onto_unindexed_segment(tmp_path, fmt):
+    line_format = FORMATS[fmt]
+    legacy = [Log(f"/old{i}", "POST" if i % 2 else "GET") for i in range(5)]
+    with open(active_path(str(tmp_path), fmt), "wb") as f:
+        f.write(line_format.header() + b"".join(line_format.encode([to_row(log) for log in legacy])))
+
+    write_logs(str(tmp_path), fmt, [Log(f"/new{i}") for i in range(3)])
+
+    check_segment(str(tmp_path), fmt, [f"/old{i}" for i in range(5)] + [f"/new{i}" for i in range(3)])
+
+@pytest.mark.parametrize("fmt", ["csv", "jsonl"])
+def test_write_onto_stale_index(tmp_path, fmt):
+    write_logs(str(tmp_path), fmt, [Log(f"/a{i}") for i in range(3)])
+    # a write that reached the segment but not its sidecars
+    with open(active_path(str(tmp_path), fmt), "ab") as f:
+        f.write(b"".join(FORMATS[fmt].encode([to_row(Log("/lost", "DELETE"))])))
+
+    write_logs(str(tmp_path), fmt, [Log(f"/b{i}") for i in range(3)])
+
+    check_segment(str(tmp_path), fmt, ["/a0", "/a1", "/a2", "/lost", "/b0", "/b1", "/b2"])
+
+class FailOnce:
+    def __init__(self, fn):
+        self.fn = fn
+        self.failed = False
+
+    def __call__(self, *args):
+        if not self.failed:
+            self.failed = True
+            raise OSError("No space left on device")
+        return self.fn(*args)
+
+@pytest.mark.parametrize("step", ["append_index", "write_meta"])
+def test_failed_sidecar_step_keeps_rows_once(tmp_path, monkeypatch, step):
+    flaky = FailOnce(getattr(log_writer, step))
+    monkeypatch.setattr(log_writer, step, flaky)
+
+    write_logs(str(tmp_path), "csv", [Log(f"/a{i}") for i in range(3)])
+
+    assert flaky.failed
+    check_segment(str(tmp_path), "csv", ["/a0", "/a1", "/a2"])
+
+def test_failed_compression_is_retried_without_rewriting_rows(tmp_path, monkeypatch):
+    flaky = FailOnce(LogWriter._gzip)
+    monkeypatch.setattr(LogWriter, "_gzip", lambda self, source, target: flaky(self, source, target))
+    writer = LogWriter(str(tmp_path), "csv", max_bytes=1, compress=True, index_every=2, flush_interval=0.01)
+    writer.start()
+    for i in range(3):
+        writer.write(Log(f"/a{i}"))
+    writer.close()
+
+    assert flaky.failed
+    segments = log_writer.list_segments(str(tmp_path), "csv")
+    assert all(segment.endswith(".gz") for segment in segments)
+    assert [row["url"] for segment in segments for row in iter_segment(segment, "csv")] == ["/a0", "/a1", "/a2"]
@@ -1,35 +1,62 @@
+import asyncio
+import contextvars
 import os
-from fastapi import FastAPI
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Literal
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import PlainTextResponse
 from pydantic import BaseModel
-import networkx as nx
-from supabase import create_client, Client
-from dotenv import load_dotenv
-from recommender import get_top_k_recommendations_for_user
-
-load_dotenv()
-
-url: str = os.getenv("SUPABASE_URL")
-key: str = os.getenv("SUPABASE_KEY")
-if not url or not key:
-    print("Error: SUPABASE_URL and/or SUPABASE_KEY environment variables are not set.")
-    exit(1)
-supabase: Client = create_client(url, key)
+from graph import FollowGraph
+from bfs_cache import BFSCache
+from result_cache import ResultCache
+from weights_store import weights_store
+from feature_extraction import adjust_follower_count, feature_store
+from scoring_engine import get_engine, prime_engine
+from candidate_retrieval import DEFAULT_MAX_CANDIDATES, all_candidates, retrieve_candidates
+from snapshot import Snapshot
+from recommender import get_top_k_recommendations_for_user, get_top_k_recommendations_for_users
+from db_update import fetch_recommendations
+from singleflight import SingleFlight
+import metrics
+from metrics import timer
+from profiler import profiler
+from data_access import supabase_config
 
 app = FastAPI()
-friends_graph = nx.DiGraph()
-resp = supabase.table("Follows").select("followerId, followingId").execute()
-for row in resp.data:
-    friends_graph.add_edge(row["followerId"], row["followingId"])
+# fail at startup, not mid-request, when the Supabase credentials are missing
+supabase_config()
+# start from a binary snapshot when one is configured instead of scanning Supabase
+SNAPSHOT_PATH = os.getenv("RECOMMENDATION_SNAPSHOT")
+if SNAPSHOT_PATH and os.path.isdir(SNAPSHOT_PATH):
+    startup_snapshot = Snapshot(SNAPSHOT_PATH)
+    friends_graph = startup_snapshot.graph()
+    feature_store.seed(startup_snapshot.features())
+    # the engine comes straight from the mapped columns; get_engine keeps it until a table changes
+    prime_engine(startup_snapshot.engine(feature_store.snapshot()))
+else:
+    friends_graph = FollowGraph()
+bfs_cache = BFSCache(friends_graph)
+result_cache = ResultCache(max_depth=bfs_cache.max_depth)
+# CPU-bound scoring for the async endpoint runs here, off the event loop and FastAPI's threadpool
+scoring_executor = ThreadPoolExecutor(max_workers=int(os.getenv("RECOMMENDATION_CPU_WORKERS", str(os.cpu_count() or 4))),
+                                      thread_name_prefix="scoring")
+inflight = SingleFlight()
+MAX_BATCH_USERS = int(os.getenv("RECOMMENDATION_MAX_BATCH_USERS", "10000"))
+
+# results are cached under the weights version they were scored with; free the old ones on a swap
+weights_store.on_change(lambda weights: result_cache.weights_changed(weights.version))
 
 def bfs_distances(user_id: str, max_depth: int = 5):
     """
     Perform a breadth-first search to find distances from the user_id
-    up to a maximum depth.
+    up to a maximum depth. Results at the cache's depth are served from `bfs_cache`.
+    Users not in the graph get `{user_id: 0}` and are not added to it: the graph is
+    only changed under `bfs_cache`'s lock, by follows.
     """
-    if user_id not in friends_graph:
-        friends_graph.add_node(user_id)
-    distances = nx.single_source_shortest_path_length(friends_graph, user_id, cutoff=max_depth)
-    return distances
+    if max_depth == bfs_cache.max_depth:
+        return bfs_cache.distances(user_id)
+    return bfs_cache.bfs(user_id, max_depth)
 
 class FollowIn(BaseModel):
     followerId: str
@@ -37,23 +64,208 @@ class FollowIn(BaseModel):
 
 @app.post("/add_follow")
 def add_follow(payload: FollowIn):
-    friends_graph.add_edge(payload.followerId, payload.followingId)
+    if bfs_cache.add_edge(payload.followerId, payload.followingId):
+        adjust_follower_count(payload.followingId, 1)
+        result_cache.follow_changed(payload.followerId, payload.followingId, added=True)
     return {"message": "Follow added successfully"}
 
+@app.post("/remove_follow")
+def remove_follow(payload: FollowIn):
+    if bfs_cache.remove_edge(payload.followerId, payload.followingId):
+        adjust_follower_count(payload.followingId, -1)
+        result_cache.follow_changed(payload.followerId, payload.followingId, added=False)
+    return {"message": "Follow removed successfully"}
+
+def _record_request(endpoint: str, start: float):
+    metrics.count("recommendation_requests_total", endpoint=endpoint)
+    metrics.observe("recommendation_request_seconds", time.perf_counter() - start, endpoint=endpoint)
+
 @app.get("/recommendation/{user_id}")
-def get_recommendations(user_id: str, k: int = 3):
+def get_recommendations(user_id: str, k: int = 3, precomputed: bool = False, debug: Literal["timings"] | None = None):
     """
     Get top K recommendations for a user based on their friends and features.
+    With `precomputed`, serve the batch job's stored results when there are any
+    (scores are not stored, so they come back as None).
+    Computed lists are served from `result_cache` until a follow change, a feature reload
+    or their TTL retires them.
+    Candidate retrieval is opt-in: by default every user in the graph is scored. Set
+    RECOMMENDATION_MAX_CANDIDATES to a cap whose recall loss `run_optimizer --max-candidates`
+    reports as acceptable to score only that many retrieved candidates.
+    With `debug=timings` the list is wrapped as `{"recommendations", "timings_ms", "counts"}`
+    with this request's time per stage.
     """
-    dist_map = bfs_distances(user_id)
+    start = time.perf_counter()
+    with metrics.trace() as trace:
+        result = None
+        if precomputed:
+            with timer("precomputed"):
+                suggested_ids = fetch_recommendations(user_id)
+            if suggested_ids:
+                result = [{"userId": uid, "score": None} for uid in suggested_ids[:k]]
+        if result is None:
+            weights = weights_store.get()
+            result = result_cache.get(user_id, k, weights.version, feature_store.reloads)
+        if result is None:
+            result = _recommend(user_id, k, weights)
+    _record_request("sync", start)
+    if debug == "timings":
+        return {"recommendations": result, **trace.as_dict()}
+    return result
+
+def _recommend(user_id: str, k: int, weights, snapshot=None, reloads: int | None = None):
+    """
+    Compute and cache the recommendations for `user_id` with one `weights_store` Weights.
+    Pass a `snapshot` together with the feature store's `reloads` as read before taking it.
+    """
+    # read before computing, so a follow change or reload landing mid-way keeps the result out of the cache
+    generation = result_cache.generation
+    if snapshot is None:
+        reloads = feature_store.reloads
+    with timer("bfs"):
+        dist_map = bfs_distances(user_id)
+    if snapshot is None:
+        with timer("snapshot"):
+            snapshot = feature_store.snapshot()
+
+    # cheap retrieval pass first so full scoring only sees a bounded candidate set
+    candidates = []
+    if DEFAULT_MAX_CANDIDATES:
+        with timer("engine"):
+            engine = get_engine(snapshot)
+        with timer("retrieve_candidates"):
+            candidates = retrieve_candidates(friends_graph, engine, user_id, dist_map, DEFAULT_MAX_CANDIDATES)
+        source = "retrieved"
+    # nothing retrieved (e.g. a new user with no follows, tags or location): score everyone
+    if not DEFAULT_MAX_CANDIDATES or not candidates:
+        with timer("all_candidates"):
+            candidates = all_candidates(friends_graph, user_id, dist_map)
+        source = "all"
+    metrics.observe("recommendation_candidates", len(candidates), source=source)
 
-    direct = {n for n,d in dist_map.items() if d == 1}
-    candidates = set(friends_graph.nodes()) - {user_id} - direct
+    recommendations = get_top_k_recommendations_for_user(user_id, dist_map, candidates, weights.values, k,
+                                                         snapshot=snapshot)
+    result = [{"userId": uid, "score": score} for uid, score in recommendations]
+    result_cache.put(user_id, k, weights.version, reloads, result, dist_map, generation)
+    return result
 
-    WEIGHTS = {
-        "location_score": 0.5,
-        "friend_score": 0.3,
-        "preference_score": 0.2,
-    }
-    recommendations = get_top_k_recommendations_for_user(user_id, dist_map, list(candidates), WEIGHTS, k)
-    return [{"userId": uid, "score": score} for uid, score in recommendations]
\ No newline at end of file
+@app.get("/recommendation/{user_id}/async")
+async def get_recommendations_async(user_id: str, k: int = 3, precomputed: bool = False,
+                                    debug: Literal["timings"] | None = None):
+    """
+    Async variant of `get_recommendations`.
+    Feature tables are refreshed with the async Supabase client, scoring runs on
+    `scoring_executor`, and concurrent requests for the same user and k share one computation.
+    Requests with `debug=timings` only coalesce with each other and get the shared run's breakdown.
+    Results are cached as for `get_recommendations`.
+    """
+    start = time.perf_counter()
+    if precomputed:
+        with metrics.trace() as trace:
+            with timer("precomputed"):
+                suggested_ids = await asyncio.to_thread(fetch_recommendations, user_id)
+        if suggested_ids:
+            _record_request("async", start)
+            result = [{"userId": uid, "score": None} for uid in suggested_ids[:k]]
+            if debug == "timings":
+                return {"recommendations": result, **trace.as_dict()}
+            return result
+
+    weights = weights_store.get()
+
+    async def compute():
+        with metrics.trace() as trace:
+            result = result_cache.get(user_id, k, weights.version, feature_store.reloads)
+            if result is not None:
+                return result, trace
+            reloads = feature_store.reloads
+            with timer("snapshot"):
+                snapshot = await feature_store.asnapshot()
+            loop = asyncio.get_running_loop()
+            # run_in_executor does not carry context over, so hand the trace to the worker explicitly
+            context = contextvars.copy_context()
+            result = await loop.run_in_executor(scoring_executor, context.run, _recommend, user_id, k,
+                                                weights, snapshot, reloads)
+        return result, trace
+    result, trace = await inflight.run((user_id, k, weights.version, debug), compute)
+    _record_request("async", start)
+    if debug == "timings":
+        return {"recommendations": result, **trace.as_dict()}
+    return result
+
+class BatchIn(BaseModel):
+    user_ids: list[str]
+    k: int = 3
+
+@app.post("/recommendations/batch")
+def get_recommendations_batch(payload: BatchIn, debug: Literal["timings"] | None = None):
+    """
+    Top K recommendations for many users in one call, as `{"recommendations": {user_id: [...]}}`.
+    Features are loaded once and the batch is scored in blocks with a multi-source BFS,
+    so bulk callers pay a fraction of the per-user cost. Every graph user is a candidate
+    (no retrieval cap), so results can differ slightly from the single-user endpoint.
+    """
+    if len(payload.user_ids) > MAX_BATCH_USERS:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BATCH_USERS} user_ids per batch")
+    start = time.perf_counter()
+    with metrics.trace() as trace:
+        with timer("snapshot"):
+            snapshot = feature_store.snapshot()
+        weights = weights_store.get()
+        results = get_top_k_recommendations_for_users(friends_graph, payload.user_ids, weights.values, payload.k,
+                                                      snapshot=snapshot, adjacency=bfs_cache.adjacency())
+    metrics.count("recommendation_requests_total", endpoint="batch")
+    metrics.count("recommendation_batch_users_total", len(results))
+    metrics.observe("recommendation_request_seconds", time.perf_counter() - start, endpoint="batch")
+    response = {"recommendations": {uid: [{"userId": rec, "score": score} for rec, score in recs]
+                                    for uid, recs in results.items()}}
+    if debug == "timings":
+        response.update(trace.as_dict())
+    return response
+
+@app.get("/weights")
+def get_weights():
+    """
+    The scoring weights in use and their version; a new weights.json is picked up
+    within `weights_store.interval` seconds of being written.
+    """
+    weights = weights_store.get()
+    return {"weights": weights.values, "version": weights.version}
+
+@app.get("/cache/stats")
+def get_cache_stats():
+    """
+    Size, hit rate and evictions by reason of the recommendation result cache.
+    """
+    return result_cache.stats()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """
+    Stage timers and counters in the Prometheus text format.
+    """
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.post("/debug/profiler/start")
+def start_profiler(interval: float = 0.005, reset: bool = True):
+    """
+    Start the sampling profiler, taking a stack sample of every thread each `interval` seconds.
+    """
+    if reset and not profiler.running:
+        profiler.reset()
+    profiler.start(interval)
+    return profiler.summary()
+
+@app.post("/debug/profiler/stop")
+def stop_profiler():
+    profiler.stop()
+    return profiler.summary()
+
+@app.get("/debug/profiler")
+def get_profile(format: Literal["summary", "collapsed"] = "summary", limit: int = 20):
+    """
+    Profiler results so far: the hottest functions, or every stack in collapsed
+    (flamegraph) format with `format=collapsed`.
+    """
+    if format == "collapsed":
+        return PlainTextResponse(profiler.collapsed())
+    return profiler.summary(limit)
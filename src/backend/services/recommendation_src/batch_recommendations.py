@@ -0,0 +1,74 @@
+'''
+Batch job that precomputes top-k recommendations for every active user and writes
+them to the Recommendations table in bulk.
+Everything is computed from one in-memory snapshot of the follow graph and feature
+tables, split across a process pool, so serving can become a point read. Each worker
+scores its chunk of users together as one users x candidates block.
+'''
+
+import argparse
+import os
+import time
+from multiprocessing import Pool
+from graph import FollowGraph
+from feature_extraction import feature_store
+from weights_store import weights_store
+import recommender
+import db_update
+
+# per-worker state, set once by _init_worker
+_graph = None
+_snapshot = None
+_weights = None
+_k = None
+
+def _init_worker(graph, snapshot, weights, k):
+    global _graph, _snapshot, _weights, _k
+    _graph, _snapshot, _weights, _k = graph, snapshot, weights, k
+
+def _recommend_chunk(users):
+    recs = recommender.get_top_k_recommendations_for_users(_graph, users, _weights, _k, snapshot=_snapshot)
+    return {user: [uid for uid, _ in recs[user]] for user in users}
+
+def compute_all(graph, snapshot, weights, k, users, workers, chunk_size):
+    """
+    Compute top-k recommendations for `users`, fanning chunks out across `workers` processes.
+    """
+    chunks = [users[i:i + chunk_size] for i in range(0, len(users), chunk_size)]
+    results = {}
+    if workers <= 1:
+        _init_worker(graph, snapshot, weights, k)
+        for chunk in chunks:
+            results.update(_recommend_chunk(chunk))
+        return results
+    with Pool(workers, initializer=_init_worker, initargs=(graph, snapshot, weights, k)) as pool:
+        for part in pool.imap_unordered(_recommend_chunk, chunks):
+            results.update(part)
+    return results
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--k", type=int, default=10, help="Number of recommendations to store per user")
+    p.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of worker processes")
+    p.add_argument("--chunk-size", type=int, default=64, help="Users per worker task")
+    p.add_argument("--upsert-chunk-size", type=int, default=db_update.UPSERT_CHUNK_SIZE, help="Rows per bulk upsert")
+    p.add_argument("--dry-run", action="store_true", help="Compute recommendations without writing them")
+    args = p.parse_args()
+
+    start = time.perf_counter()
+    graph = FollowGraph()
+    snapshot = feature_store.snapshot()
+    weights = weights_store.get().values
+    users = list(graph.nodes())
+    print(f"Snapshot loaded: {len(users)} users, {graph.number_of_edges()} edges ({time.perf_counter() - start:.1f}s)")
+
+    results = compute_all(graph, snapshot, weights, args.k, users, args.workers, args.chunk_size)
+    print(f"Computed recommendations for {len(results)} users ({time.perf_counter() - start:.1f}s)")
+
+    if args.dry_run:
+        return
+    written = db_update.post_recommendations_bulk(results, chunk_size=args.upsert_chunk_size)
+    print(f"Wrote {written} rows to Recommendations ({time.perf_counter() - start:.1f}s)")
+
+if __name__ == "__main__":
+    main()
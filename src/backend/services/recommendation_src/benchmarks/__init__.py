@@ -0,0 +1,8 @@
+'''
+Offline benchmarks for the recommendation service.
+`synthetic` generates social graphs and feature tables and serves them through an
+in-memory stand-in for the Supabase client; `run` times each recommender stage on them.
+
+Usage (from recommendation_src):
+    python -m benchmarks.run --users 1000,10000,100000 --out bench.json
+'''
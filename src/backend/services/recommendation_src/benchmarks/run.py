@@ -0,0 +1,210 @@
+'''
+Time every stage of the recommender on synthetic data of increasing size.
+For each stage we report latency percentiles, throughput and the peak memory allocated
+during one call (measured in a separate tracemalloc pass so it does not skew timings).
+Results are written as JSON; `--compare` checks them against an earlier run.
+
+Usage (from recommendation_src):
+    python -m benchmarks.run --users 1000,10000 --out bench.json
+    python -m benchmarks.run --users 1000,10000 --compare bench.json
+'''
+
+import argparse
+import json
+import platform
+import resource
+import sys
+import time
+import tracemalloc
+import numpy as np
+import data_access
+from graph import CompactGraph, FollowGraph
+from feature_extraction import compute_features_for_user, feature_store
+from recommender import get_top_k_recommendations_for_user, get_top_k_recommendations_for_users
+from candidate_retrieval import all_candidates, retrieve_candidates
+from scoring_engine import FeatureEngine, get_engine
+import feature_precompute
+import weight_optimizer
+from benchmarks.synthetic import InMemoryClient, generate
+
+WEIGHTS = {"location_score": 0.5, "friend_score": 0.3, "preference_score": 0.2}
+
+def measure(fn, inputs: list, memory_samples: int) -> dict:
+    """
+    Run `fn` on every input and summarise latency, throughput and peak memory.
+    """
+    latencies = []
+    start = time.perf_counter()
+    for x in inputs:
+        t = time.perf_counter()
+        fn(x)
+        latencies.append(time.perf_counter() - t)
+    elapsed = time.perf_counter() - start
+    ms = np.array(latencies) * 1000
+    result = {
+        "calls": len(inputs),
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p90_ms": float(np.percentile(ms, 90)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "max_ms": float(ms.max()),
+        "throughput_per_s": len(inputs) / elapsed if elapsed > 0 else float("inf"),
+    }
+    if memory_samples:
+        peak = 0
+        tracemalloc.start()
+        for x in inputs[:memory_samples]:
+            before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            fn(x)
+            peak = max(peak, tracemalloc.get_traced_memory()[1] - before)
+        tracemalloc.stop()
+        result["peak_mem_mb"] = peak / 2**20
+    return result
+
+def held_out_split(graph: CompactGraph, users: list[str], rng) -> tuple[CompactGraph, dict[str, set]]:
+    """
+    Copy of `graph` with one follow removed per user, plus the removed follows.
+    """
+    train = CompactGraph.from_csr(graph.ids, graph.indptr.copy(), graph.indices.copy())
+    held_out = {}
+    for user in users:
+        row = graph.index[user]
+        followees = graph.indices[graph.indptr[row]:graph.indptr[row + 1]]
+        if len(followees) < 2:
+            continue
+        target = graph.ids[int(rng.choice(followees))]
+        train.remove_edge(user, target)
+        held_out[user] = {target}
+    train.compact()
+    return train, held_out
+
+def bench_size(n_users: int, args) -> dict:
+    t = time.perf_counter()
+    data = generate(n_users, seed=args.seed)
+    print(f"[{n_users}] generated {len(data.follows)} follows in {time.perf_counter() - t:.1f}s")
+    data_access.set_client(InMemoryClient(data))
+    mem = args.memory_samples
+    once = [None] * args.repeat
+    stages = {}
+
+    stages["fetch_features"] = measure(lambda _: feature_store.refresh(force=True), once, min(mem, 1))
+    snapshot = feature_store.snapshot()
+    stages["fetch_features"]["rows"] = {name: len(getattr(snapshot, name)) for name in snapshot._fields[:-1]}
+
+    graphs = []
+    stages["load_graph"] = measure(lambda _: graphs.append(FollowGraph()), once, min(mem, 1))
+    graph = graphs[-1]
+    stages["load_graph"].update(nodes=graph.number_of_nodes(), edges=graph.number_of_edges())
+    stages["build_engine"] = measure(lambda _: FeatureEngine(snapshot), once, min(mem, 1))
+
+    rng = np.random.default_rng(args.seed)
+    active = np.flatnonzero(np.diff(graph.indptr) > 0)
+    users = [graph.ids[i] for i in rng.choice(active, size=min(args.queries, len(active)), replace=False)]
+    dist_maps = {}
+
+    def bfs(user):
+        dist_maps[user] = graph.bfs_distances(user, 5)
+    stages["bfs_distances"] = measure(bfs, users, mem)
+    stages["bfs_distances"]["mean_reached"] = float(np.mean([len(d) for d in dist_maps.values()]))
+
+    candidates = {user: all_candidates(graph, user, dist_maps[user]) for user in users}
+    stages["compute_features_for_user"] = measure(
+        lambda user: compute_features_for_user(user, candidates[user], dist_maps[user], snapshot=snapshot), users, mem)
+    stages["compute_features_for_user"]["mean_candidates"] = float(np.mean([len(c) for c in candidates.values()]))
+
+    def recommend(user):
+        dist_map = graph.bfs_distances(user, 5)
+        get_top_k_recommendations_for_user(user, dist_map, all_candidates(graph, user, dist_map), WEIGHTS, args.k, snapshot=snapshot)
+    stages["recommend"] = measure(recommend, users, mem)
+
+    engine = get_engine(snapshot)
+    retrieved = []
+
+    def recommend_retrieval(user):
+        dist_map = graph.bfs_distances(user, 5)
+        cands = retrieve_candidates(graph, engine, user, dist_map, args.max_candidates) or all_candidates(graph, user, dist_map)
+        retrieved.append(len(cands))
+        get_top_k_recommendations_for_user(user, dist_map, cands, WEIGHTS, args.k, snapshot=snapshot)
+    stages["recommend_retrieval"] = measure(recommend_retrieval, users, mem)
+    stages["recommend_retrieval"]["mean_candidates"] = float(np.mean(retrieved))
+
+    # the whole query sample in one batch call, to compare per-user cost with `recommend`
+    stages["recommend_batch"] = measure(
+        lambda _: get_top_k_recommendations_for_users(graph, users, WEIGHTS, args.k, snapshot=snapshot), once, min(mem, 1))
+    stages["recommend_batch"].update(users=len(users), per_user_ms=stages["recommend_batch"]["p50_ms"] / len(users))
+
+    train, held_out = held_out_split(graph, users, rng)
+    results = {}
+    stages["feature_precompute"] = measure(
+        lambda _: results.update(feature_precompute.compute_features(
+            train, snapshot, list(held_out), max_distance=4, max_candidates=args.max_candidates)),
+        once, min(mem, 1))
+    stages["feature_precompute"]["users"] = len(held_out)
+    features_by_user = feature_precompute.to_frames(train.nodes(), results)
+    stages["weight_search_fast"] = measure(
+        lambda _: weight_optimizer.weight_search_fast(features_by_user, held_out, args.k, args.step), once, min(mem, 1))
+
+    for name, stage in stages.items():
+        print(f"[{n_users}] {name:28s} p50 {stage['p50_ms']:10.2f} ms  p99 {stage['p99_ms']:10.2f} ms  "
+              f"{stage['throughput_per_s']:10.1f}/s  peak {stage.get('peak_mem_mb', float('nan')):8.1f} MB")
+    return stages
+
+def compare(results: dict, baseline: dict, threshold: float) -> bool:
+    """
+    Print p50 ratios against `baseline` and return True if any stage regressed past `threshold`.
+    """
+    regressed = False
+    for size, stages in results["sizes"].items():
+        for name, stage in stages.items():
+            old = baseline.get("sizes", {}).get(size, {}).get(name)
+            if not old or not old["p50_ms"]:
+                continue
+            ratio = stage["p50_ms"] / old["p50_ms"]
+            flag = "REGRESSION" if ratio > threshold else ""
+            regressed |= ratio > threshold
+            print(f"[{size}] {name:28s} {old['p50_ms']:10.2f} -> {stage['p50_ms']:10.2f} ms  x{ratio:5.2f} {flag}")
+    return regressed
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--users", default="1000,10000", help="Comma-separated dataset sizes, up to 1000000")
+    p.add_argument("--queries", type=int, default=50, help="Users sampled per size for the per-request stages")
+    p.add_argument("--k", type=int, default=10, help="Number of recommendations per user")
+    p.add_argument("--max-candidates", type=int, default=1000, help="Retrieval cap for recommend_retrieval and feature_precompute")
+    p.add_argument("--step", type=float, default=0.1, help="Grid step for weight_search_fast")
+    p.add_argument("--repeat", type=int, default=1, help="Runs of the one-off stages (loading, engine build, precompute, search)")
+    p.add_argument("--memory-samples", type=int, default=3, help="Calls per stage traced for peak memory (0 disables)")
+    p.add_argument("--seed", type=int, default=0, help="Seed for data generation and user sampling")
+    p.add_argument("--out", default="bench.json", help="Where to write the JSON results")
+    p.add_argument("--compare", help="Earlier results to compare p50 latencies against")
+    p.add_argument("--threshold", type=float, default=1.25, help="p50 ratio counted as a regression by --compare")
+    args = p.parse_args()
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    results = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "args": vars(args),
+        "sizes": {},
+    }
+    for n_users in (int(n) for n in args.users.split(",")):
+        results["sizes"][str(n_users)] = bench_size(n_users, args)
+    # ru_maxrss is in KiB on Linux
+    results["max_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Wrote {args.out} (max RSS {results['max_rss_mb']:.0f} MB)")
+
+    if baseline is not None:
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+'''
+Synthetic social graphs and feature tables for the benchmarks.
+Follow out-degrees and popularity are power-law, users live in Zipf-sized city clusters
+and half of all follows stay inside the follower's city. Tags, events and likes follow
+Zipf popularity. Tables are kept as integer NumPy columns and only rendered to rows
+a page at a time, so 1M-user datasets fit in memory.
+'''
+
+from typing import NamedTuple
+import numpy as np
+
+class SyntheticData(NamedTuple):
+    n_users: int
+    follows: np.ndarray      # (E, 2) follower, following
+    has_location: np.ndarray
+    lat: np.ndarray
+    lon: np.ndarray
+    user_tags: np.ndarray    # (T, 2) tag, user
+    events: np.ndarray       # owner per event
+    liked_events: np.ndarray # (L, 2) event, user
+    event_tags: np.ndarray   # (ET, 2) event, tag
+
+def _power_law(rng, n: int, alpha: float, minimum: float) -> np.ndarray:
+    """
+    Continuous Pareto samples with exponent `alpha` and lower bound `minimum`.
+    """
+    return minimum * (1 - rng.random(n)) ** (-1 / (alpha - 1))
+
+def _zipf_weights(n: int, s: float = 1.1) -> np.ndarray:
+    w = 1 / np.arange(1, n + 1) ** s
+    return w / w.sum()
+
+def _unique_pairs(a: np.ndarray, b: np.ndarray, nb: int) -> np.ndarray:
+    keys = np.unique(a.astype(np.int64) * nb + b)
+    return np.column_stack((keys // nb, keys % nb))
+
+def generate(n_users: int, seed: int = 0, avg_follows: float = 10.0, local_ratio: float = 0.5,
+             n_tags: int = 200, location_ratio: float = 0.9) -> SyntheticData:
+    rng = np.random.default_rng(seed)
+    n = n_users
+
+    # cities with Zipf sizes; users jittered ~20 km around the centre
+    n_cities = max(1, n // 2000)
+    city = rng.choice(n_cities, size=n, p=_zipf_weights(n_cities))
+    city_lat = rng.uniform(-50, 60, n_cities)
+    city_lon = rng.uniform(-180, 180, n_cities)
+    lat = np.clip(city_lat[city] + rng.normal(0, 0.15, n), -89.9, 89.9)
+    lon = (city_lon[city] + rng.normal(0, 0.15, n) / np.cos(np.radians(lat)) + 180) % 360 - 180
+    has_location = rng.random(n) < location_ratio
+
+    # power-law out-degrees (mean ~avg_follows) and power-law popularity for targets
+    alpha = 2.5
+    out_degree = np.minimum(_power_law(rng, n, alpha, avg_follows * (alpha - 2) / (alpha - 1)), n - 1).astype(np.int64)
+    src = np.repeat(np.arange(n), out_degree)
+    popularity = _power_law(rng, n, 2.1, 1.0)
+    dst = rng.choice(n, size=len(src), p=popularity / popularity.sum())
+    members = np.argsort(city, kind="stable")
+    city_start = np.concatenate(([0], np.cumsum(np.bincount(city, minlength=n_cities))))
+    local = rng.random(len(src)) < local_ratio
+    c = city[src[local]]
+    size = city_start[c + 1] - city_start[c]
+    dst[local] = members[city_start[c] + (rng.random(local.sum()) * size).astype(np.int64)]
+    keep = src != dst
+    follows = _unique_pairs(src[keep], dst[keep], n)
+
+    # 0-10 tags per user, Zipf-popular
+    tag_counts = np.minimum(rng.poisson(3, n), 10)
+    tag_users = np.repeat(np.arange(n), tag_counts)
+    tags = rng.choice(n_tags, size=len(tag_users), p=_zipf_weights(n_tags))
+    user_tags = _unique_pairs(tags, tag_users, n)
+
+    # events owned by users, 1-3 tags each, likes skewed towards popular events
+    events = np.repeat(np.arange(n), rng.poisson(0.3, n))
+    n_events = len(events)
+    if n_events:
+        et_counts = 1 + np.minimum(rng.poisson(1, n_events), 2)
+        et_events = np.repeat(np.arange(n_events), et_counts)
+        event_tags = _unique_pairs(et_events, rng.choice(n_tags, size=len(et_events), p=_zipf_weights(n_tags)), n_tags)
+        like_users = np.repeat(np.arange(n), rng.poisson(2, n))
+        event_pop = _power_law(rng, n_events, 2.1, 1.0)
+        liked = rng.choice(n_events, size=len(like_users), p=event_pop / event_pop.sum())
+        liked_events = _unique_pairs(liked, like_users, n)
+    else:
+        event_tags = np.zeros((0, 2), dtype=np.int64)
+        liked_events = np.zeros((0, 2), dtype=np.int64)
+
+    return SyntheticData(n, follows, has_location, lat, lon, user_tags, events, liked_events, event_tags)
+
+def _render(prefix: str):
+    return lambda values: [f"{prefix}{v}" for v in values.tolist()]
+
+def _parse(value: str) -> int:
+    return int(value[1:])
+
+class _Response:
+    def __init__(self, data):
+        self.data = data
+
+class _Table:
+    """
+    Columns as integer arrays plus a renderer per column.
+    """
+    def __init__(self, columns: dict[str, tuple[np.ndarray, object]]):
+        self.columns = columns
+        self.n = len(next(iter(columns.values()))[0])
+        self._sorted = {}
+
+    def rows_where_in(self, column: str, values: list[str]) -> np.ndarray:
+        if column not in self._sorted:
+            order = np.argsort(self.columns[column][0], kind="stable")
+            self._sorted[column] = (order, self.columns[column][0][order])
+        order, keys = self._sorted[column]
+        wanted = np.array(sorted({_parse(v) for v in values}), dtype=np.int64)
+        if not len(wanted):
+            return np.zeros(0, dtype=np.int64)
+        lo = np.searchsorted(keys, wanted, side="left")
+        hi = np.searchsorted(keys, wanted, side="right")
+        return np.sort(np.concatenate([order[a:b] for a, b in zip(lo.tolist(), hi.tolist())]))
+
+class _Query:
+    def __init__(self, table: _Table):
+        self.table = table
+        self.selected = list(table.columns)
+        self.rows = None
+        self.bounds = None
+
+    def select(self, columns: str, **_):
+        if columns.strip() != "*":
+            self.selected = [c.strip() for c in columns.split(",")]
+        return self
+
+    def in_(self, column: str, values):
+        self.rows = self.table.rows_where_in(column, list(values))
+        return self
+
+    def eq(self, column: str, value):
+        return self.in_(column, [value])
+
+    def order(self, *_, **__):
+        # tables are generated in a fixed order, which is all pagination needs
+        return self
+
+    def range(self, start: int, end: int):
+        self.bounds = (start, end + 1)
+        return self
+
+    def limit(self, n: int):
+        self.bounds = (0, n)
+        return self
+
+    def execute(self):
+        rows = self.rows if self.rows is not None else np.arange(self.table.n)
+        if self.bounds is not None:
+            rows = rows[self.bounds[0]:self.bounds[1]]
+        columns = {name: self.table.columns[name][1](self.table.columns[name][0][rows]) for name in self.selected}
+        return _Response([dict(zip(columns, values)) for values in zip(*columns.values())])
+
+class InMemoryClient:
+    """
+    Stand-in for the Supabase client over SyntheticData: supports the select / in_ /
+    order / range / execute chains that data_access issues.
+    """
+    def __init__(self, data: SyntheticData):
+        located = np.flatnonzero(data.has_location)
+        points = lambda rows: [{"type": "Point", "coordinates": [float(data.lon[r]), float(data.lat[r])]} for r in rows.tolist()]
+        self.tables = {
+            "Follows": _Table({"followerId": (data.follows[:, 0], _render("u")),
+                               "followingId": (data.follows[:, 1], _render("u"))}),
+            "user_locations": _Table({"userId": (located, _render("u")), "location": (located, points)}),
+            "_UserTags": _Table({"A": (data.user_tags[:, 0], _render("t")), "B": (data.user_tags[:, 1], _render("u"))}),
+            "Event": _Table({"id": (np.arange(len(data.events)), _render("e")), "userId": (data.events, _render("u"))}),
+            "_LikedEvents": _Table({"A": (data.liked_events[:, 0], _render("e")), "B": (data.liked_events[:, 1], _render("u"))}),
+            "_EventTags": _Table({"A": (data.event_tags[:, 0], _render("e")), "B": (data.event_tags[:, 1], _render("t"))}),
+        }
+
+    def table(self, name: str) -> _Query:
+        return _Query(self.tables[name])
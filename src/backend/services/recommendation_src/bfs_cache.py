@@ -0,0 +1,111 @@
+'''
+Per-user cache of bounded-depth BFS results over the follow graph.
+Entries are invalidated only when a follow edge is added or removed inside the
+cached neighbourhood, so repeated recommendations for the same user skip the BFS.
+'''
+
+import threading
+from collections import OrderedDict
+from graph import CompactGraph
+from metrics import count
+
+def shortened_by_add(dist_map: dict[str, int], follower: str, following: str, max_depth: int) -> bool:
+    """
+    True if adding follower -> following can change `dist_map` (a BFS bounded at max_depth):
+    the source reaches `follower` in under max_depth hops and the new edge gives `following`
+    a shorter (or first) path.
+    """
+    d = dist_map.get(follower)
+    return d is not None and d < max_depth and d + 1 < dist_map.get(following, max_depth + 1)
+
+def lengthened_by_remove(dist_map: dict[str, int], follower: str, following: str) -> bool:
+    """
+    True if removing follower -> following can change `dist_map`, i.e. a shortest path may have used it.
+    """
+    d = dist_map.get(follower)
+    return d is not None and dist_map.get(following) == d + 1
+
+class BFSCache:
+    """
+    LRU cache of `graph.bfs_distances(user_id, max_depth)` keyed by source user.
+    The graph must only be mutated through `add_edge` / `remove_edge` here so the
+    affected entries are dropped.
+    """
+    def __init__(self, graph: CompactGraph, max_depth: int = 5, max_entries: int = 10000):
+        self.graph = graph
+        self.max_depth = max_depth
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # serializes graph mutations (which may compact the CSR arrays) with BFS reads
+        self._graph_lock = threading.Lock()
+        # bumped on every graph change so a BFS that raced with one is not cached
+        self._generation = 0
+
+    def distances(self, user_id: str) -> dict[str, int]:
+        """
+        Cached BFS distances from `user_id`. The returned dict is shared; do not mutate it.
+        """
+        with self._lock:
+            dist_map = self._entries.get(user_id)
+            if dist_map is not None:
+                self._entries.move_to_end(user_id)
+                count("bfs_cache_requests_total", result="hit")
+                return dist_map
+            generation = self._generation
+        count("bfs_cache_requests_total", result="miss")
+        with self._graph_lock:
+            dist_map = self.graph.bfs_distances(user_id, self.max_depth)
+        with self._lock:
+            if generation != self._generation:
+                return dist_map
+            self._entries[user_id] = dist_map
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return dist_map
+
+    def bfs(self, user_id: str, max_depth: int) -> dict[str, int]:
+        """
+        Uncached `graph.bfs_distances` at another depth, taken under the graph lock.
+        """
+        with self._graph_lock:
+            return self.graph.bfs_distances(user_id, max_depth)
+
+    def _invalidate_where(self, affected):
+        with self._lock:
+            self._generation += 1
+            stale = [source for source, dist_map in self._entries.items() if affected(dist_map)]
+            for source in stale:
+                del self._entries[source]
+
+    def add_edge(self, follower: str, following: str) -> bool:
+        """
+        Add a follow and drop the cached results it can shorten (see `shortened_by_add`).
+        """
+        with self._graph_lock:
+            added = self.graph.add_edge(follower, following)
+        if added:
+            self._invalidate_where(lambda dist_map: shortened_by_add(dist_map, follower, following, self.max_depth))
+        return added
+
+    def remove_edge(self, follower: str, following: str) -> bool:
+        """
+        Remove a follow and drop the cached results whose shortest paths may have used it.
+        """
+        with self._graph_lock:
+            removed = self.graph.remove_edge(follower, following)
+        if removed:
+            self._invalidate_where(lambda dist_map: lengthened_by_remove(dist_map, follower, following))
+        return removed
+
+    def adjacency(self):
+        """
+        `graph.adjacency()` taken under the graph lock, for batch BFS passes.
+        """
+        with self._graph_lock:
+            return self.graph.adjacency()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
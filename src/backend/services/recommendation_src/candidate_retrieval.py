@@ -0,0 +1,109 @@
+'''
+Candidate retrieval stage for the recommender.
+Instead of running full feature scoring on every user in the graph, a cheap first pass
+collects the users that can score above zero on at least one signal: the 2-4 hop follow
+neighbourhood, users within the location radius (same or adjacent geo cells) and users
+sharing tags or liked tags. The union is ranked by a rough prior and capped before the
+full scoring stage.
+'''
+
+import os
+import numpy as np
+from graph import CompactGraph
+from ranking import top_k_indices
+from scoring_engine import FeatureEngine
+from user_ids import UserIds, lookup_rows, take_ids
+
+# 0 (the default) disables retrieval and scores every user in the graph. Retrieval is
+# opt-in: pick a cap once `run_optimizer --max-candidates` shows an acceptable recall loss.
+DEFAULT_MAX_CANDIDATES = int(os.getenv("RECOMMENDATION_MAX_CANDIDATES", "0"))
+MIN_HOPS = 2
+GEO_RADIUS_KM = 100.0
+
+# (engine, graph, engine row -> graph index, graph nodes mapped so far); see _graph_rows
+_cached_graph_rows = None
+
+def _graph_rows(graph: CompactGraph, engine: FeatureEngine) -> np.ndarray:
+    """
+    Graph index of every engine row, -1 for rows not in the graph (including the empty row).
+    Graph indices never move, so nodes added since the last call are mapped incrementally.
+    """
+    global _cached_graph_rows
+    cached = _cached_graph_rows
+    if cached is not None and cached[0] is engine and cached[1] is graph:
+        _, _, rows, mapped = cached
+    else:
+        rows, mapped = np.full(engine.empty + 1, -1, dtype=np.int64), 0
+    ids = graph.ids
+    n = len(ids)
+    if mapped == 0 and isinstance(ids, UserIds) and isinstance(engine.user_ids, UserIds) \
+            and ids.mapped is engine.user_ids.mapped:
+        # both opened from one snapshot: the graph's mapped users are the engine's first rows
+        mapped = min(ids.n_mapped, engine.user_ids.n_mapped)
+        rows[:mapped] = np.arange(mapped)
+    for i in range(mapped, n):
+        r = engine.index.get(ids[i])
+        if r is not None:
+            rows[r] = i
+    _cached_graph_rows = (engine, graph, rows, n)
+    return rows
+
+def retrieve_candidates(graph: CompactGraph, engine: FeatureEngine, user_id: str, dist_map: dict[str,int],
+                        max_candidates: int = DEFAULT_MAX_CANDIDATES, max_distance: int = 4) -> list[str]:
+    """
+    Return at most `max_candidates` graph users worth scoring for `user_id`, highest prior first.
+    The user and their direct follows are never returned. The prior adds up the parts of the
+    friend, location and preference scores that are cheap to get from each source, as one
+    array over graph indices.
+    """
+    graph_rows = _graph_rows(graph, engine)
+    n = len(graph.ids)
+    prior = np.zeros(n)
+    seen = np.zeros(n, dtype=bool)
+
+    # a user outside the graph maps to n and is dropped with the nodes added since `n` was read
+    nodes = lookup_rows(graph.index, dist_map, n)
+    depths = np.fromiter(dist_map.values(), dtype=float, count=len(dist_map))
+    inside = nodes < n
+    nodes, depths = nodes[inside], depths[inside]
+    hops = (depths >= MIN_HOPS) & (depths <= max_distance)
+    prior[nodes[hops]] = 1 - depths[hops] / max_distance
+    seen[nodes[hops]] = True
+
+    row = engine.index.get(user_id, engine.empty)
+    nearby, dist_km = engine.nearby(row, GEO_RADIUS_KM)
+    sharing, shared = engine.sharing(row)
+    for rows, values in ((nearby, 1 - dist_km / GEO_RADIUS_KM), (sharing, shared)):
+        g = graph_rows[rows]
+        keep = (g >= 0) & (g < n)
+        # each source lists a row at most once, so plain fancy-index adds are safe
+        prior[g[keep]] += values[keep]
+        seen[g[keep]] = True
+
+    # never the user or their direct follows
+    seen[nodes[depths <= 1]] = False
+    user = graph.index.get(user_id)
+    if user is not None and user < n:
+        seen[user] = False
+
+    candidates = np.flatnonzero(seen)
+    candidates = candidates[top_k_indices(prior[candidates], max_candidates or len(candidates))]
+    return take_ids(graph.ids, candidates)
+
+def all_candidates(graph: CompactGraph, user_id: str, dist_map: dict[str,int]) -> list[str]:
+    """
+    Everyone in the graph except the user and their direct follows (no retrieval).
+    """
+    direct = {n for n, d in dist_map.items() if d == 1}
+    return [n for n in graph.nodes() if n != user_id and n not in direct]
+
+def retrieval_coverage(candidates_by_user: dict[str, list[str]], held_out_by_user: dict[str, set]) -> float:
+    """
+    Fraction of held-out follows that survive retrieval, averaged per user.
+    This bounds recall@k from above however the retrieved candidates are ranked.
+    """
+    coverage = []
+    for user, held in held_out_by_user.items():
+        if held:
+            coverage.append(len(held & set(candidates_by_user.get(user, ()))) / len(held))
+    return float(np.mean(coverage)) if coverage else 0.0
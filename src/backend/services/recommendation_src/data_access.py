@@ -0,0 +1,229 @@
+'''
+Shared Supabase data-access layer for the recommendation services.
+All services go through one pooled client and read tables page by page as generators,
+so large tables are never truncated at PostgREST's row limit or loaded into memory
+in a single response.
+'''
+
+import asyncio
+import os
+import threading
+import time
+from typing import Callable, Iterable, Iterator, NamedTuple
+from supabase import create_client, acreate_client, Client, AsyncClient
+from dotenv import load_dotenv
+from metrics import count
+
+load_dotenv()
+
+PAGE_SIZE = int(os.getenv("SUPABASE_PAGE_SIZE", "1000"))
+# keep .in_() filters well under PostgREST's URL length limit
+IN_CHUNK_SIZE = 200
+MAX_RETRIES = 4
+BACKOFF_SECONDS = 0.5
+
+_client: Client | None = None
+_client_lock = threading.Lock()
+
+class Follow(NamedTuple):
+    follower_id: str
+    following_id: str
+
+class UserLocation(NamedTuple):
+    user_id: str
+    lat: float
+    lon: float
+
+class UserTag(NamedTuple):
+    tag_id: str
+    user_id: str
+
+class EventOwner(NamedTuple):
+    event_id: str
+    user_id: str
+
+class LikedEvent(NamedTuple):
+    event_id: str
+    user_id: str
+
+class EventTag(NamedTuple):
+    event_id: str
+    tag_id: str
+
+def supabase_config() -> tuple[str, str]:
+    """
+    SUPABASE_URL and SUPABASE_KEY from the environment.
+    Raises RuntimeError when either is unset; services call this at startup so a missing
+    credential stops the deploy instead of failing requests later.
+    """
+    url = os.getenv("SUPABASE_URL")
+    key = os.getenv("SUPABASE_KEY")
+    if not url or not key:
+        raise RuntimeError("SUPABASE_URL and/or SUPABASE_KEY environment variables are not set.")
+    return url, key
+
+def get_client() -> Client:
+    """
+    Return the process-wide Supabase client, creating it on first use.
+    The underlying HTTP session keeps its connections alive, so sharing one client
+    pools connections across every caller in the process.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = create_client(*supabase_config())
+        return _client
+
+def set_client(client):
+    """
+    Replace the process-wide client, e.g. with the in-memory tables the benchmarks use.
+    """
+    global _client
+    with _client_lock:
+        _client = client
+
+def with_retries(request: Callable, retries: int = MAX_RETRIES, backoff: float = BACKOFF_SECONDS):
+    """
+    Run `request`, retrying with exponential backoff if it raises.
+    The last failure is re-raised once all attempts are used up.
+    """
+    for attempt in range(retries):
+        try:
+            return request()
+        except Exception as e:
+            if attempt == retries - 1:
+                raise
+            delay = backoff * 2 ** attempt
+            print(f"Supabase request failed ({e}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+def _chunks(items: list, size: int) -> Iterator[list]:
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def _page_query(client, table: str, columns: str, order_by: Iterable[str], in_filter, start: int, page_size: int):
+    query = client.table(table).select(columns)
+    if in_filter is not None:
+        query = query.in_(in_filter[0], in_filter[1])
+    for column in order_by:
+        query = query.order(column)
+    return query.range(start, start + page_size - 1)
+
+def iter_rows(table: str, columns: str, order_by: Iterable[str], in_filter: tuple[str, list] | None = None,
+              page_size: int = PAGE_SIZE) -> Iterator[dict]:
+    """
+    Yield every row of `table` one page at a time.
+    `order_by` must identify rows uniquely (e.g. the primary key) so pages do not
+    overlap or skip rows. `in_filter` is an optional `(column, values)` pair.
+    """
+    start = 0
+    while True:
+        def request(start=start):
+            return _page_query(get_client(), table, columns, order_by, in_filter, start, page_size).execute()
+        rows = with_retries(request).data or []
+        count("supabase_requests_total", table=table)
+        count("supabase_rows_fetched_total", len(rows), table=table)
+        yield from rows
+        if len(rows) < page_size:
+            return
+        start += page_size
+
+# name -> (table, columns, unique ordering, row converter)
+TABLES = {
+    "follows": ("Follows", "followerId, followingId", ("followerId", "followingId"),
+                lambda row: Follow(row["followerId"], row["followingId"])),
+    "user_locations": ("user_locations", "userId, location", ("userId",),
+                       lambda row: UserLocation(row["userId"], row["location"]["coordinates"][1], row["location"]["coordinates"][0])),
+    "user_tags": ("_UserTags", "A, B", ("A", "B"), lambda row: UserTag(row["A"], row["B"])),
+    "events": ("Event", "id, userId", ("id",), lambda row: EventOwner(row["id"], row["userId"])),
+    "liked_events": ("_LikedEvents", "A, B", ("A", "B"), lambda row: LikedEvent(row["A"], row["B"])),
+    "event_tags": ("_EventTags", "A, B", ("A", "B"), lambda row: EventTag(row["A"], row["B"])),
+}
+
+def iter_table(name: str, in_filter: tuple[str, list] | None = None) -> Iterator[NamedTuple]:
+    """
+    Yield typed rows of one of the TABLES.
+    """
+    table, columns, order_by, convert = TABLES[name]
+    for row in iter_rows(table, columns, order_by, in_filter):
+        yield convert(row)
+
+def iter_follows() -> Iterator[Follow]:
+    return iter_table("follows")
+
+def iter_user_locations() -> Iterator[UserLocation]:
+    return iter_table("user_locations")
+
+def iter_user_tags() -> Iterator[UserTag]:
+    return iter_table("user_tags")
+
+def iter_events() -> Iterator[EventOwner]:
+    return iter_table("events")
+
+def iter_liked_events() -> Iterator[LikedEvent]:
+    return iter_table("liked_events")
+
+def iter_event_tags(event_ids: Iterable[str] | None = None) -> Iterator[EventTag]:
+    """
+    Yield event tags, optionally restricted to `event_ids`.
+    The ID list is sent in chunks of IN_CHUNK_SIZE so the request stays bounded.
+    """
+    if event_ids is None:
+        yield from iter_table("event_tags")
+        return
+    for chunk in _chunks(list(event_ids), IN_CHUNK_SIZE):
+        yield from iter_table("event_tags", in_filter=("A", chunk))
+
+_async_client: AsyncClient | None = None
+_async_client_lock = asyncio.Lock()
+
+async def get_async_client() -> AsyncClient:
+    """
+    Async counterpart of `get_client`, for use from the event loop.
+    """
+    global _async_client
+    async with _async_client_lock:
+        if _async_client is None:
+            _async_client = await acreate_client(*supabase_config())
+        return _async_client
+
+async def with_retries_async(request: Callable, retries: int = MAX_RETRIES, backoff: float = BACKOFF_SECONDS):
+    """
+    Await `request()`, retrying with exponential backoff like `with_retries`.
+    """
+    for attempt in range(retries):
+        try:
+            return await request()
+        except Exception as e:
+            if attempt == retries - 1:
+                raise
+            delay = backoff * 2 ** attempt
+            print(f"Supabase request failed ({e}), retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+async def fetch_table_async(name: str, in_filter: tuple[str, list] | None = None, page_size: int = PAGE_SIZE) -> list[NamedTuple]:
+    """
+    Read all typed rows of one of the TABLES with the async client.
+    """
+    table, columns, order_by, convert = TABLES[name]
+    rows = []
+    start = 0
+    while True:
+        async def request(start=start):
+            client = await get_async_client()
+            return await _page_query(client, table, columns, order_by, in_filter, start, page_size).execute()
+        page = (await with_retries_async(request)).data or []
+        count("supabase_requests_total", table=table)
+        count("supabase_rows_fetched_total", len(page), table=table)
+        rows.extend(convert(row) for row in page)
+        if len(page) < page_size:
+            return rows
+        start += page_size
+
+async def fetch_event_tags_async(event_ids: Iterable[str]) -> list[EventTag]:
+    """
+    Async `iter_event_tags(event_ids)`, with the chunks requested concurrently.
+    """
+    chunks = list(_chunks(list(event_ids), IN_CHUNK_SIZE))
+    pages = await asyncio.gather(*(fetch_table_async("event_tags", in_filter=("A", chunk)) for chunk in chunks))
+    return [row for page in pages for row in page]
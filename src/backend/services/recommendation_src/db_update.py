@@ -1,12 +1,6 @@
-import os
-from supabase import create_client, Client
-from dotenv import load_dotenv
+from data_access import get_client, with_retries
 
-load_dotenv()
-
-url: str = os.getenv("SUPABASE_URL")
-key: str = os.getenv("SUPABASE_KEY")
-supabase: Client = create_client(url, key)
+UPSERT_CHUNK_SIZE = 500
 
 def post_recommendations(user_id, recommendations):
     data = {
@@ -14,4 +8,26 @@ def post_recommendations(user_id, recommendations):
         "suggested_ids": recommendations
     }
     
-    supabase.table("Recommendations").upsert(data, on_conflict="user_id").execute()
\ No newline at end of file
+    with_retries(lambda: get_client().table("Recommendations").upsert(data, on_conflict="user_id").execute())
+
+def post_recommendations_bulk(recommendations_by_user, chunk_size=UPSERT_CHUNK_SIZE):
+    """
+    Upsert many users' recommendations, `chunk_size` rows per request.
+    """
+    rows = [
+        {"user_id": user_id, "suggested_ids": recommendations}
+        for user_id, recommendations in recommendations_by_user.items()
+    ]
+    for i in range(0, len(rows), chunk_size):
+        chunk = rows[i:i + chunk_size]
+        with_retries(lambda: get_client().table("Recommendations").upsert(chunk, on_conflict="user_id").execute())
+    return len(rows)
+
+def fetch_recommendations(user_id):
+    """
+    Point read of a user's precomputed recommendations, or None if there are none.
+    """
+    resp = with_retries(lambda: get_client().table("Recommendations").select("suggested_ids").eq("user_id", user_id).execute())
+    if not resp.data:
+        return None
+    return resp.data[0]["suggested_ids"]
@@ -0,0 +1,147 @@
+'''
+Offline ranking metrics for the weight optimizer.
+Each user's candidates are ranked once, to the largest k asked for, and every metric at
+every k is read off cumulative sums over that one ranking: recall@k, precision@k, NDCG@k,
+MAP@k and MRR@k, for all users at once. Means can come with percentile bootstrap
+confidence intervals over users.
+'''
+
+import numpy as np
+
+METRIC_NAMES = ["recall", "precision", "ndcg", "map", "mrr"]
+# upper bound on resampling weights held at once by bootstrap_ci
+BOOTSTRAP_CHUNK_ELEMENTS = 10_000_000
+
+def parse_ks(value: str) -> list[int]:
+    """
+    "1,3,5,10" -> [1, 3, 5, 10], for argparse.
+    """
+    ks = [int(part) for part in value.split(",") if part.strip()]
+    if not ks or min(ks) < 1:
+        raise ValueError(f"expected positive comma-separated k values, got {value!r}")
+    return ks
+
+def rank_hits(stack, weights, depth: int) -> np.ndarray:
+    """
+    Rank every user's candidates in a PaddedStack (a chunk of a FeatureStack) by `weights` and
+    return a (users, depth) bool array marking held-out follows, best first. As in
+    ranking.top_k_indices, ties go to the lower candidate index. Users with fewer than `depth`
+    candidates are padded with misses.
+    """
+    n_users, n_cands, _ = stack.features.shape
+    depth = min(depth, n_cands)
+    if n_users == 0 or depth == 0:
+        return np.zeros((n_users, 0), dtype=bool)
+    scores = np.where(stack.valid, stack.features @ np.asarray(weights, dtype=float), -np.inf)
+    if depth < n_cands:
+        # each row keeps what scores above its depth-th score, then the lowest-index ties
+        kth = np.partition(scores, n_cands - depth, axis=1)[:, n_cands - depth, None]
+        above = scores > kth
+        tied = scores == kth
+        need = depth - above.sum(axis=1, keepdims=True)
+        keep = above | (tied & (np.cumsum(tied, axis=1) <= need))
+        top = np.nonzero(keep)[1].reshape(n_users, depth)
+    else:
+        top = np.broadcast_to(np.arange(n_cands), scores.shape)
+    order = np.lexsort((top, -np.take_along_axis(scores, top, axis=1)))
+    top = np.take_along_axis(top, order, axis=1)
+    return np.take_along_axis(stack.held, top, axis=1)
+
+def ranking_metrics(hits: np.ndarray, n_held: np.ndarray, ks: list[int]) -> dict[str, np.ndarray]:
+    """
+    Per-user `{"<metric>@<k>": values}` for every metric in METRIC_NAMES and every k, from
+    ranked hits as returned by `rank_hits` (depth at least max(ks), or every candidate) and
+    each user's number of held-out follows. Users with nothing held out score 0.
+    """
+    n_users, depth = hits.shape
+    n_held = np.asarray(n_held, dtype=float)
+    positions = np.arange(1, max(max(ks), depth) + 1)
+    discount = 1 / np.log2(positions + 1)
+    # ideal DCG with m relevant items is ideal[m - 1]
+    ideal = np.cumsum(discount)
+    found = np.cumsum(hits, axis=1)
+    dcg = np.cumsum(hits * discount[:depth], axis=1)
+    # average precision sums precision@i over the ranks i that hit
+    precision_sum = np.cumsum(hits * (found / positions[:depth]), axis=1)
+    first = np.where(hits.any(axis=1), hits.argmax(axis=1) + 1, 0) if depth else np.zeros(n_users, dtype=int)
+    has_held = n_held > 0
+
+    metrics = {}
+    for k in ks:
+        last = min(k, depth) - 1
+        if last < 0:
+            zeros = np.zeros(n_users)
+            metrics.update({f"{name}@{k}": zeros for name in METRIC_NAMES})
+            continue
+        relevant = np.minimum(n_held, k)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            metrics[f"recall@{k}"] = np.where(has_held, found[:, last] / n_held, 0.0)
+            metrics[f"precision@{k}"] = found[:, last] / k
+            metrics[f"ndcg@{k}"] = np.where(has_held, dcg[:, last] / ideal[np.maximum(relevant, 1).astype(int) - 1], 0.0)
+            metrics[f"map@{k}"] = np.where(has_held, precision_sum[:, last] / relevant, 0.0)
+        metrics[f"mrr@{k}"] = np.where((first > 0) & (first <= k), 1 / np.maximum(first, 1), 0.0)
+    return metrics
+
+def evaluate_stack(stack, weights, ks: list[int]) -> dict[str, np.ndarray]:
+    """
+    Per-user metrics for `weights` over a FeatureStack, at every k in one ranking pass,
+    ranking one padded chunk of users at a time.
+    """
+    parts = [ranking_metrics(rank_hits(block, weights, max(ks)), block.n_held, ks) for block in stack.chunks()]
+    if not parts:
+        return ranking_metrics(np.zeros((0, 0), dtype=bool), np.zeros(0), ks)
+    return {name: np.concatenate([part[name] for part in parts]) for name in parts[0]}
+
+def bootstrap_ci(per_user: dict[str, np.ndarray], samples: int = 1000, confidence: float = 0.95,
+                 seed: int = 20) -> dict[str, tuple[float, float]]:
+    """
+    Percentile bootstrap interval of each metric's mean over users. Every metric is read
+    from the same resamples, and a resample is drawn as per-user multiplicities so the
+    users x metrics values are never copied.
+    """
+    names = list(per_user)
+    if not names or samples <= 0:
+        return {}
+    values = np.column_stack([per_user[name] for name in names])
+    n_users = len(values)
+    if n_users == 0:
+        return {name: (0.0, 0.0) for name in names}
+    rng = np.random.default_rng(seed)
+    means = np.empty((samples, len(names)))
+    chunk = max(1, BOOTSTRAP_CHUNK_ELEMENTS // n_users)
+    for start in range(0, samples, chunk):
+        n = min(chunk, samples - start)
+        counts = rng.multinomial(n_users, np.full(n_users, 1 / n_users), size=n)
+        means[start:start + n] = counts @ values / n_users
+    alpha = (1 - confidence) / 2
+    low, high = np.quantile(means, [alpha, 1 - alpha], axis=0)
+    return {name: (float(low[i]), float(high[i])) for i, name in enumerate(names)}
+
+def summarize(per_user: dict[str, np.ndarray], samples: int = 0, confidence: float = 0.95,
+              seed: int = 20) -> dict[str, dict[str, float]]:
+    """
+    `{metric: {"mean", "low", "high"}}`; low and high are only set with bootstrap `samples`.
+    """
+    ci = bootstrap_ci(per_user, samples, confidence, seed)
+    summary = {}
+    for name, values in per_user.items():
+        summary[name] = {"mean": float(np.mean(values)) if len(values) else 0.0}
+        if name in ci:
+            summary[name]["low"], summary[name]["high"] = ci[name]
+    return summary
+
+def format_summary(summary: dict[str, dict[str, float]], ks: list[int]) -> str:
+    """
+    Summary as a metrics x k table, with intervals when present.
+    """
+    lines = [f"{'':>10}" + "".join(f"{'@' + str(k):>24}" for k in ks)]
+    for name in METRIC_NAMES:
+        cells = []
+        for k in ks:
+            stats = summary[f"{name}@{k}"]
+            cell = f"{stats['mean']:.4f}"
+            if "low" in stats:
+                cell += f" [{stats['low']:.4f}, {stats['high']:.4f}]"
+            cells.append(f"{cell:>24}")
+        lines.append(f"{name:>10}" + "".join(cells))
+    return "\n".join(lines)
@@ -4,90 +4,126 @@ This module fetches user data, computes features based on location, tags, and fr
 and prepares the data for recommendation algorithms.
 '''
 
-import os
-from supabase import create_client, Client
-from dotenv import load_dotenv
 import pandas as pd
 import numpy as np
 from collections import deque
 import math
+from data_access import (iter_user_locations, iter_user_tags, iter_follows, iter_events, iter_liked_events, iter_event_tags,
+                         fetch_table_async, fetch_event_tags_async)
+from feature_store import FeatureStore, FeatureSnapshot
+from scoring_engine import get_engine, sync_cached_count
 
-load_dotenv()
-
-url: str = os.getenv("SUPABASE_URL")
-key: str = os.getenv("SUPABASE_KEY")
-supabase: Client = create_client(url, key)
-
-def fetch_user_locations():
-    response = (
-        supabase.table("user_locations")
-        .select("userId, location")
-        .execute()
-    )
-    if not response.data:
-        print("No user locations found.")
-        return {}
+def _location_map(rows):
     location_map = {}
-    for row in response.data:
-        geo = row["location"]
-        lon, lat = geo["coordinates"]
-        location_map[row["userId"]] = (lat, lon)  # Store as (lat, lon)
+    for loc in rows:
+        location_map[loc.user_id] = (loc.lat, loc.lon)  # Store as (lat, lon)
+    if not location_map:
+        print("No user locations found.")
     return location_map
 
-def fetch_user_tags():
-    response = (
-        supabase.table("_UserTags")
-        .select("A, B")
-        .execute()
-    )
-    if not response.data:
-        print("No user tags found.")
-        return {}
+def _tag_map(rows):
     tag_map = {}
-    for row in response.data:
-        tag_map.setdefault(row["B"], []).append(row["A"])
+    for row in rows:
+        tag_map.setdefault(row.user_id, []).append(row.tag_id)
+    if not tag_map:
+        print("No user tags found.")
     return tag_map
 
-def fetch_follower_counts():
-    resp = supabase.table("Follows").select("followingId").execute()
-    if not resp.data:
-        print("No follower data found.")
-        return {}
+def _follower_counts(rows):
     counts = {}
-    for row in resp.data:
-        uid = row["followingId"]
+    for follow in rows:
+        uid = follow.following_id
         counts[uid] = counts.get(uid, 0) + 1
+    if not counts:
+        print("No follower data found.")
     return counts
 
-def fetch_event_counts():
-    resp = supabase.table("Event").select("userId").execute()
-    if not resp.data:
-        print("No event data found.")
-        return {}
+def _event_counts(rows):
     counts = {}
-    for row in resp.data:
-        uid = row["userId"]
+    for event in rows:
+        uid = event.user_id
         counts[uid] = counts.get(uid, 0) + 1
+    if not counts:
+        print("No event data found.")
     return counts
 
-def fetch_liked_events_tags():
-    respEvents = supabase.table("_LikedEvents").select("B, A").execute()
-    if not respEvents.data:
+def _likers_index(rows):
+    # inverted index: event -> users who liked it
+    likers = {}
+    for like in rows:
+        likers.setdefault(like.event_id, []).append(like.user_id)
+    if not likers:
         print("No liked events data found.")
-        return {}
-    likes = {}
-    for row in respEvents.data:
-        likes.setdefault(row["B"], set()).add(row["A"])
-    respLikes = supabase.table("_EventTags").select("A, B").in_("A", [e for s in likes.values() for e in s]).execute()
-    liked_tags = {uid: set() for uid in likes}
-    for row in respLikes.data:
-        event_id = row["A"]
-        tag_id = row["B"]
-        for uid, events in likes.items():
-            if event_id in events:
-                liked_tags[uid].add(tag_id)
+    return likers
+
+def _liked_tags(likers, event_tag_rows):
+    liked_tags = {uid: set() for users in likers.values() for uid in users}
+    for row in event_tag_rows:
+        for uid in likers[row.event_id]:
+            liked_tags[uid].add(row.tag_id)
     return liked_tags
 
+def fetch_user_locations():
+    return _location_map(iter_user_locations())
+
+def fetch_user_tags():
+    return _tag_map(iter_user_tags())
+
+def fetch_follower_counts():
+    return _follower_counts(iter_follows())
+
+def fetch_event_counts():
+    return _event_counts(iter_events())
+
+def fetch_liked_events_tags():
+    likers = _likers_index(iter_liked_events())
+    if not likers:
+        return {}
+    return _liked_tags(likers, iter_event_tags(likers))
+
+# async variants for the event loop; they parse rows exactly like the fetchers above
+async def afetch_user_locations():
+    return _location_map(await fetch_table_async("user_locations"))
+
+async def afetch_user_tags():
+    return _tag_map(await fetch_table_async("user_tags"))
+
+async def afetch_follower_counts():
+    return _follower_counts(await fetch_table_async("follows"))
+
+async def afetch_event_counts():
+    return _event_counts(await fetch_table_async("events"))
+
+async def afetch_liked_events_tags():
+    likers = _likers_index(await fetch_table_async("liked_events"))
+    if not likers:
+        return {}
+    return _liked_tags(likers, await fetch_event_tags_async(likers))
+
+# shared by the API and the optimizer so the tables are only scanned once per TTL
+feature_store = FeatureStore({
+    "locations": fetch_user_locations,
+    "tags": fetch_user_tags,
+    "follower_counts": fetch_follower_counts,
+    "event_counts": fetch_event_counts,
+    "liked_tags": fetch_liked_events_tags,
+}, async_loaders={
+    "locations": afetch_user_locations,
+    "tags": afetch_user_tags,
+    "follower_counts": afetch_follower_counts,
+    "event_counts": afetch_event_counts,
+    "liked_tags": afetch_liked_events_tags,
+})
+
+def adjust_follower_count(user_id: str, delta: int):
+    """
+    Update one user's follower count after a follow is added (+1) or removed (-1),
+    without rescanning the Follows table.
+    """
+    table = feature_store.adjust_count("follower_counts", user_id, delta)
+    if table is not None:
+        sync_cached_count("follower_counts", user_id, table)
+
 def ratio_score(a, b):
     """
     Calculate the ratio score between two values.
@@ -177,14 +213,15 @@ def preference_score(tags1, tags2, liked_tags1, liked_tags2):
     ret = max(0.0, min(1.0, ret))
     return ret
 
-def compute_features_for_user(user_id: str, candidates: list[str], dist_map: dict[str,int], max_distance: int = 4) -> pd.DataFrame:
+def compute_features_for_user(user_id: str, candidates: list[str], dist_map: dict[str,int], max_distance: int = 4, snapshot: FeatureSnapshot | None = None) -> pd.DataFrame:
     """
     Computes recommendation features for a user and a set of candidate users, based on social network, location, and preferences.
     For each candidate user, the following features are computed:
       1. **Friend score**: Weighted combination of network similarity (based on friend graph distance), follower count ratio, and event count ratio.
       2. **Location score**: Similarity based on geographical distance between users.
       3. **Preference score**: Similarity based on user tags and liked event tags.
-    Data such as user locations, tags, follower counts, event counts, and liked event tags are fetched from the database using helper functions.
+    Data such as user locations, tags, follower counts, event counts, and liked event tags are read from the shared `feature_store`,
+    which only goes back to the database when a table's TTL has expired.
     If `candidates` is empty or `user_id` is None, the function includes `user_id` in the candidates list.
     Parameters
     ----------
@@ -196,6 +233,9 @@ def compute_features_for_user(user_id: str, candidates: list[str], dist_map: dic
         Mapping from candidate user IDs to their distance from `user_id` in the friend network.
     max_distance : int, optional
         Maximum friend network distance to consider for similarity (default is 4).
+    snapshot : FeatureSnapshot, optional
+        Pinned view of the feature tables. Batch callers such as the optimizer pass one so every
+        user is scored against the same data; defaults to a fresh `feature_store.snapshot()`.
     Returns
     -------
     pd.DataFrame
@@ -205,7 +245,7 @@ def compute_features_for_user(user_id: str, candidates: list[str], dist_map: dic
             - 'preference_score'
     Notes
     -----
-    - Helper functions such as `fetch_user_locations`, `fetch_user_tags`, `fetch_follower_counts`, `fetch_event_counts`, and `fetch_liked_events_tags` must be available in the environment.
+    - The tables are loaded by `fetch_user_locations`, `fetch_user_tags`, `fetch_follower_counts`, `fetch_event_counts`, and `fetch_liked_events_tags` through the feature store.
     - The function uses alert dialogs for error handling and success notification.
     - If a required feature cannot be computed for a candidate, its value defaults to 0.
     Example
@@ -215,42 +255,7 @@ def compute_features_for_user(user_id: str, candidates: list[str], dist_map: dic
     if user_id is None or not candidates:
         candidates = [user_id] + candidates
     
-    location_map = fetch_user_locations()
-    tag_map = fetch_user_tags()
-    follower_counts = fetch_follower_counts()
-    event_counts = fetch_event_counts()
-    liked_tags = fetch_liked_events_tags()
-
-    rows ={}
-
-    for candidate in candidates:
-
-        # get network similarity score
-        d = dist_map.get(candidate, max_distance + 1)
-        bfs = 0 if d < 2 or d > max_distance else 1 - (d / max_distance)
-        follower_score = ratio_score(follower_counts.get(user_id, 0), follower_counts.get(candidate, 0))
-        event_score = ratio_score(event_counts.get(user_id, 0), event_counts.get(candidate, 0))
-        friend_score = 0.7 * bfs + 0.15 * follower_score + 0.15 * event_score
-
-        # get location score
-        loc1 = location_map.get(user_id)
-        loc2 = location_map.get(candidate)
-        loc_score = location_score(loc1, loc2) if loc1 and loc2 else 0
-
-        # get preference score
-        tags1 = tag_map.get(user_id, [])
-        tags2 = tag_map.get(candidate, [])
-        liked_tags1 = liked_tags.get(user_id, set())
-        liked_tags2 = liked_tags.get(candidate, set())
-        pref_score = preference_score(tags1, tags2, liked_tags1, liked_tags2)
-
-        rows[candidate] = {
-            "friend_score": friend_score,
-            "location_score": loc_score,
-            "preference_score": pref_score
-        }
-    df = pd.DataFrame.from_dict(rows, orient='index')
-    for col in ["friend_score", "location_score", "preference_score"]:
-        if col not in df.columns:
-            df[col] = 0.0
-    return df
\ No newline at end of file
+    if snapshot is None:
+        snapshot = feature_store.snapshot()
+    engine = get_engine(snapshot)
+    return engine.features_frame(user_id, candidates, dist_map, max_distance)
@@ -0,0 +1,137 @@
+'''
+Parallel, cached feature extraction for the weight optimizer.
+Features for every test user are computed from one graph and feature snapshot,
+fanned out across a process pool, and saved to an .npz file keyed by a hash of the
+inputs so reruns with a different --k or --step skip extraction entirely.
+'''
+
+import hashlib
+import os
+from multiprocessing import Pool
+import numpy as np
+import pandas as pd
+from graph import CompactGraph
+from feature_store import FeatureSnapshot
+from scoring_engine import FEATURE_COLUMNS, get_engine
+from candidate_retrieval import retrieve_candidates
+
+CACHE_FORMAT = 1
+
+# per-worker state, set once by _init_worker
+_graph = None
+_snapshot = None
+_max_distance = None
+_max_candidates = None
+
+def _init_worker(graph, snapshot, max_distance, max_candidates=None):
+    global _graph, _snapshot, _max_distance, _max_candidates
+    _graph, _snapshot, _max_distance, _max_candidates = graph, snapshot, max_distance, max_candidates
+    # forked workers inherit the parent's engine and its arrays; others build their own once
+    get_engine(snapshot)
+
+def _features_for(user):
+    source = _graph.index[user]
+    rows, depths = _graph.bfs_rows(source, _max_distance)
+    dist_map = {_graph.ids[r]: int(d) for r, d in zip(rows.tolist(), depths.tolist())}
+    engine = get_engine(_snapshot)
+    if _max_candidates:
+        candidates = retrieve_candidates(_graph, engine, user, dist_map, _max_candidates, _max_distance)
+        cand_rows = np.fromiter((_graph.index[c] for c in candidates), dtype=np.int32, count=len(candidates))
+    else:
+        # candidates = everyone except user and direct friends
+        excluded = np.zeros(_graph.number_of_nodes(), dtype=bool)
+        excluded[rows[depths <= 1]] = True
+        cand_rows = np.flatnonzero(~excluded).astype(np.int32)
+        candidates = [_graph.ids[r] for r in cand_rows]
+    features = engine.feature_matrix(user, candidates, dist_map, _max_distance)
+    return user, cand_rows, features
+
+def compute_features(graph: CompactGraph, snapshot: FeatureSnapshot, users: list[str], max_distance: int = 4, workers: int = 1,
+                     max_candidates: int | None = None):
+    """
+    Return `{user: (candidate_rows, feature_matrix)}` for every user, where candidate rows
+    index `graph.ids` and the matrix columns follow FEATURE_COLUMNS.
+    With `max_candidates`, only the users picked by `retrieve_candidates` are scored.
+    """
+    results = {}
+    if workers <= 1:
+        _init_worker(graph, snapshot, max_distance, max_candidates)
+        for user in users:
+            user, cand_rows, features = _features_for(user)
+            results[user] = (cand_rows, features)
+        return results
+    # build the engine before forking so workers share its arrays
+    get_engine(snapshot)
+    with Pool(workers, initializer=_init_worker, initargs=(graph, snapshot, max_distance, max_candidates)) as pool:
+        for user, cand_rows, features in pool.imap_unordered(_features_for, users, chunksize=8):
+            results[user] = (cand_rows, features)
+    return results
+
+def to_frames(graph_ids: list[str], results) -> dict[str, pd.DataFrame]:
+    """
+    Wrap `compute_features` output in the DataFrames the optimizer works with.
+    """
+    return {
+        user: pd.DataFrame(features, index=[graph_ids[r] for r in cand_rows], columns=FEATURE_COLUMNS)
+        for user, (cand_rows, features) in results.items()
+    }
+
+def _update_with_table(h, table: dict):
+    for key in sorted(table, key=str):
+        value = table[key]
+        if isinstance(value, (set, frozenset, list)):
+            value = sorted(value, key=str)
+        h.update(f"{key}={value!r};".encode())
+
+def snapshot_hash(train_edges, test_by_user, snapshot: FeatureSnapshot, max_distance: int, max_candidates: int | None = None) -> str:
+    """
+    Hash of everything the extracted features depend on.
+    """
+    h = hashlib.sha256(f"v{CACHE_FORMAT};d{max_distance};".encode())
+    if max_candidates:
+        h.update(f"c{max_candidates};".encode())
+    for u, v in sorted(train_edges):
+        h.update(f"{u}>{v};".encode())
+    h.update(b"|test|")
+    _update_with_table(h, test_by_user)
+    for table in snapshot[:-1]:
+        h.update(b"|table|")
+        _update_with_table(h, table)
+    return h.hexdigest()[:16]
+
+def cache_path(cache_dir: str, key: str) -> str:
+    return os.path.join(cache_dir, f"features-{key}.npz")
+
+def save(path: str, graph_ids: list[str], results):
+    """
+    Write `compute_features` output to an .npz file.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    users = list(results)
+    sizes = [len(results[u][0]) for u in users]
+    tmp = path + ".tmp.npz"
+    np.savez(
+        tmp,
+        graph_ids=np.array(graph_ids, dtype=str),
+        users=np.array(users, dtype=str),
+        user_ptr=np.concatenate(([0], np.cumsum(sizes))).astype(np.int64),
+        cand_rows=np.concatenate([results[u][0] for u in users]) if users else np.zeros(0, dtype=np.int32),
+        features=np.concatenate([results[u][1] for u in users]) if users else np.zeros((0, len(FEATURE_COLUMNS))),
+    )
+    os.replace(tmp, path)
+
+def load(path: str):
+    """
+    Read a file written by `save`, returning `(graph_ids, results)`.
+    """
+    with np.load(path) as data:
+        graph_ids = data["graph_ids"].tolist()
+        users = data["users"].tolist()
+        ptr = data["user_ptr"]
+        cand_rows = data["cand_rows"]
+        features = data["features"]
+    results = {
+        user: (cand_rows[ptr[i]:ptr[i + 1]], features[ptr[i]:ptr[i + 1]])
+        for i, user in enumerate(users)
+    }
+    return graph_ids, results
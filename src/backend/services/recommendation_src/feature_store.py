@@ -0,0 +1,238 @@
+'''
+Process-wide feature store for the recommendation service.
+Keeps the lookup tables used by feature extraction (locations, tags, follower counts,
+event counts and liked event tags) in memory so they are fetched once per TTL
+instead of once per request.
+'''
+
+import asyncio
+import os
+import threading
+import time
+from collections.abc import Mapping
+from typing import Awaitable, Callable, NamedTuple
+from metrics import timer
+
+DEFAULT_TTL = float(os.getenv("FEATURE_STORE_TTL", "300"))
+
+class FeatureSnapshot(NamedTuple):
+    """
+    Consistent view of every feature table at one point in time.
+    `version` changes whenever any of the tables is reloaded or updated.
+    """
+    locations: dict
+    tags: dict
+    follower_counts: dict
+    event_counts: dict
+    liked_tags: dict
+    version: int
+
+class CountTable(Mapping):
+    """
+    A count table as loaded (`base`, never modified) with `adjust_count`'s updates layered over it.
+    Updates are made by `updated`, which returns a new CountTable sharing `base` and holding a copy
+    of the overlay, so a table already handed out in a snapshot never changes. The copy is only as
+    large as the number of keys updated since the table was loaded.
+    """
+    def __init__(self, base: Mapping, overlay: dict | None = None):
+        self.base = base
+        self._overlay = overlay or {}
+
+    def updated(self, key, value) -> "CountTable":
+        overlay = dict(self._overlay)
+        overlay[key] = value
+        return CountTable(self.base, overlay)
+
+    def __getitem__(self, key):
+        if key in self._overlay:
+            return self._overlay[key]
+        return self.base[key]
+
+    def __contains__(self, key) -> bool:
+        return key in self._overlay or key in self.base
+
+    def __iter__(self):
+        overlay = self._overlay
+        for key in self.base:
+            if key not in overlay:
+                yield key
+        yield from overlay
+
+    def __len__(self) -> int:
+        return len(self.base) + sum(1 for key in self._overlay if key not in self.base)
+
+def base_table(table: Mapping) -> Mapping:
+    """
+    The table as loaded, before any `adjust_count` updates.
+    """
+    return table.base if isinstance(table, CountTable) else table
+
+class FeatureStore:
+    """
+    In-memory cache of the feature tables.
+    Each table is loaded lazily on first access and reloaded independently once its
+    TTL has elapsed, so a refresh only re-reads the tables that are actually stale.
+    Tables installed by `seed` never go stale.
+    Every reload or count update bumps `version`, which callers can use to key
+    any state derived from the tables. `reloads` only counts whole-table loads, for state
+    that can follow count updates itself but not a fresh read of the tables.
+    """
+    def __init__(self, loaders: dict[str, Callable[[], dict]], ttl: float = DEFAULT_TTL,
+                 async_loaders: dict[str, Callable[[], Awaitable[dict]]] | None = None):
+        self._loaders = dict(loaders)
+        self._async_loaders = dict(async_loaders or {})
+        self._async_lock = None
+        self.ttl = ttl
+        self._data = {}
+        self._loaded_at = {}
+        # tables installed by seed(), which do not expire
+        self._seeded = set()
+        self._lock = threading.RLock()
+        self.version = 0
+        self.reloads = 0
+
+    def _is_stale(self, name: str) -> bool:
+        loaded_at = self._loaded_at.get(name)
+        if loaded_at is None:
+            return True
+        if name in self._seeded:
+            return False
+        return self.ttl is not None and time.monotonic() - loaded_at > self.ttl
+
+    def _load(self, name: str):
+        with timer(f"fetch_{name}"):
+            self._data[name] = self._loaders[name]()
+        self._loaded_at[name] = time.monotonic()
+        self._seeded.discard(name)
+        self.version += 1
+        self.reloads += 1
+
+    def get(self, name: str) -> dict:
+        """
+        Return the table `name`, reloading it first if it is missing or stale.
+        """
+        with self._lock:
+            if self._is_stale(name):
+                self._load(name)
+            return self._data[name]
+
+    def set(self, name: str, value: dict):
+        """
+        Replace the table `name` in place, e.g. after applying an incremental update.
+        """
+        with self._lock:
+            self._data[name] = value
+            self._loaded_at[name] = time.monotonic()
+            self._seeded.discard(name)
+            self.version += 1
+            self.reloads += 1
+
+    def seed(self, snapshot: FeatureSnapshot):
+        """
+        Install every table from `snapshot` (e.g. one read from a binary snapshot file).
+        Seeded tables do not expire: they are kept, with count updates applied, until they are
+        invalidated or seeded again from a newer snapshot.
+        """
+        with self._lock:
+            for name in self._loaders:
+                self._data[name] = getattr(snapshot, name)
+                self._loaded_at[name] = time.monotonic()
+                self._seeded.add(name)
+            self.version += 1
+            self.reloads += 1
+
+    def adjust_count(self, name: str, key: str, delta: int) -> Mapping | None:
+        """
+        Apply `delta` to one entry of a count table and return the table now installed.
+        The table is replaced by a CountTable with the new value rather than changed in place,
+        so snapshots already handed out keep the counts they were taken with.
+        A table that is not loaded yet is left alone; its first load reads the change from the database.
+        """
+        with self._lock:
+            table = self._data.get(name)
+            if table is None:
+                return None
+            if not isinstance(table, CountTable):
+                table = CountTable(table)
+            table = table.updated(key, max(0, table.get(key, 0) + delta))
+            self._data[name] = table
+            self.version += 1
+            return table
+
+    def refresh(self, force: bool = False):
+        """
+        Reload every stale table, or every table if `force` is set.
+        """
+        with self._lock:
+            for name in self._loaders:
+                if force or self._is_stale(name):
+                    self._load(name)
+
+    def invalidate(self, name: str | None = None):
+        """
+        Mark one table, or all of them, as stale so the next access reloads it.
+        """
+        with self._lock:
+            if name is None:
+                self._loaded_at.clear()
+            else:
+                self._loaded_at.pop(name, None)
+
+    def _assemble(self) -> FeatureSnapshot:
+        # caller holds self._lock
+        return FeatureSnapshot(
+            locations=self._data["locations"],
+            tags=self._data["tags"],
+            follower_counts=self._data["follower_counts"],
+            event_counts=self._data["event_counts"],
+            liked_tags=self._data["liked_tags"],
+            version=self.version,
+        )
+
+    def snapshot(self) -> FeatureSnapshot:
+        """
+        Return all tables at once, refreshing stale ones first.
+        """
+        with self._lock:
+            self.refresh()
+            return self._assemble()
+
+    async def _with_lock(self, fn: Callable):
+        """
+        Run `fn()` holding `self._lock` without blocking the event loop. The lock is taken
+        inline when it is free; when a sync caller holds it (possibly for a whole Supabase
+        reload), the wait happens in a worker thread instead.
+        """
+        if self._lock.acquire(blocking=False):
+            try:
+                return fn()
+            finally:
+                self._lock.release()
+        def locked():
+            with self._lock:
+                return fn()
+        return await asyncio.to_thread(locked)
+
+    async def asnapshot(self) -> FeatureSnapshot:
+        """
+        Async `snapshot()`: stale tables are fetched concurrently with the async loaders
+        without blocking the event loop. Tables without an async loader are loaded in a thread.
+        """
+        if self._async_lock is None:
+            self._async_lock = asyncio.Lock()
+        # one refresh at a time; callers queued behind it find the tables fresh
+        async with self._async_lock:
+            stale = await self._with_lock(lambda: [name for name in self._loaders if self._is_stale(name)])
+            if stale:
+                async def load(name):
+                    with timer(f"fetch_{name}"):
+                        if name in self._async_loaders:
+                            return await self._async_loaders[name]()
+                        return await asyncio.to_thread(self._loaders[name])
+                tables = await asyncio.gather(*(load(name) for name in stale))
+                def install():
+                    for name, table in zip(stale, tables):
+                        self.set(name, table)
+                await self._with_lock(install)
+        # every table was fresh or just loaded, so assemble without the sync refresh
+        return await self._with_lock(self._assemble)
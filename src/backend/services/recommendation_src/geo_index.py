@@ -0,0 +1,71 @@
+'''
+Spatial index for radius queries on user locations.
+Points are placed on the unit sphere and bucketed into a uniform 3D grid whose cell
+size equals the chord length of the query radius, so every point within the radius
+of a query lies in one of the 27 cells around it.
+'''
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0
+
+def to_unit_vectors(lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+    """
+    Convert latitude/longitude in radians to (n, 3) unit vectors.
+    """
+    cos_lat = np.cos(lat)
+    return np.column_stack((cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)))
+
+def haversine_km(lat1: float, lon1: float, lat2: np.ndarray, lon2: np.ndarray) -> np.ndarray:
+    """
+    Vectorized Haversine distance in kilometers from one point to many, all in radians.
+    """
+    a = (np.sin((lat2 - lat1) / 2) ** 2 +
+         np.cos(lat1) * np.cos(lat2) *
+         np.sin((lon2 - lon1) / 2) ** 2)
+    return EARTH_RADIUS_KM * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+class SphereGrid:
+    """
+    Grid index over points on the sphere for a fixed query radius.
+    `ids` are the caller's identifiers for each point (e.g. user rows) and are what
+    `query` returns.
+    """
+    def __init__(self, lat: np.ndarray, lon: np.ndarray, ids: np.ndarray, radius_km: float):
+        self.radius_km = radius_km
+        # straight-line distance through the sphere for an arc of radius_km
+        self.cell = 2 * np.sin(min(radius_km / (2 * EARTH_RADIUS_KM), np.pi / 2))
+        self.base = int(np.ceil(2 / self.cell)) + 3
+
+        cells = self._cells(to_unit_vectors(lat, lon))
+        keys = self._keys(cells)
+        order = np.argsort(keys, kind="stable")
+        self.ids = np.asarray(ids)[order]
+        self.lat = np.asarray(lat)[order]
+        self.lon = np.asarray(lon)[order]
+        self.keys, starts = np.unique(keys[order], return_index=True)
+        self.ptr = np.append(starts, len(order))
+
+    def _cells(self, points: np.ndarray) -> np.ndarray:
+        return np.floor((points + 1) / self.cell).astype(np.int64) + 1
+
+    def _keys(self, cells: np.ndarray) -> np.ndarray:
+        return (cells[..., 0] * self.base + cells[..., 1]) * self.base + cells[..., 2]
+
+    def query(self, lat: float, lon: float) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Return `(ids, distances_km)` for every indexed point within the radius of (lat, lon).
+        """
+        if len(self.keys) == 0:
+            return np.empty(0, dtype=self.ids.dtype), np.empty(0)
+        center = self._cells(to_unit_vectors(np.array([lat]), np.array([lon])))[0]
+        offsets = np.array([(i, j, k) for i in (-1, 0, 1) for j in (-1, 0, 1) for k in (-1, 0, 1)])
+        wanted = self._keys(center + offsets)
+        pos = np.searchsorted(self.keys, wanted)
+        pos = pos[(pos < len(self.keys)) & (self.keys[np.minimum(pos, len(self.keys) - 1)] == wanted)]
+        if len(pos) == 0:
+            return np.empty(0, dtype=self.ids.dtype), np.empty(0)
+        hits = np.concatenate([np.arange(self.ptr[p], self.ptr[p + 1]) for p in pos])
+        dist_km = haversine_km(lat, lon, self.lat[hits], self.lon[hits])
+        inside = dist_km <= self.radius_km
+        return self.ids[hits][inside], dist_km[inside]
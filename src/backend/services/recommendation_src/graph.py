@@ -1,36 +1,276 @@
-import networkx as nx
-from supabase import create_client, Client
-from dotenv import load_dotenv
+import numpy as np
+import scipy.sparse as sp
+from data_access import iter_follows
+from metrics import observe
+from user_ids import take_ids
 
-load_dotenv()
+class CompactGraph:
+    """
+    Compact directed graph of user follows.
+    User IDs are interned to consecutive ints and out-edges are stored in CSR form
+    (`indptr`, `indices`) as NumPy arrays. New edges go into an append buffer that is
+    merged into the CSR arrays once it grows past `compact_threshold`; removed CSR
+    edges are tombstoned with -1 until the next compaction.
+    It mirrors the parts of the networkx.DiGraph API the services use.
+    """
+    def __init__(self, edges=(), compact_threshold: int = 4096):
+        self.ids = []
+        self.index = {}
+        self.indptr = np.zeros(1, dtype=np.int64)
+        self.indices = np.zeros(0, dtype=np.int32)
+        self.compact_threshold = compact_threshold
+        self._pending_src = []
+        self._pending_dst = []
+        self._pending = set()
+        self._removed = 0
+        self.add_edges_from(edges)
+
+    @classmethod
+    def from_csr(cls, ids: list[str], indptr: np.ndarray, indices: np.ndarray, compact_threshold: int = 4096,
+                 index: dict[str, int] | None = None):
+        """
+        Wrap existing CSR arrays (e.g. memory-mapped from a snapshot) without copying them.
+        With `index` (e.g. a snapshot's UserIds and UserIndex), `ids` and `index` are used as
+        they are and the graph appends new users to them; otherwise `ids` is copied and indexed.
+        """
+        graph = cls.__new__(cls)
+        if index is None:
+            graph.ids = list(ids)
+            graph.index = {uid: i for i, uid in enumerate(graph.ids)}
+        else:
+            graph.ids = ids
+            graph.index = index
+        graph.indptr = indptr
+        graph.indices = indices
+        graph.compact_threshold = compact_threshold
+        graph._pending_src = []
+        graph._pending_dst = []
+        graph._pending = set()
+        graph._removed = 0
+        return graph
+
+    def intern(self, user_id: str) -> int:
+        """
+        Return the int for `user_id`, adding it as a node if it is new.
+        """
+        i = self.index.get(user_id)
+        if i is None:
+            i = len(self.ids)
+            self.index[user_id] = i
+            self.ids.append(user_id)
+        return i
+
+    def add_node(self, user_id: str):
+        self.intern(user_id)
+
+    def _in_csr(self, u: int, v: int) -> bool:
+        if u + 1 >= len(self.indptr):
+            return False
+        return bool(np.any(self.indices[self.indptr[u]:self.indptr[u + 1]] == v))
+
+    def has_edge(self, follower: str, following: str) -> bool:
+        u, v = self.index.get(follower), self.index.get(following)
+        if u is None or v is None:
+            return False
+        return (u, v) in self._pending or self._in_csr(u, v)
+
+    def add_edge(self, follower: str, following: str) -> bool:
+        """
+        Add a follow, returning False if it already existed.
+        """
+        u, v = self.intern(follower), self.intern(following)
+        if (u, v) in self._pending or self._in_csr(u, v):
+            return False
+        self._pending.add((u, v))
+        self._pending_src.append(u)
+        self._pending_dst.append(v)
+        if len(self._pending) + self._removed >= self.compact_threshold:
+            self.compact()
+        return True
+
+    def remove_edge(self, follower: str, following: str) -> bool:
+        """
+        Remove a follow, returning False if it did not exist.
+        """
+        u, v = self.index.get(follower), self.index.get(following)
+        if u is None or v is None:
+            return False
+        if (u, v) in self._pending:
+            self._pending.discard((u, v))
+            for i, (src, dst) in enumerate(zip(self._pending_src, self._pending_dst)):
+                if src == u and dst == v:
+                    del self._pending_src[i], self._pending_dst[i]
+                    break
+            return True
+        if u + 1 >= len(self.indptr):
+            return False
+        start = self.indptr[u]
+        hits = np.flatnonzero(self.indices[start:self.indptr[u + 1]] == v)
+        if len(hits) == 0:
+            return False
+        self.indices[start + hits[0]] = -1
+        self._removed += 1
+        if len(self._pending) + self._removed >= self.compact_threshold:
+            self.compact()
+        return True
+
+    def add_edges_from(self, edges):
+        # bulk loads skip the per-edge checks and let compact() deduplicate
+        for follower, following in edges:
+            u, v = self.intern(follower), self.intern(following)
+            self._pending_src.append(u)
+            self._pending_dst.append(v)
+        self.compact()
 
-url: str = os.getenv("SUPABASE_URL")
-key: str = os.getenv("SUPABASE_KEY")
+    def compact(self):
+        """
+        Merge the append buffer into the CSR arrays.
+        """
+        n = len(self.ids)
+        old_rows = np.repeat(np.arange(len(self.indptr) - 1), np.diff(self.indptr))
+        src = np.concatenate((old_rows, np.asarray(self._pending_src, dtype=np.int64)))
+        dst = np.concatenate((self.indices.astype(np.int64), np.asarray(self._pending_dst, dtype=np.int64)))
+        live = dst >= 0
+        src, dst = src[live], dst[live]
+        # unique edge keys come back sorted by (src, dst)
+        keys = np.unique(src * max(n, 1) + dst)
+        src, dst = keys // max(n, 1), keys % max(n, 1)
+        self.indptr = np.concatenate(([0], np.cumsum(np.bincount(src, minlength=n)))).astype(np.int64)
+        self.indices = dst.astype(np.int32)
+        self._pending_src, self._pending_dst = [], []
+        self._pending = set()
+        self._removed = 0
 
-if not url or not key:
-    print("Error: SUPABASE_URL and/or SUPABASE_KEY environment variables are not set.")
-    exit(1)
+    def __contains__(self, user_id: str) -> bool:
+        return user_id in self.index
 
-supabase: Client = create_client(url, key)
+    def nodes(self) -> list[str]:
+        return self.ids
 
-class FollowGraph:
+    def number_of_nodes(self) -> int:
+        return len(self.ids)
+
+    def number_of_edges(self) -> int:
+        return len(self.indices) - self._removed + len(self._pending_src)
+
+    def _neighbors(self, frontier: np.ndarray) -> np.ndarray:
+        """
+        All out-neighbours of the nodes in `frontier`, with repeats.
+        """
+        # nodes interned since the last compaction have no CSR row yet
+        in_csr = frontier[frontier < len(self.indptr) - 1]
+        starts = self.indptr[in_csr]
+        lengths = self.indptr[in_csr + 1] - starts
+        total = int(lengths.sum())
+        # gather every CSR slice at once: offset each run by its start
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        nbrs = self.indices[offsets + np.arange(total)]
+        if self._removed:
+            nbrs = nbrs[nbrs >= 0]
+        if self._pending_src:
+            pending_src = np.asarray(self._pending_src)
+            nbrs = np.concatenate((nbrs, np.asarray(self._pending_dst)[np.isin(pending_src, frontier)]))
+        return nbrs
+
+    def bfs_rows(self, source: int, max_depth: int = 5) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Frontier-at-a-time BFS from node `source`.
+        Returns `(rows, depths)` for every node reached within `max_depth` hops.
+        """
+        depth = np.full(len(self.ids), -1, dtype=np.int16)
+        depth[source] = 0
+        frontier = np.array([source], dtype=np.int64)
+        reached = [frontier]
+        for d in range(1, max_depth + 1):
+            nbrs = self._neighbors(frontier)
+            nbrs = np.unique(nbrs[depth[nbrs] < 0])
+            if len(nbrs) == 0:
+                break
+            depth[nbrs] = d
+            reached.append(nbrs)
+            frontier = nbrs
+            observe("bfs_frontier_size", len(nbrs), depth=str(d))
+        rows = np.concatenate(reached)
+        observe("bfs_reached", len(rows))
+        return rows, depth[rows]
+
+    def adjacency(self) -> sp.csr_matrix:
+        """
+        The live edges (pending ones included, tombstones dropped) as an n x n sparse matrix.
+        The arrays are copied, so later graph changes do not leak into it.
+        """
+        n = len(self.ids)
+        # nodes interned since the last compaction get empty rows
+        indptr = np.concatenate((self.indptr, np.full(n + 1 - len(self.indptr), self.indptr[-1])))
+        indices = self.indices.copy()
+        if not self._removed and not self._pending_src:
+            return sp.csr_matrix((np.ones(len(indices), dtype=np.int32), indices, indptr), shape=(n, n))
+        src = np.repeat(np.arange(n), np.diff(indptr))
+        src = np.concatenate((src[indices >= 0], np.asarray(self._pending_src, dtype=np.int64)))
+        dst = np.concatenate((indices[indices >= 0], np.asarray(self._pending_dst, dtype=np.int64)))
+        return sp.csr_matrix((np.ones(len(src), dtype=np.int32), (src, dst)), shape=(n, n))
+
+    def multi_source_bfs(self, sources: np.ndarray, max_depth: int = 5, adjacency: sp.csr_matrix | None = None) -> np.ndarray:
+        """
+        Bounded BFS from every node in `sources` at once.
+        Returns a (len(sources), n) int8 array with the hop distance of every node reached from
+        each source within `max_depth` hops, and 0 for nodes not reached (and the source itself).
+        Negative sources stand for users outside the graph and get an all-zero row.
+        The frontiers of all sources are packed as bits, 64 sources per uint64 word, so each
+        level is one boolean sparse product: OR-reduce the frontier words of every node's
+        in-neighbours. A pass over the edges thereby advances 64 searches at once.
+        """
+        if adjacency is None:
+            adjacency = self.adjacency()
+        n = adjacency.shape[0]
+        sources = np.asarray(sources, dtype=np.int64)
+        # built node-major so each level's bits unpack straight into it
+        depths = np.zeros((n, len(sources)), dtype=np.int8)
+        valid = np.flatnonzero((sources >= 0) & (sources < n))
+        if len(valid) == 0 or n == 0:
+            return np.ascontiguousarray(depths.T)
+        incoming = adjacency.T.tocsr()
+        has_in = np.diff(incoming.indptr) > 0
+        starts = incoming.indptr[:-1][has_in]
+        words = (len(sources) + 63) // 64
+        frontier = np.zeros((n, words), dtype=np.uint64)
+        np.bitwise_or.at(frontier, (sources[valid], valid // 64), np.left_shift(np.uint64(1), (valid % 64).astype(np.uint64)))
+        seen = frontier.copy()
+        for d in range(1, max_depth + 1):
+            reached = np.zeros_like(frontier)
+            if len(starts):
+                reached[has_in] = np.bitwise_or.reduceat(frontier[incoming.indices], starts, axis=0)
+            reached &= ~seen
+            if not reached.any():
+                break
+            seen |= reached
+            frontier = reached
+            # (n, words) bit words -> (n, sources) 0/1 bytes, little-endian within each word
+            hit = np.unpackbits(reached.astype("<u8", copy=False).view(np.uint8), axis=1, bitorder="little")[:, :len(sources)]
+            hit *= np.uint8(d)
+            depths += hit.view(np.int8)
+            observe("bfs_frontier_size", int(np.count_nonzero(hit)) / len(valid), depth=str(d))
+        return np.ascontiguousarray(depths.T)
+
+    def bfs_distances(self, user_id: str, max_depth: int = 5) -> dict[str, int]:
+        """
+        Hop distance from `user_id` to every user within `max_depth`, including itself at 0.
+        """
+        source = self.index.get(user_id)
+        if source is None:
+            return {user_id: 0}
+        rows, depths = self.bfs_rows(source, max_depth)
+        return dict(zip(take_ids(self.ids, rows), depths.tolist()))
+
+class FollowGraph(CompactGraph):
     """
     A directed graph representing user follows.
     This graph is used to compute distances and relationships between users.
     It is initialized with data from the Supabase database.
     """
     def __init__(self):
-        self.graph = nx.DiGraph()
+        super().__init__()
         self.load_all()
 
     def load_all(self):
-        resp = supabase.table("Follows").select("followerId, followingId").execute()
-        for {"follower_id": follower_id, "followed_id": followed_id} in resp.data:
-            self.graph.add_edge(follower_id, followed_id)
-
-    def add_edge(self, follower : str, following: str):
-        self.graph.add_edge(follower, following)
-
-    def bfs_distances(self, user_id: str, max_depth: int = 5):
-        distances = nx.single_source_shortest_path_length(self.graph, user_id, cutoff=max_depth)
-        return distances
\ No newline at end of file
+        self.add_edges_from((follow.follower_id, follow.following_id) for follow in iter_follows())
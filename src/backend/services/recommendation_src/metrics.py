@@ -0,0 +1,189 @@
+'''
+In-process metrics for the recommendation service.
+Stages time themselves with `timer`, sizes go through `observe` and totals through `count`.
+Everything lands in one registry rendered in the Prometheus text format at /metrics, and
+requests that opened a `trace` also get their own per-stage breakdown (`?debug=timings`).
+'''
+
+import contextvars
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+SECONDS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1, 10, 100, 1000, 10000, 100000, 1000000)
+
+# name -> (type, help, buckets); metrics not listed here are untyped counters or gauges
+METRICS = {
+    "recommendation_requests_total": ("counter", "Recommendation requests served, by endpoint.", None),
+    "recommendation_request_seconds": ("histogram", "End-to-end recommendation latency, by endpoint.", SECONDS_BUCKETS),
+    "recommendation_batch_users_total": ("counter", "Users scored through the batch endpoint.", None),
+    "recommendation_stage_seconds": ("histogram", "Time spent in each recommendation stage.", SECONDS_BUCKETS),
+    "recommendation_candidates": ("histogram", "Candidates passed to full scoring, by source.", SIZE_BUCKETS),
+    "bfs_frontier_size": ("histogram", "Nodes discovered at each BFS depth.", SIZE_BUCKETS),
+    "bfs_reached": ("histogram", "Nodes reached by one bounded BFS.", SIZE_BUCKETS),
+    "bfs_cache_requests_total": ("counter", "BFS cache lookups, by result.", None),
+    "supabase_requests_total": ("counter", "Supabase page requests, by table.", None),
+    "supabase_rows_fetched_total": ("counter", "Rows read from Supabase, by table.", None),
+    "result_cache_requests_total": ("counter", "Recommendation result cache lookups, by result.", None),
+    "result_cache_evictions_total": ("counter", "Result cache entries dropped, by reason.", None),
+    "result_cache_entries": ("gauge", "Entries currently in the recommendation result cache.", None),
+}
+
+def _key(labels: dict) -> tuple:
+    return tuple(sorted(labels.items()))
+
+def _format_labels(labels: tuple, extra: tuple = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+class Metrics:
+    """
+    Thread-safe registry of labelled counters, gauges and histograms.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: dict[str, dict[tuple, float]] = {}
+        self._gauges: dict[str, dict[tuple, float]] = {}
+        # name -> labels -> [bucket counts..., sum, count]
+        self._histograms: dict[str, dict[tuple, list]] = {}
+
+    def count(self, name: str, value: float = 1, **labels):
+        key = _key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def set_gauge(self, name: str, value: float, **labels):
+        with self._lock:
+            self._gauges.setdefault(name, {})[_key(labels)] = value
+
+    def observe(self, name: str, value: float, **labels):
+        buckets = METRICS[name][2]
+        key = _key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            state = series.get(key)
+            if state is None:
+                state = series[key] = [0] * (len(buckets) + 2)
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    def render(self) -> str:
+        """
+        All metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        with self._lock:
+            counters = {name: dict(series) for name, series in self._counters.items()}
+            gauges = {name: dict(series) for name, series in self._gauges.items()}
+            histograms = {name: {k: list(v) for k, v in series.items()} for name, series in self._histograms.items()}
+        for kind, metrics in (("counter", counters), ("gauge", gauges)):
+            for name in sorted(metrics):
+                _, help_text, _ = METRICS.get(name, (kind, "", None))
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in sorted(metrics[name].items()):
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        for name in sorted(histograms):
+            _, help_text, buckets = METRICS[name]
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} histogram")
+            for labels, state in sorted(histograms[name].items()):
+                cumulative = 0
+                for bound, n in zip(buckets + (math.inf,), state[:-2] + [state[-1] - sum(state[:-2])]):
+                    cumulative += n
+                    lines.append(f"{name}_bucket{_format_labels(labels, (('le', _format_value(bound)),))} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(state[-2])}")
+                lines.append(f"{name}_count{_format_labels(labels)} {state[-1]}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._histograms.clear()
+
+registry = Metrics()
+
+class Trace:
+    """
+    Per-request breakdown: total seconds per stage and the sizes observed along the way.
+    """
+    def __init__(self):
+        self.timings: dict[str, float] = {}
+        self.counts: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def add_time(self, stage: str, seconds: float):
+        with self._lock:
+            self.timings[stage] = self.timings.get(stage, 0.0) + seconds
+
+    def add_count(self, name: str, value: float):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + value
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {"timings_ms": {stage: round(s * 1000, 3) for stage, s in self.timings.items()},
+                    "counts": dict(self.counts)}
+
+_trace: contextvars.ContextVar[Trace | None] = contextvars.ContextVar("recommendation_trace", default=None)
+
+@contextmanager
+def trace():
+    """
+    Collect a Trace of every stage run in this context (and in contexts copied from it).
+    """
+    t = Trace()
+    token = _trace.set(t)
+    try:
+        yield t
+    finally:
+        _trace.reset(token)
+
+@contextmanager
+def timer(stage: str):
+    """
+    Time the block into `recommendation_stage_seconds{stage=...}` and the current trace.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        registry.observe("recommendation_stage_seconds", elapsed, stage=stage)
+        t = _trace.get()
+        if t is not None:
+            t.add_time(stage, elapsed)
+
+def count(name: str, value: float = 1, **labels):
+    registry.count(name, value, **labels)
+    t = _trace.get()
+    if t is not None:
+        t.add_count(name + "".join(f"[{v}]" for _, v in _key(labels)), value)
+
+def observe(name: str, value: float, **labels):
+    registry.observe(name, value, **labels)
+    t = _trace.get()
+    if t is not None:
+        t.add_count(name + "".join(f"[{v}]" for _, v in _key(labels)), value)
+
+def set_gauge(name: str, value: float, **labels):
+    registry.set_gauge(name, value, **labels)
+
+def render() -> str:
+    return registry.render()
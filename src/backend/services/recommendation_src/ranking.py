@@ -0,0 +1,53 @@
+'''
+Ranking helpers shared by the online recommender and the offline optimizer.
+Scores are a single dot product between a contiguous feature matrix and a weight
+vector, and the top k are selected with argpartition instead of a full sort.
+'''
+
+import heapq
+from typing import Iterable
+import numpy as np
+from scoring_engine import FEATURE_COLUMNS
+
+def weight_vector(weights: dict[str, float], columns: list[str] = FEATURE_COLUMNS) -> np.ndarray:
+    """
+    Align a {feature: weight} dict with the feature matrix columns.
+    Features without a weight count as 0 and unknown keys are ignored.
+    """
+    return np.array([float(weights.get(column, 0.0)) for column in columns])
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Indices of the `k` highest scores, best first. Ties go to the lower index, both in the
+    order of the result and in which tied scores make the cut at position k, so the result
+    matches heapq.nlargest over the scores and streaming_top_k over any split into blocks.
+    """
+    n = len(scores)
+    if k <= 0 or n == 0:
+        return np.empty(0, dtype=np.int64)
+    if n > k:
+        # only partially sorts the array to find the k-th highest score
+        kth = scores[np.argpartition(scores, n - k)[n - k]]
+        above = np.flatnonzero(scores > kth)
+        idx = np.concatenate((above, np.flatnonzero(scores == kth)[:k - len(above)]))
+    else:
+        idx = np.arange(n)
+    return idx[np.lexsort((idx, -scores[idx]))]
+
+def streaming_top_k(blocks: Iterable[tuple[list, np.ndarray]], k: int) -> list[tuple[object, float]]:
+    """
+    Top `k` `(id, score)` pairs over `(ids, scores)` blocks, best first.
+    Only the current block and a k-sized heap are held in memory at a time.
+    """
+    heap = []
+    position = 0
+    for ids, scores in blocks:
+        for i in top_k_indices(scores, k):
+            # earlier positions win ties, as within top_k_indices
+            item = (float(scores[i]), -(position + int(i)), ids[i])
+            if len(heap) < k:
+                heapq.heappush(heap, item)
+            elif item > heap[0]:
+                heapq.heapreplace(heap, item)
+        position += len(scores)
+    return [(uid, score) for score, _, uid in sorted(heap, reverse=True)]
@@ -3,30 +3,107 @@ Recommender module for generating user recommendations based on location, prefer
 This module uses a scoring system to rank users based on their features and returns the top K recommendations.
 '''
 
-from feature_extraction import compute_features_for_user
-import json
-
-with open("weights.json", "r") as f:
-    WEIGHTS = json.load(f)
-    if WEIGHTS is None:
-        WEIGHTS = {
-            "location_score": 0.5,
-            "preference_score": 0.3,
-            "friend_score": 0.2
-        }
+import os
+from itertools import islice
+import numpy as np
+import scipy.sparse as sp
+from feature_extraction import feature_store
+from graph import CompactGraph
+from scoring_engine import get_engine
+from ranking import weight_vector, top_k_indices, streaming_top_k
+from metrics import timer
+from weights_store import weights_store
+from user_ids import lookup_rows
+
+# users x candidates cells scored per block by the batch path (8 bytes each)
+BATCH_CELLS = int(os.getenv("RECOMMENDATION_BATCH_CELLS", "4000000"))
 
 def score_features(features):
     loc_score, pref_score, friend_score = features
+    weights = weights_store.get().values
     return (
-        WEIGHTS["location_score"] * loc_score +
-        WEIGHTS["preference_score"] * pref_score +
-        WEIGHTS["friend_score"] * friend_score
+        weights["location_score"] * loc_score +
+        weights["preference_score"] * pref_score +
+        weights["friend_score"] * friend_score
     )
 
-def get_top_k_recommendations_for_user(user_id, dist_map, candidates, weights, k):
-    df = compute_features_for_user(user_id, candidates, dist_map)
-    df['score'] = 0
-    for feature, weight in weights.items():
-        df['score'] += df[feature] * weight
-    top = df['score'].nlargest(k)
-    return [(uid, float(score)) for uid, score in top.items()]
\ No newline at end of file
+def get_top_k_recommendations_for_user(user_id, dist_map, candidates, weights, k, snapshot=None, block_size=None):
+    """
+    Score candidates as one dot product of the feature matrix with the weight vector
+    and return the top k `(user_id, score)` pairs, best first.
+    With `block_size`, candidates are scored in blocks and only a k-sized heap is kept,
+    so memory stays O(k + block_size) however many candidates there are.
+    """
+    if user_id is None or not candidates:
+        candidates = [user_id] + candidates
+    candidates = list(dict.fromkeys(candidates))
+    if snapshot is None:
+        snapshot = feature_store.snapshot()
+    engine = get_engine(snapshot)
+    w = weight_vector(weights)
+
+    if block_size is None:
+        with timer("features"):
+            features = engine.feature_matrix(user_id, candidates, dist_map)
+        with timer("rank"):
+            scores = features @ w
+            return [(candidates[i], float(scores[i])) for i in top_k_indices(scores, k)]
+
+    def blocks():
+        for start in range(0, len(candidates), block_size):
+            block = candidates[start:start + block_size]
+            with timer("features"):
+                features = engine.feature_matrix(user_id, block, dist_map)
+            yield block, features @ w
+    return streaming_top_k(blocks(), k)
+
+def get_top_k_recommendations_for_users(graph: CompactGraph, user_ids: list[str], weights, k, snapshot=None,
+                                        adjacency: sp.csr_matrix | None = None, max_depth: int = 5,
+                                        max_distance: int = 4, max_cells: int = BATCH_CELLS) -> dict[str, list[tuple[str, float]]]:
+    """
+    Top k `(user_id, score)` pairs for each of `user_ids`, scoring every graph user except the
+    user and their direct follows (what `get_top_k_recommendations_for_user` does with
+    `all_candidates`). Users are handled in blocks: one multi-source BFS per block, then the
+    block is scored as users x candidates matrices of at most `max_cells` cells against
+    features loaded once.
+    Pass `adjacency` to pin the graph state, e.g. one taken under a lock.
+    """
+    if snapshot is None:
+        snapshot = feature_store.snapshot()
+    engine = get_engine(snapshot)
+    w = weight_vector(weights)
+    if adjacency is None:
+        adjacency = graph.adjacency()
+    n = adjacency.shape[0]
+    users = list(dict.fromkeys(user_ids))
+    if n == 0:
+        return {uid: [] for uid in users}
+    ids = graph.ids
+    cand_rows = engine.rows_for(islice(ids, n))
+
+    results = {}
+    block_size = max(1, max_cells // n)
+    # the BFS packs 64 sources per machine word, so it always runs on at least that many
+    bfs_size = max(block_size, 64)
+    for start in range(0, len(users), bfs_size):
+        bfs_block = users[start:start + bfs_size]
+        # users added to the graph after `adjacency` was taken count as unknown
+        all_sources = lookup_rows(graph.index, bfs_block, -1)
+        all_sources[all_sources >= n] = -1
+        with timer("batch_bfs"):
+            all_depths = graph.multi_source_bfs(all_sources, max_depth, adjacency=adjacency)
+        for offset in range(0, len(bfs_block), block_size):
+            block = bfs_block[offset:offset + block_size]
+            sources = all_sources[offset:offset + block_size]
+            depths = all_depths[offset:offset + block_size]
+            with timer("batch_features"):
+                scores = engine.batch_scores(engine.rows_for(block), cand_rows, depths, w, max_distance)
+            with timer("batch_rank"):
+                # the user and their direct follows are not candidates
+                scores[depths == 1] = -np.inf
+                known = np.flatnonzero(sources >= 0)
+                scores[known, sources[known]] = -np.inf
+                for i, uid in enumerate(block):
+                    top = top_k_indices(scores[i], k)
+                    results[uid] = [(ids[j], float(scores[i, j])) for j in top if scores[i, j] > -np.inf]
+    return results
@@ -0,0 +1,135 @@
+'''
+Bounded cache of finished recommendation lists for the online API.
+Entries are keyed by (user_id, k, weights version), evicted LRU once the cache is full and
+expire after a TTL. Follow changes drop only the entries whose BFS neighbourhood they touch,
+and a reload of the feature tables retires everything computed from the previous tables.
+'''
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from itertools import islice
+from typing import Hashable, NamedTuple
+from bfs_cache import lengthened_by_remove, shortened_by_add
+from metrics import count, set_gauge
+
+DEFAULT_MAX_ENTRIES = int(os.getenv("RECOMMENDATION_CACHE_SIZE", "10000"))
+DEFAULT_TTL = float(os.getenv("RECOMMENDATION_CACHE_TTL", "300"))
+
+class CachedResult(NamedTuple):
+    result: list
+    # BFS distances the result was computed from; shared with the BFS cache, not copied
+    dist_map: dict
+    weights_version: Hashable
+    reloads: int
+    created: float
+
+class ResultCache:
+    """
+    LRU + TTL cache of recommendation results.
+    `reloads` is the feature store's reload counter when the result was computed; entries
+    from older tables count as expired. 0 for `max_entries` disables the cache.
+    """
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES, ttl: float = DEFAULT_TTL, max_depth: int = 5):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_depth = max_depth
+        self._entries: OrderedDict[tuple, CachedResult] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = {"lru": 0, "expired": 0, "follow": 0, "weights": 0}
+        # bumped on every invalidation so a result computed across one is not stored
+        self.generation = 0
+
+    def _drop(self, keys: list, reason: str):
+        for key in keys:
+            del self._entries[key]
+        if keys:
+            self.evictions[reason] += len(keys)
+            count("result_cache_evictions_total", len(keys), reason=reason)
+        set_gauge("result_cache_entries", len(self._entries))
+
+    def get(self, user_id: str, k: int, weights_version: Hashable, reloads: int) -> list | None:
+        """
+        The cached result for `(user_id, k, weights_version)`, or None if there is no fresh one.
+        """
+        key = (user_id, k, weights_version)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry.reloads != reloads or time.monotonic() - entry.created > self.ttl):
+                self._drop([key], "expired")
+                entry = None
+            if entry is None:
+                self.misses += 1
+                count("result_cache_requests_total", result="miss")
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        count("result_cache_requests_total", result="hit")
+        return entry.result
+
+    def put(self, user_id: str, k: int, weights_version: Hashable, reloads: int, result: list, dist_map: dict,
+            generation: int):
+        """
+        Store a result. `generation` is `self.generation` read before computing it; if the cache
+        was invalidated in the meantime the result may already be stale and is not stored.
+        """
+        if self.max_entries <= 0:
+            return
+        key = (user_id, k, weights_version)
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._entries[key] = CachedResult(result, dist_map, weights_version, reloads, time.monotonic())
+            self._entries.move_to_end(key)
+            overflow = max(len(self._entries) - self.max_entries, 0)
+            self._drop(list(islice(self._entries, overflow)), "lru")
+
+    def follow_changed(self, follower: str, following: str, added: bool):
+        """
+        Drop the results a follow change can affect: those whose BFS neighbourhood it changes
+        (the same test the BFS cache uses) and those listing `following`, whose follower count
+        and hence score just changed. Other users' scores for `following` move as well; those
+        entries are left to the TTL.
+        """
+        def affected(entry: CachedResult) -> bool:
+            if added:
+                changed = shortened_by_add(entry.dist_map, follower, following, self.max_depth)
+            else:
+                changed = lengthened_by_remove(entry.dist_map, follower, following)
+            return changed or any(rec["userId"] == following for rec in entry.result)
+        with self._lock:
+            self.generation += 1
+            self._drop([key for key, entry in self._entries.items() if affected(entry)], "follow")
+
+    def weights_changed(self, weights_version: Hashable):
+        """
+        Drop every entry computed with weights other than `weights_version`.
+        """
+        with self._lock:
+            self.generation += 1
+            self._drop([key for key, entry in self._entries.items() if entry.weights_version != weights_version], "weights")
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            set_gauge("result_cache_entries", 0)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": dict(self.evictions),
+            }
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -4,21 +4,11 @@ import argparse
 import random
 import numpy as np
 import pandas as pd
-import networkx as nx
-from dotenv import load_dotenv
-from supabase import create_client
+from data_access import iter_follows
 import weight_optimizer
-
-load_dotenv()
-
-url = os.getenv("SUPABASE_URL")
-key = os.getenv("SUPABASE_KEY")
-
-if not url or not key:
-    print("Error: SUPABASE_URL and/or SUPABASE_KEY environment variables are not set.")
-    exit(1)
-
-supabase = create_client(url, key)
+import evaluation
+import feature_precompute
+from snapshot import write_snapshot
 
 def fetch_all_edges():
     """
@@ -26,11 +16,10 @@ def fetch_all_edges():
     Returns a list of tuples (followerId, followingId).
     """
     try:
-        response = supabase.table("Follows").select("followerId, followingId").execute()
-        if not response.data:
+        edges = [(follow.follower_id, follow.following_id) for follow in iter_follows()]
+        if not edges:
             print("No edges found in Follows table.")
-            return []
-        return [(row["followerId"], row["followingId"]) for row in response.data]
+        return edges
     except Exception as e:
         print(f"Error fetching edges from Supabase: {e}")
         return []
@@ -43,6 +32,14 @@ def dump_csv(edges, path="follows.csv"):
     df.to_csv(path, index=False)
     print(f"Dumped {len(edges)} edges to {path}")
 
+def dump_snapshot(edges, features, path="follows.snapshot"):
+    """
+    Dump the edges and feature tables to a binary snapshot directory,
+    which weight_optimizer.load_edges and the API can memory-map.
+    """
+    write_snapshot(path, weight_optimizer.build_graph(edges), features)
+    print(f"Dumped {len(edges)} edges to {path}")
+
 def build_test_map(test_edges):
     """
     Build a map of users to their held-out edges for evaluation.
@@ -52,17 +49,51 @@ def build_test_map(test_edges):
         test_by_user.setdefault(u, set()).add(v)
     return test_by_user
 
+def load_or_compute_features(G_train, train_edges, held_out_by_user, snapshot, args, max_candidates=None):
+    """
+    Features for every test user, read from the cache directory when an entry for
+    the same inputs exists and computed in parallel otherwise.
+    """
+    key = feature_precompute.snapshot_hash(train_edges, held_out_by_user, snapshot, max_distance=4, max_candidates=max_candidates)
+    path = feature_precompute.cache_path(args.cache_dir, key)
+    if not args.no_cache and os.path.exists(path):
+        graph_ids, results = feature_precompute.load(path)
+        print(f"Loaded cached features from {path}")
+    else:
+        graph_ids = G_train.nodes()
+        results = feature_precompute.compute_features(G_train, snapshot, list(held_out_by_user), max_distance=4,
+                                                      workers=args.workers, max_candidates=max_candidates)
+        if not args.no_cache:
+            feature_precompute.save(path, graph_ids, results)
+            print(f"Saved features to {path}")
+    return graph_ids, results
+
 def main():
     p = argparse.ArgumentParser()
     p.add_argument("--test-ratio", type=float, default=0.2, help="Ratio of edges to hold out for testing")
     p.add_argument("--min-follows", type=int, default=3, help="Minimum number of follows to include a user in training")
-    p.add_argument("--k", type=int, default=2, help="Number of recommendations to generate")
+    p.add_argument("--k", type=evaluation.parse_ks, default=[2], help="Comma-separated cutoffs to evaluate, e.g. 1,3,5,10; the search maximizes recall at the first")
+    p.add_argument("--bootstrap", type=int, default=1000, help="Bootstrap resamples for the metric confidence intervals (0 disables them)")
     p.add_argument("--step", type=float, default=0.1, help="Step size for optimization")
+    p.add_argument("--strategy", choices=sorted(weight_optimizer.SEARCH_STRATEGIES), default="grid", help="Weight search strategy")
+    p.add_argument("--samples", type=int, default=256, help="Evaluation budget for the random, sobol, coordinate and halving strategies")
+    p.add_argument("--seed", type=int, default=20, help="Random seed for the sampling strategies")
+    p.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of processes for feature extraction")
+    p.add_argument("--cache-dir", default=".feature_cache", help="Directory for cached feature matrices")
+    p.add_argument("--no-cache", action="store_true", help="Recompute features even if a cached copy exists")
+    p.add_argument("--snapshot-out", default="follows.snapshot", help="Directory for the binary edge and feature snapshot")
+    p.add_argument("--csv", action="store_true", help="Also dump the edges to follows.csv")
+    p.add_argument("--max-candidates", type=int, default=0, help="Score only this many retrieved candidates per user and report the recall lost (0 scores everyone)")
     args = p.parse_args()
+    k = args.k[0]
 
-    # 1.) Fetch and dump all edges
+    # 1.) Fetch and dump all edges and feature tables
     edges = fetch_all_edges()
-    dump_csv(edges)
+    # load the feature tables once and reuse them for every test user
+    snapshot = weight_optimizer.feature_store.snapshot()
+    dump_snapshot(edges, snapshot, args.snapshot_out)
+    if args.csv:
+        dump_csv(edges)
 
     # 2.) Split edges into train and test sets
     train_edges, test_edges = weight_optimizer.train_test_split(
@@ -76,51 +107,63 @@ def main():
     print(f"Train graph:{G_train.number_of_nodes()} users, {G_train.number_of_edges()} edges")
     print(f"Test set: {len(test_edges)} edges held out for {len(test_by_user)} users")
 
-    all_loc, all_friend, all_pref = [], [], []
-
-    features_by_user = {}
-    held_out_by_user = {}
-
-    for user, held_out in test_by_user.items():
-        # skip is user not in training graph
-        if user not in G_train or not held_out:
-            continue
-        
-        dist_map = nx.single_source_shortest_path_length(G_train, user, cutoff=4)
+    # skip users not in the training graph
+    held_out_by_user = {
+        user: held_out for user, held_out in test_by_user.items()
+        if user in G_train and held_out
+    }
 
-        # direct friends
-        direct = {n for n, d in dist_map.items() if d == 1}
-        # candidates = everyone except user and direct friends
-        candidates = [n for n in G_train.nodes() if n != user and n not in direct]
+    graph_ids, results = load_or_compute_features(G_train, train_edges, held_out_by_user, snapshot, args,
+                                                  max_candidates=args.max_candidates or None)
+    features_by_user = feature_precompute.to_frames(graph_ids, results)
 
-        # compute and store features df
-        df = weight_optimizer.compute_features_for_user(user, candidates, dist_map)
-        # keep only relevant columns
-        features_by_user[user] = df[["friend_score", "location_score", "preference_score"]].copy()
-        held_out_by_user[user] = held_out
-        all_loc.extend(df["location_score"].tolist())
-        all_friend.extend(df["friend_score"].tolist())
-        all_pref.extend(df["preference_score"].tolist())
+    all_features = np.concatenate([features for _, features in results.values()]) if results else np.zeros((0, 3))
+    all_friend, all_loc, all_pref = (pd.Series(all_features[:, i]) for i in range(3))
 
     print("Feature statistics:")
-    print(f" location score:\n" , pd.Series(all_loc).describe())
-    print(f" friend score:\n" , pd.Series(all_friend).describe())
-    print(f" preference score:\n" , pd.Series(all_pref).describe())
+    print(f" location score:\n" , all_loc.describe())
+    print(f" friend score:\n" , all_friend.describe())
+    print(f" preference score:\n" , all_pref.describe())
 
     # 3.) Weight search
-    best_weights, best_score = weight_optimizer.weight_search_fast(
+    best_weights, best_score, evaluator = weight_optimizer.weight_search_strategy(
         features_by_user,
         held_out_by_user,
-        args.k,
-        args.step,
+        k,
+        strategy=args.strategy,
+        step=args.step,
+        samples=args.samples,
+        seed=args.seed,
     )
+    print(f"{args.strategy} search scored {evaluator.evaluations} weight vectors ({evaluator.user_evaluations} user evaluations)")
 
     w_loc, w_friend, w_pref = best_weights
     print("/n Best weights found:")
     print(f"location_score: {w_loc:.2f}")
     print(f"friend_score: {w_friend:.2f}")
     print(f"preference_score: {w_pref:.2f}")
-    print(f" recall@{args.k}: {best_score:.4f}")
+    print(f" recall@{k}: {best_score:.4f}")
+
+    # every metric at every k for the chosen weights, from one ranking per user
+    per_user = evaluation.evaluate_stack(evaluator.stack, best_weights, args.k)
+    summary = evaluation.summarize(per_user, samples=args.bootstrap, seed=args.seed)
+    interval = f", {args.bootstrap}-sample bootstrap 95% CI" if args.bootstrap > 0 else ""
+    print(f"Ranking metrics over {evaluator.n_users} users{interval}:")
+    print(evaluation.format_summary(summary, args.k))
+
+    if args.max_candidates:
+        full_ids, full_results = load_or_compute_features(G_train, train_edges, held_out_by_user, snapshot, args)
+        report = weight_optimizer.retrieval_recall_loss(
+            best_weights,
+            feature_precompute.to_frames(full_ids, full_results),
+            features_by_user,
+            held_out_by_user,
+            k,
+        )
+        print(f"Candidate retrieval (cap {args.max_candidates}):")
+        print(f" candidates per user: {report['mean_candidates_retrieved']:.1f} of {report['mean_candidates_full']:.1f}")
+        print(f" held-out coverage: {report['coverage']:.4f}")
+        print(f" recall@{k} full: {report['recall_full']:.4f}, retrieved: {report['recall_retrieved']:.4f}, loss: {report['recall_loss']:.4f}")
 
     # write to JSON
     out = {
@@ -129,8 +172,10 @@ def main():
         "preference_score": w_pref,
         "last_updated": pd.Timestamp.now().isoformat(),
     }
-    with open("weights.json", "w") as f:
+    # write then rename, so a running API polling the file never reads half of it
+    with open("weights.json.tmp", "w") as f:
         json.dump(out, f, indent=2)
+    os.replace("weights.json.tmp", "weights.json")
     print("Weights saved to weights.json")
 
 if __name__ == "__main__":
@@ -0,0 +1,340 @@
+'''
+Vectorized feature engine for the recommendation system.
+Lays the feature tables out as NumPy arrays aligned by user index so the friend,
+location and preference scores for every candidate are computed with a handful of
+array operations instead of a Python loop per candidate.
+'''
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from feature_store import FeatureSnapshot, base_table
+from geo_index import SphereGrid
+from user_ids import lookup_rows
+
+FEATURE_COLUMNS = ["friend_score", "location_score", "preference_score"]
+# count tables in the snapshot and the engine arrays built from them
+COUNT_ARRAYS = {"follower_counts": "followers", "event_counts": "events"}
+
+def _membership_matrix(sets_by_row: list, n_rows: int) -> sp.csr_matrix:
+    """
+    Build a binary CSR matrix with one row per user and one column per distinct item
+    (tag or liked tag), so set intersections become sparse dot products.
+    """
+    vocab = {}
+    rows, cols = [], []
+    for r, values in enumerate(sets_by_row):
+        for item in set(values):
+            rows.append(r)
+            cols.append(vocab.setdefault(item, len(vocab)))
+    data = np.ones(len(rows))
+    return sp.csr_matrix((data, (rows, cols)), shape=(n_rows, len(vocab)))
+
+class FeatureEngine:
+    """
+    Aligned array view of a FeatureSnapshot.
+    Every known user gets a row; one extra empty row at the end stands in for users
+    with no data at all, so any candidate ID can be scored.
+    """
+    def __init__(self, snapshot: FeatureSnapshot):
+        user_ids = set(snapshot.locations) | set(snapshot.tags) | set(snapshot.follower_counts) \
+            | set(snapshot.event_counts) | set(snapshot.liked_tags)
+        user_ids = sorted(user_ids)
+        index = {uid: i for i, uid in enumerate(user_ids)}
+        n = len(user_ids) + 1
+
+        lat = np.full(n, np.nan)
+        lon = np.full(n, np.nan)
+        for uid, (la, lo) in snapshot.locations.items():
+            i = index[uid]
+            lat[i], lon[i] = la, lo
+        followers = np.zeros(n)
+        for uid, count in snapshot.follower_counts.items():
+            followers[index[uid]] = count
+        events = np.zeros(n)
+        for uid, count in snapshot.event_counts.items():
+            events[index[uid]] = count
+
+        # user x tag and user x liked-tag indicator matrices
+        tag_matrix = _membership_matrix([snapshot.tags.get(uid, ()) for uid in user_ids] + [()], n)
+        liked_matrix = _membership_matrix([snapshot.liked_tags.get(uid, ()) for uid in user_ids] + [()], n)
+        self._init_arrays(snapshot, user_ids, index, lat, lon, followers, events, tag_matrix, liked_matrix)
+
+    @classmethod
+    def from_arrays(cls, snapshot: FeatureSnapshot, user_ids: list[str], lat: np.ndarray, lon: np.ndarray,
+                    followers: np.ndarray, events: np.ndarray, tag_matrix: sp.csr_matrix, liked_matrix: sp.csr_matrix,
+                    index: dict[str, int] | None = None):
+        """
+        Build the engine from per-user columns aligned with `user_ids` (e.g. memory-mapped from a
+        binary snapshot) instead of iterating the tables of `snapshot`, which must hold the same data.
+        Locations are in degrees and missing ones NaN; the empty row is appended here.
+        """
+        engine = cls.__new__(cls)
+        if index is None:
+            index = {uid: i for i, uid in enumerate(user_ids)}
+
+        def pad(values, fill):
+            return np.append(np.asarray(values, dtype=float), fill)
+
+        def pad_matrix(matrix):
+            matrix = sp.csr_matrix(matrix)
+            return sp.csr_matrix((matrix.data, matrix.indices, np.append(matrix.indptr, matrix.indptr[-1])),
+                                 shape=(matrix.shape[0] + 1, matrix.shape[1]))
+
+        engine._init_arrays(snapshot, user_ids, index, pad(lat, np.nan), pad(lon, np.nan), pad(followers, 0.0),
+                            pad(events, 0.0), pad_matrix(tag_matrix), pad_matrix(liked_matrix))
+        return engine
+
+    def _init_arrays(self, snapshot, user_ids, index, lat, lon, followers, events, tag_matrix, liked_matrix):
+        self.snapshot = snapshot
+        self.user_ids = user_ids
+        self.index = index
+        self.empty = len(user_ids)
+        self.has_location = ~np.isnan(lat)
+        self.lat = np.radians(lat)
+        self.lon = np.radians(lon)
+        self._geo_grids = {}
+        self.followers = followers
+        self.events = events
+        self.tag_matrix = tag_matrix
+        self.tag_counts = np.asarray(tag_matrix.sum(axis=1)).ravel()
+        self.liked_matrix = liked_matrix
+        self.liked_counts = np.asarray(liked_matrix.sum(axis=1)).ravel()
+        self._candidates = None
+
+    def sync_count(self, table: str, user_id: str, values: dict) -> bool:
+        """
+        Copy one user's entry of a count table into the engine after FeatureStore.adjust_count,
+        which swapped in the new `values` table; the engine's snapshot follows it.
+        Returns False if the user has no row or the table was reloaded since the engine was
+        built, in which case the engine must be rebuilt.
+        """
+        row = self.index.get(user_id)
+        if row is None or base_table(getattr(self.snapshot, table)) is not base_table(values):
+            return False
+        getattr(self, COUNT_ARRAYS[table])[row] = values.get(user_id, 0)
+        if getattr(self.snapshot, table) is not values:
+            self.snapshot = self.snapshot._replace(**{table: values})
+        return True
+
+    def rows_for(self, user_ids) -> np.ndarray:
+        """
+        Map user IDs to row indices, sending unknown users to the empty row.
+        """
+        return lookup_rows(self.index, user_ids, self.empty)
+
+    @staticmethod
+    def _ratio_scores(a: float, b: np.ndarray) -> np.ndarray:
+        scores = np.maximum(0.0, 1 - np.abs(a - b) / np.maximum(np.maximum(a, b), 1))
+        return np.where((a == 0) & (b == 0), 1.0, scores)
+
+    def _friend_scores(self, row: int, rows: np.ndarray, depths: np.ndarray, max_distance: int) -> np.ndarray:
+        bfs = np.where((depths < 2) | (depths > max_distance), 0.0, 1 - depths / max_distance)
+        follower_score = self._ratio_scores(self.followers[row], self.followers[rows])
+        event_score = self._ratio_scores(self.events[row], self.events[rows])
+        return 0.7 * bfs + 0.15 * follower_score + 0.15 * event_score
+
+    def _geo_grid(self, max_km: float) -> SphereGrid:
+        grid = self._geo_grids.get(max_km)
+        if grid is None:
+            rows = np.flatnonzero(self.has_location)
+            grid = SphereGrid(self.lat[rows], self.lon[rows], rows, max_km)
+            self._geo_grids[max_km] = grid
+        return grid
+
+    def _location_scores(self, row: int, rows: np.ndarray, max_km: float = 100.0) -> np.ndarray:
+        if not self.has_location[row]:
+            return np.zeros(len(rows))
+        # only users inside the radius can score above 0, so skip the trig for everyone else
+        nearby, dist_km = self.nearby(row, max_km)
+        scores = np.zeros(len(self.lat))
+        scores[nearby] = np.maximum(0.0, 1 - dist_km / max_km)
+        return scores[rows]
+
+    def nearby(self, row: int, max_km: float = 100.0) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Rows of users within `max_km` of `row` and their distances, i.e. everyone
+        with a non-zero location score.
+        """
+        if not self.has_location[row]:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        return self._geo_grid(max_km).query(self.lat[row], self.lon[row])
+
+    def sharing(self, row: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Rows of users sharing at least one tag or liked tag with `row`, and the fraction of
+        `row`'s tags they share. Everyone else has a zero preference score.
+        """
+        shared_tags = self._shared_counts(self.tag_matrix, row)
+        shared_liked = self._shared_counts(self.liked_matrix, row)
+        rows = np.flatnonzero((shared_tags > 0) | (shared_liked > 0))
+        return rows, shared_tags[rows] / max(self.tag_counts[row], 1)
+
+    @staticmethod
+    def _shared_counts(matrix: sp.csr_matrix, row: int) -> np.ndarray:
+        """
+        Number of items every row shares with `row`, as one sparse matrix-vector product.
+        """
+        return matrix @ matrix[row].toarray().ravel()
+
+    def _preference_scores(self, row: int, rows: np.ndarray) -> np.ndarray:
+        n_tags = self.tag_counts[row]
+        cand_tags = self.tag_counts[rows]
+        if n_tags == 0:
+            return np.zeros(len(rows))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            # cosine of binary indicator vectors: |A & B| / (||A|| * ||B||)
+            preference_sim = self._shared_counts(self.tag_matrix, row)[rows] / (np.sqrt(n_tags) * np.sqrt(cand_tags))
+
+            # jaccard of liked tags: |A & B| / (|A| + |B| - |A & B|)
+            n_liked = self.liked_counts[row]
+            cand_liked = self.liked_counts[rows]
+            shared_liked = self._shared_counts(self.liked_matrix, row)[rows]
+            liked_sim = shared_liked / (n_liked + cand_liked - shared_liked)
+        liked_sim = np.where((n_liked > 0) & (cand_liked > 0), liked_sim, 0.0)
+        scores = np.clip(0.5 * preference_sim + 0.5 * liked_sim, 0.0, 1.0)
+        # a candidate without tags has a zero indicator vector and scores 0 overall
+        return np.where(cand_tags > 0, scores, 0.0)
+
+    def feature_matrix(self, user_id: str, candidates: list[str], dist_map: dict[str,int], max_distance: int = 4) -> np.ndarray:
+        """
+        Return a (len(candidates), 3) matrix with columns in FEATURE_COLUMNS order.
+        """
+        row = self.index.get(user_id, self.empty)
+        rows = self.rows_for(candidates)
+        depths = np.fromiter((dist_map.get(c, max_distance + 1) for c in candidates), dtype=float, count=len(candidates))
+        features = np.empty((len(candidates), len(FEATURE_COLUMNS)))
+        features[:, 0] = self._friend_scores(row, rows, depths, max_distance)
+        features[:, 1] = self._location_scores(row, rows)
+        features[:, 2] = self._preference_scores(row, rows)
+        return features
+
+    def _candidate_view(self, cand_rows: np.ndarray) -> dict:
+        """
+        Candidate-side arrays for `batch_scores`, kept for the last candidate list seen so
+        every block of a batch reuses them.
+        """
+        cached = self._candidates
+        if cached is not None and cached["cand_rows"] is cand_rows:
+            return cached
+        n = len(cand_rows)
+        # the ratio terms depend only on the (followers, events) pair, and there are few distinct pairs
+        followers, events = self.followers[cand_rows], self.events[cand_rows]
+        pair_keys, pair_of = np.unique(followers * (self.events.max(initial=0) + 1) + events, return_inverse=True)
+        first = np.zeros(len(pair_keys), dtype=np.int64)
+        first[pair_of.ravel()] = np.arange(n)
+        view = {
+            "cand_rows": cand_rows,
+            "pair_of": pair_of.ravel(),
+            "pair_followers": followers[first],
+            "pair_events": events[first],
+            # engine row -> candidate column; users without features share the empty row,
+            # which never shows up in the geo lookups
+            "column": np.full(self.empty + 1, -1, dtype=np.int64),
+            # item x candidate views of the membership matrices, so products land in candidate order
+            "tags_t": self.tag_matrix[cand_rows].T.tocsr(),
+            "liked_t": self.liked_matrix[cand_rows].T.tocsr(),
+        }
+        view["column"][cand_rows] = np.arange(n)
+        self._candidates = view
+        return view
+
+    def batch_scores(self, rows: np.ndarray, cand_rows: np.ndarray, depths: np.ndarray, weights: np.ndarray,
+                     max_distance: int = 4, max_km: float = 100.0) -> np.ndarray:
+        """
+        Weighted scores (`feature_matrix(...) @ weights`) for many users against one shared
+        candidate list, as a (len(rows), len(cand_rows)) array.
+        `rows` are the users' engine rows, `cand_rows` the candidates' engine rows and `depths`
+        a matching array of hop distances, 0 where unreached (see `multi_source_bfs`).
+        The dense friend terms are table lookups: the BFS term by depth, and the follower/event
+        ratios once per distinct pair of candidate counts. Location is added at the cells within
+        the radius only.
+        """
+        w_friend, w_location, w_preference = weights
+        view = self._candidate_view(cand_rows)
+
+        ratio = 0.15 * self._ratio_scores(self.followers[rows][:, None], view["pair_followers"][None, :]) \
+            + 0.15 * self._ratio_scores(self.events[rows][:, None], view["pair_events"][None, :])
+        scores = np.take(w_friend * ratio, view["pair_of"], axis=1)
+        hop = np.arange(max(int(depths.max(initial=0)), max_distance) + 1, dtype=float)
+        hop = np.where((hop < 2) | (hop > max_distance), 0.0, w_friend * 0.7 * (1 - hop / max_distance))
+        scores += np.take(hop, depths)
+
+        for i, row in enumerate(rows.tolist()):
+            nearby, dist_km = self.nearby(row, max_km)
+            cols = view["column"][nearby]
+            keep = cols >= 0
+            scores[i, cols[keep]] += w_location * np.maximum(0.0, 1 - dist_km[keep] / max_km)
+
+        # preference: shared tag and liked-tag counts for the whole block come from two sparse
+        # products, densified because popular tags make them dense anyway. Both halves lie in
+        # [0, 1], so their average needs no clipping; it is 0 unless both users have tags.
+        tagged = (self.tag_counts[rows] > 0) * (w_preference * 0.5)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            user_norm = np.where(tagged > 0, tagged / np.sqrt(self.tag_counts[rows]), 0.0)
+            cand_norm = np.where(self.tag_counts[cand_rows] > 0, 1 / np.sqrt(self.tag_counts[cand_rows]), 0.0)
+        shared = (self.tag_matrix[rows] @ view["tags_t"]).toarray()
+        shared *= user_norm[:, None]
+        shared *= cand_norm[None, :]
+        scores += shared
+
+        # jaccard |A & B| / (|A| + |B| - |A & B|), only where something is shared
+        shared = (self.liked_matrix[rows] @ view["liked_t"]).toarray()
+        union = self.liked_counts[rows][:, None] + self.liked_counts[cand_rows][None, :]
+        union -= shared
+        np.divide(shared, union, out=shared, where=shared > 0)
+        shared *= tagged[:, None]
+        shared *= (self.tag_counts[cand_rows] > 0)[None, :]
+        scores += shared
+        return scores
+
+    def features_frame(self, user_id: str, candidates: list[str], dist_map: dict[str,int], max_distance: int = 4) -> pd.DataFrame:
+        """
+        Same as `feature_matrix`, wrapped in a DataFrame indexed by candidate ID.
+        """
+        candidates = list(dict.fromkeys(candidates))
+        features = self.feature_matrix(user_id, candidates, dist_map, max_distance)
+        return pd.DataFrame(features, index=candidates, columns=FEATURE_COLUMNS)
+
+_cached_engine = None
+
+def prime_engine(engine: FeatureEngine):
+    """
+    Install a prebuilt engine (e.g. `Snapshot.engine`) as the one `get_engine` returns for its snapshot.
+    """
+    global _cached_engine
+    _cached_engine = engine
+
+def _same_tables(a: FeatureSnapshot, b: FeatureSnapshot) -> bool:
+    """
+    True if `a` and `b` hold the same loaded tables. Count tables may differ by
+    FeatureStore.adjust_count updates, which the engine follows through `sync_count`.
+    """
+    for name in FeatureSnapshot._fields[:-1]:
+        x, y = getattr(a, name), getattr(b, name)
+        if name in COUNT_ARRAYS:
+            x, y = base_table(x), base_table(y)
+        if x is not y:
+            return False
+    return True
+
+def get_engine(snapshot: FeatureSnapshot) -> FeatureEngine:
+    """
+    Return the engine for `snapshot`, rebuilding it only when the tables were reloaded.
+    Its counts are the latest ones, which may be newer than `snapshot`'s.
+    """
+    global _cached_engine
+    engine = _cached_engine
+    if engine is None or not _same_tables(engine.snapshot, snapshot):
+        engine = FeatureEngine(snapshot)
+        _cached_engine = engine
+    return engine
+
+def sync_cached_count(table: str, user_id: str, values: dict):
+    """
+    Propagate a count update (FeatureStore.adjust_count, which returned `values`) to the cached engine.
+    """
+    global _cached_engine
+    engine = _cached_engine
+    if engine is not None and not engine.sync_count(table, user_id, values):
+        _cached_engine = None
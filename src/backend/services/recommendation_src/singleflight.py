@@ -0,0 +1,32 @@
+'''
+Request coalescing for async handlers.
+Concurrent callers asking for the same key share one in-flight computation instead
+of each starting their own, so a burst of identical requests costs a single run.
+'''
+
+import asyncio
+from typing import Awaitable, Callable, Hashable
+
+class SingleFlight:
+    """
+    Tracks at most one running task per key.
+    The task is forgotten as soon as it finishes, so results are never cached
+    beyond the requests that were waiting for them.
+    """
+    def __init__(self):
+        self._inflight: dict[Hashable, asyncio.Task] = {}
+
+    async def run(self, key: Hashable, factory: Callable[[], Awaitable]):
+        """
+        Await the in-flight task for `key`, starting `factory()` if there is none.
+        """
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # one caller disconnecting must not cancel the work the others wait on
+        return await asyncio.shield(task)
+
+    def __len__(self) -> int:
+        return len(self._inflight)
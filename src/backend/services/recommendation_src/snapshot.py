@@ -0,0 +1,240 @@
+'''
+Versioned binary snapshot of the follow graph and feature tables.
+A snapshot is a directory of .npy arrays plus a meta.json header. Readers open the
+arrays memory-mapped and build the graph and feature engine straight from them, so
+services start without scanning Supabase and forked workers share the same pages.
+
+Usage:
+    python snapshot.py --out snapshots/latest
+'''
+
+import argparse
+import json
+import os
+import shutil
+import time
+from collections.abc import Mapping
+from typing import Callable
+import numpy as np
+import scipy.sparse as sp
+from graph import CompactGraph, FollowGraph
+from feature_store import FeatureSnapshot
+from feature_extraction import feature_store
+from scoring_engine import FeatureEngine
+from user_ids import MappedIds, UserIds, UserIndex, take_ids
+
+FORMAT_NAME = "linklocal-snapshot"
+FORMAT_VERSION = 1
+
+def _csr(sets_by_row: list) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Encode one set of string items per row as (indptr, indices, vocabulary).
+    """
+    vocab = {}
+    indptr = [0]
+    indices = []
+    for values in sets_by_row:
+        indices.extend(vocab.setdefault(item, len(vocab)) for item in sorted(set(values)))
+        indptr.append(len(indices))
+    return (np.asarray(indptr, dtype=np.int64), np.asarray(indices, dtype=np.int32),
+            np.array(list(vocab), dtype="S") if vocab else np.zeros(0, dtype="S1"))
+
+def write_snapshot(path: str, graph: CompactGraph, features: FeatureSnapshot):
+    """
+    Write `graph` and `features` to the snapshot directory `path`, replacing it atomically.
+    """
+    graph.compact()
+    user_ids = list(graph.ids)
+    known = set(user_ids)
+    for table in features[:-1]:
+        for uid in table:
+            if uid not in known:
+                known.add(uid)
+                user_ids.append(uid)
+    n = len(user_ids)
+    # users outside the graph have no out-edges
+    indptr = np.concatenate((graph.indptr, np.full(n - graph.number_of_nodes(), graph.indptr[-1])))
+
+    lat = np.full(n, np.nan)
+    lon = np.full(n, np.nan)
+    for i, uid in enumerate(user_ids):
+        loc = features.locations.get(uid)
+        if loc is not None:
+            lat[i], lon[i] = loc
+    tag_indptr, tag_indices, tag_ids = _csr([features.tags.get(uid, ()) for uid in user_ids])
+    liked_indptr, liked_indices, liked_tag_ids = _csr([features.liked_tags.get(uid, ()) for uid in user_ids])
+
+    arrays = {
+        "user_ids": np.array(user_ids, dtype="S"),
+        "indptr": indptr.astype(np.int64),
+        "indices": graph.indices.astype(np.int32),
+        "lat": lat,
+        "lon": lon,
+        "follower_counts": np.array([features.follower_counts.get(uid, 0) for uid in user_ids], dtype=np.int64),
+        "event_counts": np.array([features.event_counts.get(uid, 0) for uid in user_ids], dtype=np.int64),
+        "tag_indptr": tag_indptr,
+        "tag_indices": tag_indices,
+        "tag_ids": tag_ids,
+        "liked_indptr": liked_indptr,
+        "liked_indices": liked_indices,
+        "liked_tag_ids": liked_tag_ids,
+    }
+    meta = {
+        "format": FORMAT_NAME,
+        "version": FORMAT_VERSION,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "n_users": n,
+        "n_graph_users": graph.number_of_nodes(),
+        "n_edges": int(len(graph.indices)),
+        "arrays": sorted(arrays),
+    }
+
+    tmp = path.rstrip("/") + ".tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp, f"{name}.npy"), array)
+    with open(os.path.join(tmp, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+    old = path.rstrip("/") + ".old"
+    # left behind by a run that crashed between the two renames
+    shutil.rmtree(old, ignore_errors=True)
+    if os.path.exists(path):
+        os.replace(path, old)
+    os.replace(tmp, path)
+    shutil.rmtree(old, ignore_errors=True)
+
+class SnapshotTable(Mapping):
+    """
+    Read-only dict view of one feature table in a Snapshot that decodes a user's entry only
+    when it is read. `present` marks the rows that have one. Count updates are layered over
+    it by FeatureStore.adjust_count, so the mapped arrays are never copied or modified.
+    """
+    def __init__(self, ids: UserIds, index: UserIndex, present: np.ndarray, decode: Callable[[int], object]):
+        self._ids = ids
+        self._index = index
+        self._present = present
+        self._decode = decode
+
+    def _row(self, key) -> int | None:
+        row = self._index.get(key)
+        return row if row is not None and self._present[row] else None
+
+    def __getitem__(self, key):
+        row = self._row(key)
+        if row is None:
+            raise KeyError(key)
+        return self._decode(row)
+
+    def __contains__(self, key) -> bool:
+        return self._row(key) is not None
+
+    def __iter__(self):
+        yield from take_ids(self._ids, np.flatnonzero(self._present))
+
+    def __len__(self) -> int:
+        return int(np.count_nonzero(self._present))
+
+class Snapshot:
+    """
+    Memory-mapped view of a snapshot directory.
+    Arrays are opened copy-on-write, so callers may patch them in place without
+    touching the file or other processes' pages.
+    """
+    def __init__(self, path: str):
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        if self.meta.get("format") != FORMAT_NAME or self.meta.get("version") != FORMAT_VERSION:
+            raise ValueError(f"Unsupported snapshot at {path}: {self.meta.get('format')} v{self.meta.get('version')}")
+        self.path = path
+        self.arrays = {
+            name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="c")
+            for name in self.meta["arrays"]
+        }
+        # decoded and indexed on first use, once for the graph, the tables and the engine
+        self._mapped_ids = MappedIds(self["user_ids"])
+        self._ids = UserIds(self._mapped_ids)
+        self._index = UserIndex(self._mapped_ids)
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.arrays[name]
+
+    def user_ids(self) -> UserIds:
+        return self._ids
+
+    def _user_index(self) -> UserIndex:
+        return self._index
+
+    def edges(self):
+        """
+        Yield `(follower, following)` pairs, e.g. for weight_optimizer.load_edges.
+        """
+        ids = list(self.user_ids())
+        indptr, indices = self["indptr"], self["indices"]
+        rows = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+        for u, v in zip(rows.tolist(), indices.tolist()):
+            yield ids[u], ids[v]
+
+    def graph(self) -> CompactGraph:
+        """
+        Follow graph backed directly by the mapped CSR arrays and user IDs. Graph users come
+        first in the snapshot, so the graph indexes a prefix of the snapshot's IDs.
+        """
+        n = self.meta["n_graph_users"]
+        return CompactGraph.from_csr(UserIds(self._mapped_ids, n), self["indptr"][:n + 1], self["indices"],
+                                     index=UserIndex(self._mapped_ids, n))
+
+    def _matrix(self, prefix: str, vocab_name: str) -> sp.csr_matrix:
+        """
+        User x item indicator matrix over the mapped CSR arrays (only the data is allocated).
+        """
+        indptr, indices = self[f"{prefix}_indptr"], self[f"{prefix}_indices"]
+        return sp.csr_matrix((np.ones(len(indices)), indices, indptr), shape=(len(indptr) - 1, len(self[vocab_name])))
+
+    def _set_table(self, prefix: str, vocab_name: str, wrap: Callable) -> SnapshotTable:
+        vocab = [t.decode() for t in self[vocab_name]]
+        indptr, indices = self[f"{prefix}_indptr"], self[f"{prefix}_indices"]
+        def decode(i):
+            return wrap(vocab[t] for t in indices[indptr[i]:indptr[i + 1]].tolist())
+        return SnapshotTable(self.user_ids(), self._user_index(), np.diff(indptr) > 0, decode)
+
+    def features(self) -> FeatureSnapshot:
+        """
+        The feature tables, with the keys and values the fetch_* functions return, as
+        SnapshotTable views over the mapped arrays rather than dicts built up front.
+        """
+        ids, index = self.user_ids(), self._user_index()
+        lat, lon = self["lat"], self["lon"]
+        followers, events = self["follower_counts"], self["event_counts"]
+        return FeatureSnapshot(
+            locations=SnapshotTable(ids, index, ~np.isnan(lat), lambda i: (float(lat[i]), float(lon[i]))),
+            tags=self._set_table("tag", "tag_ids", list),
+            follower_counts=SnapshotTable(ids, index, followers != 0, lambda i: int(followers[i])),
+            event_counts=SnapshotTable(ids, index, events != 0, lambda i: int(events[i])),
+            liked_tags=self._set_table("liked", "liked_tag_ids", set),
+            version=0,
+        )
+
+    def engine(self, features: FeatureSnapshot) -> FeatureEngine:
+        """
+        FeatureEngine built from the mapped columns, without reading `features` (the tables
+        from `features()`, possibly as installed in a FeatureStore) entry by entry.
+        """
+        return FeatureEngine.from_arrays(features, self.user_ids(), self["lat"], self["lon"],
+                                         self["follower_counts"], self["event_counts"],
+                                         self._matrix("tag", "tag_ids"), self._matrix("liked", "liked_tag_ids"),
+                                         index=self._user_index())
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--out", required=True, help="Snapshot directory to write")
+    args = p.parse_args()
+
+    start = time.perf_counter()
+    graph = FollowGraph()
+    write_snapshot(args.out, graph, feature_store.snapshot())
+    print(f"Wrote snapshot of {graph.number_of_nodes()} users, {graph.number_of_edges()} edges to {args.out} "
+          f"({time.perf_counter() - start:.1f}s)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+import random
+import pytest
+from graph import CompactGraph
+
+nx = pytest.importorskip("networkx")
+
+def random_edges(rng: random.Random, n_users: int, n_edges: int) -> list[tuple[str, str]]:
+    return [(f"u{rng.randrange(n_users)}", f"u{rng.randrange(n_users)}") for _ in range(n_edges)]
+
+def assert_same_distances(graph: CompactGraph, reference, sources, max_depth: int):
+    for source in sources:
+        expected = nx.single_source_shortest_path_length(reference, source, cutoff=max_depth)
+        assert graph.bfs_distances(source, max_depth) == expected, source
+
+@pytest.mark.parametrize("compact_threshold", [1, 7, 4096])
+def test_bfs_distances_matches_networkx_across_updates(compact_threshold):
+    rng = random.Random(compact_threshold)
+    edges = random_edges(rng, 60, 150)
+    graph = CompactGraph(edges, compact_threshold=compact_threshold)
+    reference = nx.DiGraph(edges)
+    for step in range(300):
+        follower, following = random_edges(rng, 70, 1)[0]
+        if rng.random() < 0.5 and reference.number_of_edges():
+            follower, following = rng.choice(list(reference.edges))
+            assert graph.remove_edge(follower, following)
+            reference.remove_edge(follower, following)
+        else:
+            assert graph.add_edge(follower, following) == (not reference.has_edge(follower, following))
+            reference.add_edge(follower, following)
+        assert not graph.remove_edge("u0", "nobody")
+        if step % 10 == 0:
+            assert graph.number_of_edges() == reference.number_of_edges()
+            assert_same_distances(graph, reference, rng.sample(list(reference.nodes), 5), rng.randint(1, 5))
+    assert_same_distances(graph, reference, reference.nodes, 5)
+
+def test_bfs_distances_of_unknown_user():
+    graph = CompactGraph([("a", "b")])
+    assert graph.bfs_distances("ghost", 5) == {"ghost": 0}
+    assert "ghost" not in graph
+
+def test_multi_source_bfs_matches_bfs_distances():
+    rng = random.Random(22)
+    graph = CompactGraph(random_edges(rng, 200, 500), compact_threshold=10**6)
+    # tombstones in the CSR arrays, and pending edges (some to new users) on top
+    for follower, following in rng.sample(random_edges(rng, 200, 2000), 300):
+        graph.remove_edge(follower, following)
+    for follower, following in random_edges(rng, 220, 200):
+        graph.add_edge(follower, following)
+    assert graph._removed and graph._pending_src
+
+    users = graph.ids[:150] + ["ghost"]
+    sources = [graph.index.get(user, -1) for user in users]
+    for max_depth in (1, 3, 5):
+        depths = graph.multi_source_bfs(sources, max_depth)
+        assert depths.shape == (len(users), graph.number_of_nodes())
+        for user, row in zip(users, depths):
+            expected = {uid: d for uid, d in graph.bfs_distances(user, max_depth).items() if d > 0}
+            assert {graph.ids[j]: int(row[j]) for j in row.nonzero()[0]} == expected, user
@@ -0,0 +1,41 @@
+import heapq
+import numpy as np
+import pytest
+from ranking import streaming_top_k, top_k_indices
+
+def nlargest(scores: np.ndarray, k: int) -> list[int]:
+    return heapq.nlargest(k, range(len(scores)), key=lambda i: scores[i])
+
+def blocks(scores: np.ndarray, size: int):
+    ids = list(range(len(scores)))
+    for start in range(0, len(scores), size):
+        yield ids[start:start + size], scores[start:start + size]
+
+def tied_scores() -> list[np.ndarray]:
+    rng = np.random.default_rng(10)
+    sparse = np.zeros(1000)
+    sparse[[5, 700]] = 1.0
+    return [
+        sparse,
+        np.zeros(1000),
+        rng.integers(0, 4, 1000).astype(float),
+        np.where(rng.random(1000) < 0.9, 0.0, rng.random(1000)),
+        np.array([-np.inf, 0.0, -np.inf, 0.0, 1.0]),
+    ]
+
+@pytest.mark.parametrize("scores", tied_scores())
+@pytest.mark.parametrize("k", [1, 5, 100, 999, 1000, 2000])
+def test_top_k_indices_breaks_ties_by_index(scores, k):
+    assert top_k_indices(scores, k).tolist() == nlargest(scores, k)
+
+@pytest.mark.parametrize("scores", tied_scores())
+@pytest.mark.parametrize("k", [1, 5, 100])
+@pytest.mark.parametrize("block_size", [1, 3, 100, 5000])
+def test_streaming_top_k_matches_full(scores, k, block_size):
+    top = streaming_top_k(blocks(scores, block_size), k)
+    assert [uid for uid, _ in top] == nlargest(scores, k)
+    assert [score for _, score in top] == [scores[i] for i in top_k_indices(scores, k)]
+
+def test_top_k_indices_empty():
+    assert top_k_indices(np.zeros(3), 0).tolist() == []
+    assert top_k_indices(np.zeros(0), 3).tolist() == []
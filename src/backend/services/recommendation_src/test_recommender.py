@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+from candidate_retrieval import all_candidates
+from feature_store import FeatureSnapshot
+from graph import CompactGraph
+from recommender import get_top_k_recommendations_for_user, get_top_k_recommendations_for_users
+
+WEIGHTS = {"friend_score": 0.4, "location_score": 0.35, "preference_score": 0.25}
+
+def random_world(n_users: int, seed: int) -> tuple[CompactGraph, FeatureSnapshot]:
+    rng = np.random.default_rng(seed)
+    ids = [f"u{i}" for i in range(n_users)]
+    edges = [(ids[a], ids[b]) for a, b in rng.integers(0, n_users, (4 * n_users, 2)) if a != b]
+    graph = CompactGraph(edges, compact_threshold=10**6)
+    for follower, following in edges[::9]:
+        graph.remove_edge(follower, following)
+    graph.add_edge(ids[0], "newcomer")
+    tags = [f"t{i}" for i in range(12)]
+    snapshot = FeatureSnapshot(
+        locations={uid: (48 + rng.normal(0, 0.5), 2 + rng.normal(0, 0.5)) for uid in ids[::2]},
+        tags={uid: list(rng.choice(tags, 3, replace=False)) for uid in ids[::3]},
+        follower_counts={uid: int(rng.integers(1, 40)) for uid in ids},
+        event_counts={uid: int(rng.integers(1, 6)) for uid in ids[::4]},
+        liked_tags={uid: set(rng.choice(tags, 2, replace=False)) for uid in ids[1::3]},
+        version=0,
+    )
+    return graph, snapshot
+
+@pytest.mark.parametrize("max_cells", [10**6, 5000])
+def test_batch_matches_single_user(max_cells):
+    graph, snapshot = random_world(150, seed=22)
+    users = graph.ids[:150] + ["ghost"]
+    batch = get_top_k_recommendations_for_users(graph, users, WEIGHTS, 5, snapshot=snapshot, max_cells=max_cells)
+    assert list(batch) == users
+    for user in users:
+        dist_map = graph.bfs_distances(user, 5)
+        single = get_top_k_recommendations_for_user(user, dist_map, all_candidates(graph, user, dist_map),
+                                                    WEIGHTS, 5, snapshot=snapshot)
+        assert [uid for uid, _ in batch[user]] == [uid for uid, _ in single], user
+        assert [score for _, score in batch[user]] == pytest.approx([score for _, score in single]), user
@@ -0,0 +1,136 @@
+'''
+User IDs of a binary snapshot, kept as the memory-mapped bytes array they are stored in.
+IDs are decoded one at a time as they are read, and the str -> row dict is built on the
+first lookup, once per process, and shared by everything opened from the snapshot: the
+follow graph, the feature tables and the feature engine.
+'''
+
+import threading
+from collections.abc import MutableMapping, Sequence
+from itertools import islice
+import numpy as np
+
+class MappedIds:
+    """
+    A fixed-width bytes array of user IDs, one per row, and its lazily built index.
+    """
+    def __init__(self, raw: np.ndarray):
+        self.raw = raw
+        self._index = None
+        self._lock = threading.Lock()
+
+    def index(self) -> dict[str, int]:
+        index = self._index
+        if index is None:
+            with self._lock:
+                if self._index is None:
+                    self._index = {uid.decode(): i for i, uid in enumerate(self.raw.tolist())}
+                index = self._index
+        return index
+
+class UserIds(Sequence):
+    """
+    The first `limit` IDs of a MappedIds (all of them by default) as a list of str, plus
+    the IDs appended since (e.g. by CompactGraph.intern).
+    """
+    def __init__(self, mapped: MappedIds, limit: int | None = None):
+        self.mapped = mapped
+        self.n_mapped = len(mapped.raw) if limit is None else min(limit, len(mapped.raw))
+        self._added = []
+
+    def __len__(self) -> int:
+        return self.n_mapped + len(self._added)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if 0 <= i < self.n_mapped:
+            return self.mapped.raw[i].decode()
+        return self._added[i - self.n_mapped]
+
+    def __iter__(self):
+        # the index's keys are the decoded IDs in row order
+        yield from islice(self.mapped.index(), self.n_mapped)
+        yield from self._added
+
+    def append(self, user_id: str):
+        self._added.append(user_id)
+
+    def take(self, rows) -> list[str]:
+        """
+        `[self[r] for r in rows]`, decoding the mapped ones in one pass.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        if len(rows) == 0 or rows.max() < self.n_mapped:
+            return [uid.decode() for uid in self.mapped.raw[rows].tolist()]
+        return [self[r] for r in rows.tolist()]
+
+class UserIndex(MutableMapping):
+    """
+    str -> row index of a UserIds with the same `limit`. Rows at or past `limit` count as
+    missing, and keys set on the index (e.g. by CompactGraph.intern) are kept in it alone.
+    """
+    def __init__(self, mapped: MappedIds, limit: int | None = None):
+        self.mapped = mapped
+        self.n_mapped = len(mapped.raw) if limit is None else min(limit, len(mapped.raw))
+        self._added = {}
+
+    def get(self, key, default=None):
+        row = self.mapped.index().get(key)
+        if row is not None and row < self.n_mapped:
+            return row
+        return self._added.get(key, default)
+
+    def rows(self, keys, default: int = -1) -> np.ndarray:
+        """
+        Row of every key in `keys`, or `default` for keys not in the index.
+        """
+        keys = list(keys)
+        index = self.mapped.index()
+        rows = np.fromiter((index.get(key, -1) for key in keys), dtype=np.int64, count=len(keys))
+        missing = np.flatnonzero((rows < 0) | (rows >= self.n_mapped))
+        if len(missing):
+            added = self._added
+            rows[missing] = [added.get(keys[i], default) for i in missing.tolist()]
+        return rows
+
+    def __getitem__(self, key):
+        row = self.get(key)
+        if row is None:
+            raise KeyError(key)
+        return row
+
+    def __setitem__(self, key, value):
+        self._added[key] = value
+
+    def __delitem__(self, key):
+        raise TypeError("user indexes do not support deleting entries")
+
+    def __contains__(self, key) -> bool:
+        return self.get(key) is not None
+
+    def __iter__(self):
+        yield from islice(self.mapped.index(), self.n_mapped)
+        yield from self._added
+
+    def __len__(self) -> int:
+        return self.n_mapped + len(self._added)
+
+def lookup_rows(index, keys, default: int = -1) -> np.ndarray:
+    """
+    Row of every key in `keys` from a dict or UserIndex, or `default` for missing keys.
+    """
+    if isinstance(index, UserIndex):
+        return index.rows(keys, default)
+    keys = list(keys)
+    return np.fromiter((index.get(key, default) for key in keys), dtype=np.int64, count=len(keys))
+
+def take_ids(ids, rows) -> list[str]:
+    """
+    `[ids[r] for r in rows]` for a list or UserIds.
+    """
+    if isinstance(ids, UserIds):
+        return ids.take(rows)
+    return [ids[r] for r in np.asarray(rows).tolist()]
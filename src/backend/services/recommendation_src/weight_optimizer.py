@@ -1,14 +1,28 @@
 import argparse
+import copy
+import math
+import os
 import random
+from typing import NamedTuple
 import numpy as np
 import pandas as pd
-import networkx as nx
-from feature_extraction import compute_features_for_user
+from graph import CompactGraph
+from snapshot import Snapshot
+from evaluation import ranking_metrics, evaluate_stack
+from candidate_retrieval import retrieval_coverage
+from feature_extraction import compute_features_for_user, feature_store
+
+# order of the weight tuples searched below: (w_loc, w_friend, w_pref)
+WEIGHT_COLUMNS = ["location_score", "friend_score", "preference_score"]
+# upper bound on padded feature and score tensor elements held at once during evaluation
+GRID_CHUNK_ELEMENTS = 20_000_000
 
 def load_edges(path):
     """
-    Load edges from a CSV file into a directed graph.
+    Load edges from a binary snapshot directory or a CSV file.
     """
+    if os.path.isdir(path):
+        return list(Snapshot(path).edges())
     df = pd.read_csv(path)
     df = df.dropna(subset=['followerId', 'followingId'])
     edges = list(zip(df['followerId'], df['followingId']))
@@ -42,19 +56,20 @@ def build_graph(edge_list):
     """
     Build a directed graph from edges.
     """
-    G = nx.DiGraph()
-    G.add_edges_from(edge_list)
-    return G
+    return CompactGraph(edge_list)
 
 def evaluate_weights(weights, G_train, test_by_user, k, max_distance=4):
-    recalls = []
+    hits = []
+    n_held = []
+    # score every user against the same feature tables
+    snapshot = feature_store.snapshot()
     for user, held_out in test_by_user.items():
         # skip if no held out or user not in training graph
         if not held_out or user not in G_train:
             continue
         
         # bfs distances from user
-        dist_map = nx.single_source_shortest_path_length(G_train, user, cutoff=max_distance)
+        dist_map = G_train.bfs_distances(user, max_distance)
 
         # direct friends
         direct = {n for n, d in dist_map.items() if d == 1}
@@ -63,7 +78,7 @@ def evaluate_weights(weights, G_train, test_by_user, k, max_distance=4):
         candidates = [n for n in G_train.nodes() if n != user and n not in direct]
 
         # compute features dataframe
-        df = compute_features_for_user(user, candidates, dist_map)
+        df = compute_features_for_user(user, candidates, dist_map, snapshot=snapshot)
 
         # score features
         df['score'] = (
@@ -72,36 +87,38 @@ def evaluate_weights(weights, G_train, test_by_user, k, max_distance=4):
             df['preference_score'] * weights[2]
         )
 
-        top_k = set(df['score'].nlargest(k).index)
-        recall = len(top_k & (held_out)) / len(held_out) if held_out else 0
-        recalls.append(recall)
-    
-    return float(np.mean(recalls)) if recalls else 0.0
+        # ranked hits, padded with misses when there are fewer than k candidates
+        ranked = df['score'].nlargest(k).index.isin(list(held_out))
+        hits.append(np.pad(ranked, (0, k - len(ranked))))
+        n_held.append(len(held_out))
+
+    if not hits:
+        return 0.0
+    return float(ranking_metrics(np.array(hits), np.array(n_held), [k])[f"recall@{k}"].mean())
 
 def evaluate_weights_fast(weights, features_by_user, held_out_by_user, k):
-    w = np.array(weights)
-    recalls = []
-
-    for user, df in features_by_user.items():
-        feats = df.values
-        scores = feats.dot(w)
-
-        # get top k indices by score
-        n = len(scores)
-        if n <= k:
-            # if fewer than k candidates, use argsort
-            top_k_indices = np.argsort(scores)[-k:]
-        else:
-            # use argpartition for efficiency
-            # this is faster than argsort for large arrays
-            # it only partially sorts the array to find the top k elements
-            top_k_indices = np.argpartition(scores, -k)[-k:]
-        top_k = set(df.index[top_k_indices])
+    if not features_by_user:
+        return 0.0
+    stack = FeatureStack(features_by_user, held_out_by_user)
+    return float(evaluate_stack(stack, weights, [k])[f"recall@{k}"].mean())
 
-        held = held_out_by_user[user]
-        recall = len(top_k & held) / len(held) if held else 0
-        recalls.append(recall)
-    return float(np.mean(recalls)) if recalls else 0.0
+def retrieval_recall_loss(weights, full_features_by_user, retrieved_features_by_user, held_out_by_user, k):
+    """
+    Compare recall@k for `weights` with and without the candidate retrieval stage.
+    Both sides are scored by evaluate_weights_fast; `coverage` is the share of held-out
+    follows retrieval keeps at all, which caps the retrieved recall.
+    """
+    recall_full = evaluate_weights_fast(weights, full_features_by_user, held_out_by_user, k)
+    recall_retrieved = evaluate_weights_fast(weights, retrieved_features_by_user, held_out_by_user, k)
+    return {
+        "recall_full": recall_full,
+        "recall_retrieved": recall_retrieved,
+        "recall_loss": recall_full - recall_retrieved,
+        "coverage": retrieval_coverage(
+            {user: list(df.index) for user, df in retrieved_features_by_user.items()}, held_out_by_user),
+        "mean_candidates_full": float(np.mean([len(df) for df in full_features_by_user.values()])) if full_features_by_user else 0.0,
+        "mean_candidates_retrieved": float(np.mean([len(df) for df in retrieved_features_by_user.values()])) if retrieved_features_by_user else 0.0,
+    }
 
 def weight_search(G_train, test_by_user, k, step):
     best = (None, -1.0)
@@ -119,20 +136,267 @@ def weight_search(G_train, test_by_user, k, step):
                 best = (weights, score)
     return best
 
+def simplex_grid(step):
+    """
+    All (w_loc, w_friend, w_pref) triples on a `step` grid that sum to 1.0,
+    in the same order as the nested loops in `weight_search`.
+    """
+    vals = np.arange(0, 1.0 + step, step)
+    w_loc, w_friend = np.meshgrid(vals, vals, indexing="ij")
+    w_loc, w_friend = w_loc.ravel(), w_friend.ravel()
+    w_pref = 1 - w_loc - w_friend
+    keep = w_pref >= 0.0
+    return np.column_stack((w_loc[keep], w_friend[keep], w_pref[keep]))
+
+class PaddedStack(NamedTuple):
+    """
+    A run of consecutive FeatureStack users padded to its widest user's candidate count:
+    (users, candidates, 3) features, masks of real and held-out candidates, and held-out counts.
+    """
+    features: np.ndarray
+    valid: np.ndarray
+    held: np.ndarray
+    n_held: np.ndarray
+
+class FeatureStack:
+    """
+    Every user's candidate features, with columns in WEIGHT_COLUMNS order, and a mask of
+    held-out candidates, stored ragged: one row per candidate, user i's candidates at rows
+    offsets[i]:offsets[i + 1]. Evaluation pads a chunk of users at a time (see `chunks`),
+    so memory follows the total candidate count rather than users x widest user.
+    """
+    def __init__(self, features_by_user, held_out_by_user):
+        self.users = list(features_by_user)
+        lengths = [len(df) for df in features_by_user.values()]
+        self.offsets = np.concatenate(([0], np.cumsum(lengths, dtype=np.int64)))
+        self.features = np.zeros((self.offsets[-1], len(WEIGHT_COLUMNS)))
+        self.held = np.zeros(self.offsets[-1], dtype=bool)
+        self.n_held = np.zeros(len(self.users))
+        for i, user in enumerate(self.users):
+            df = features_by_user[user]
+            held = held_out_by_user[user]
+            start, stop = self.offsets[i], self.offsets[i + 1]
+            self.features[start:stop] = df[WEIGHT_COLUMNS].values
+            self.held[start:stop] = df.index.isin(list(held))
+            self.n_held[i] = len(held)
+
+    def subset(self, user_idx):
+        """
+        Stack restricted to the users at positions `user_idx`.
+        """
+        user_idx = np.asarray(user_idx, dtype=np.int64)
+        starts = self.offsets[user_idx]
+        lengths = self.offsets[user_idx + 1] - starts
+        offsets = np.concatenate(([0], np.cumsum(lengths)))
+        # row j of the subset's i-th user is row starts[i] + j of this stack
+        rows = np.repeat(starts - offsets[:-1], lengths) + np.arange(offsets[-1])
+        sub = copy.copy(self)
+        sub.users = [self.users[i] for i in user_idx.tolist()]
+        sub.offsets = offsets
+        sub.features = self.features[rows]
+        sub.held = self.held[rows]
+        sub.n_held = self.n_held[user_idx]
+        return sub
+
+    def padded(self, start, stop):
+        """
+        Users `start:stop` as a PaddedStack.
+        """
+        lengths = np.diff(self.offsets[start:stop + 1])
+        n_cands = int(lengths.max(initial=0))
+        valid = np.arange(n_cands)[None, :] < lengths[:, None]
+        features = np.zeros((stop - start, n_cands, len(WEIGHT_COLUMNS)))
+        held = np.zeros((stop - start, n_cands), dtype=bool)
+        # the mask is True row by row in candidate order, as the ragged rows are stored
+        rows = slice(self.offsets[start], self.offsets[stop])
+        features[valid] = self.features[rows]
+        held[valid] = self.held[rows]
+        return PaddedStack(features, valid, held, self.n_held[start:stop])
+
+    def chunks(self, max_elements=GRID_CHUNK_ELEMENTS):
+        """
+        PaddedStacks over consecutive users, in order, each padded to at most
+        `max_elements` features (one user at least).
+        """
+        budget = max(1, max_elements // len(WEIGHT_COLUMNS))
+        lengths = np.diff(self.offsets).tolist()
+        start, widest = 0, 0
+        for i, n in enumerate(lengths):
+            if i > start and (i + 1 - start) * max(widest, n) > budget:
+                yield self.padded(start, i)
+                start, widest = i, 0
+            widest = max(widest, n)
+        if start < len(lengths):
+            yield self.padded(start, len(lengths))
+
+def evaluate_weight_grid(stack, weight_grid, k, max_elements=GRID_CHUNK_ELEMENTS):
+    """
+    Mean recall@k for every row of `weight_grid` at once.
+    Scores are one (users x candidates x 3) . (3 x W) product per chunk of users and chunk of
+    weights, and hits are counted with the held-out mask instead of per-user set intersections.
+    """
+    n_users = len(stack.users)
+    recalls = np.zeros(len(weight_grid))
+    if n_users == 0:
+        return recalls
+    for block in stack.chunks(max_elements):
+        n_block, n_cands, _ = block.features.shape
+        if n_cands == 0:
+            continue
+        kk = min(k, n_cands)
+        chunk = max(1, max_elements // (n_block * n_cands))
+        # padding never makes the top k
+        padding = np.where(block.valid, 0.0, -np.inf)[:, :, None]
+        held = block.held[:, :, None]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            per_user = np.where(block.n_held > 0, 1 / block.n_held, 0.0)[:, None]
+        for start in range(0, len(weight_grid), chunk):
+            w = weight_grid[start:start + chunk]
+            scores = block.features @ w.T + padding
+            if kk < n_cands:
+                top = np.argpartition(-scores, kk - 1, axis=1)[:, :kk, :]
+            else:
+                top = np.broadcast_to(np.arange(n_cands)[None, :, None], scores.shape)
+            hits = np.take_along_axis(np.broadcast_to(held, scores.shape), top, axis=1).sum(axis=1)
+            recalls[start:start + chunk] += (hits * per_user).sum(axis=0)
+    return recalls / n_users
+
 def weight_search_fast(features_by_user, held_out_by_user, k, step):
-    best = (None, -1.0)
+    grid = simplex_grid(step)
+    recalls = evaluate_weight_grid(FeatureStack(features_by_user, held_out_by_user), grid, k)
+    if len(recalls) == 0 or not features_by_user:
+        return (None, -1.0)
+    # argmax keeps the first best grid point, like the strict > in weight_search
+    best = int(np.argmax(recalls))
+    return tuple(grid[best]), float(recalls[best])
 
-    # generate weights that sum to 1.0
-    vals= np.arange(0, 1.0 + step, step)
+class WeightEvaluator:
+    """
+    Callable that returns mean recall@k for a batch of weight vectors, optionally on a
+    subset of users, and counts how much evaluation work the search strategies use.
+    """
+    def __init__(self, stack, k):
+        self.stack = stack
+        self.k = k
+        self.n_users = len(stack.users)
+        self.evaluations = 0
+        self.user_evaluations = 0
 
-    for w_loc in vals:
-        for w_friend in vals:
-            w_pref = 1 - w_loc - w_friend
-            if w_pref < 0.0:
-                continue
-            weights = (w_loc, w_friend, w_pref)
-            score = evaluate_weights_fast(weights, features_by_user, held_out_by_user, k)   
-            if score > best[1]:
-                best = (weights, score)
-    return best
+    def __call__(self, weights, user_idx=None):
+        weights = np.atleast_2d(weights)
+        stack = self.stack if user_idx is None else self.stack.subset(user_idx)
+        self.evaluations += len(weights)
+        self.user_evaluations += len(weights) * len(stack.users)
+        return evaluate_weight_grid(stack, weights, self.k)
+
+def _best(weights, scores):
+    best = int(np.argmax(scores))
+    return tuple(weights[best]), float(scores[best])
+
+def _simplex_points(unit):
+    """
+    Map points of the unit cube [0, 1]^(d-1) onto the d-simplex via sorted spacings.
+    """
+    cuts = np.sort(unit, axis=1)
+    n = len(cuts)
+    return np.diff(np.hstack((np.zeros((n, 1)), cuts, np.ones((n, 1)))), axis=1)
+
+def _anchor_points(d):
+    # every corner plus the centre, so samplers always cover the extremes
+    return np.vstack((np.eye(d), np.full((1, d), 1 / d)))
+
+def grid_strategy(evaluate, step=0.1, **_):
+    grid = simplex_grid(step)
+    return _best(grid, evaluate(grid))
+
+def random_strategy(evaluate, samples=256, seed=20, **_):
+    d = len(WEIGHT_COLUMNS)
+    rng = np.random.default_rng(seed)
+    weights = np.vstack((_anchor_points(d), rng.dirichlet(np.ones(d), samples)))
+    return _best(weights, evaluate(weights))
 
+def sobol_strategy(evaluate, samples=256, seed=20, **_):
+    from scipy.stats import qmc
+    d = len(WEIGHT_COLUMNS)
+    sampler = qmc.Sobol(d - 1, scramble=True, seed=seed)
+    unit = sampler.random_base2(max(1, math.ceil(math.log2(samples))))
+    weights = np.vstack((_anchor_points(d), _simplex_points(unit)))
+    return _best(weights, evaluate(weights))
+
+def _shift_weight(w, i, value):
+    """
+    Set w[i] to `value` and rescale the other weights so the total stays 1.0.
+    """
+    out = w.copy()
+    rest = 1 - w[i]
+    out[i] = value
+    others = np.arange(len(w)) != i
+    if rest > 0:
+        out[others] = w[others] * (1 - value) / rest
+    else:
+        out[others] = (1 - value) / others.sum()
+    return out
+
+def coordinate_strategy(evaluate, step=0.1, samples=256, min_step=1e-3, **_):
+    """
+    Coordinate ascent on the simplex: move one weight up or down by `delta` at a time,
+    rescaling the others, and halve `delta` whenever no move improves recall.
+    """
+    d = len(WEIGHT_COLUMNS)
+    w = np.full(d, 1 / d)
+    best = float(evaluate(w)[0])
+    delta = step
+    while delta >= min_step and evaluate.evaluations < samples:
+        trials = [
+            _shift_weight(w, i, min(1.0, max(0.0, w[i] + sign * delta)))
+            for i in range(d) for sign in (1, -1)
+        ]
+        trials = np.array(trials)
+        scores = evaluate(trials)
+        i = int(np.argmax(scores))
+        if scores[i] > best:
+            w, best = trials[i], float(scores[i])
+        else:
+            delta /= 2
+    return tuple(w), best
+
+def halving_strategy(evaluate, samples=256, seed=20, eta=3, **_):
+    """
+    Successive halving: score many random weight vectors on a small user sample,
+    keep the best 1/eta, and grow the sample by eta until every user is used.
+    """
+    d = len(WEIGHT_COLUMNS)
+    rng = np.random.default_rng(seed)
+    weights = np.vstack((_anchor_points(d), rng.dirichlet(np.ones(d), samples)))
+    order = rng.permutation(evaluate.n_users)
+    rounds = max(0, math.floor(math.log(len(weights), eta)))
+    n_sample = max(1, evaluate.n_users // eta ** rounds)
+    while True:
+        scores = evaluate(weights, user_idx=order[:n_sample])
+        if len(weights) == 1 or n_sample >= evaluate.n_users:
+            break
+        weights = weights[np.argsort(-scores, kind="stable")[:max(1, len(weights) // eta)]]
+        n_sample = min(evaluate.n_users, n_sample * eta)
+    if n_sample < evaluate.n_users:
+        scores = evaluate(weights)
+    return _best(weights, scores)
+
+SEARCH_STRATEGIES = {
+    "grid": grid_strategy,
+    "random": random_strategy,
+    "sobol": sobol_strategy,
+    "coordinate": coordinate_strategy,
+    "halving": halving_strategy,
+}
+
+def weight_search_strategy(features_by_user, held_out_by_user, k, strategy="grid", **options):
+    """
+    Search for the best weights with one of SEARCH_STRATEGIES.
+    Returns `(weights, recall, evaluator)`; the evaluator records how many weight
+    vectors (and weight x user pairs) were scored.
+    """
+    evaluate = WeightEvaluator(FeatureStack(features_by_user, held_out_by_user), k)
+    if evaluate.n_users == 0:
+        return None, -1.0, evaluate
+    weights, score = SEARCH_STRATEGIES[strategy](evaluate, **options)
+    return weights, score, evaluate
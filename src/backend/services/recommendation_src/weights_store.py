@@ -0,0 +1,112 @@
+'''
+Scoring weights read from the optimizer's weights.json and swapped in at runtime.
+The file is polled by mtime at most every few seconds from the request path; when it
+changes, the new weights replace the old ones in a single reference swap, so a request
+always scores with one consistent set. Each set is versioned by the file's `last_updated`
+field, which callers use to key anything computed with it.
+'''
+
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Callable, NamedTuple
+from scoring_engine import FEATURE_COLUMNS
+
+WEIGHTS_PATH = os.getenv("RECOMMENDATION_WEIGHTS", "weights.json")
+DEFAULT_POLL_INTERVAL = float(os.getenv("RECOMMENDATION_WEIGHTS_POLL", "5"))
+
+# used until a weights file has been read
+DEFAULT_WEIGHTS = {
+    "location_score": 0.5,
+    "preference_score": 0.3,
+    "friend_score": 0.2,
+}
+
+class Weights(NamedTuple):
+    values: dict[str, float]
+    version: str
+
+def load_weights(path: str) -> Weights:
+    """
+    Parse a weights file. Raises ValueError if it is not JSON or lacks a feature weight.
+    Files without `last_updated` are versioned by a hash of their contents.
+    """
+    with open(path, "rb") as f:
+        raw = f.read()
+    data = json.loads(raw)
+    if data is None:
+        return Weights(dict(DEFAULT_WEIGHTS), "default")
+    if not isinstance(data, dict):
+        raise ValueError("expected a JSON object")
+    missing = [column for column in FEATURE_COLUMNS if not isinstance(data.get(column), (int, float))]
+    if missing:
+        raise ValueError(f"missing or non-numeric weights: {', '.join(missing)}")
+    values = {column: float(data[column]) for column in FEATURE_COLUMNS}
+    version = str(data.get("last_updated") or "sha1:" + hashlib.sha1(raw).hexdigest()[:12])
+    return Weights(values, version)
+
+class WeightsStore:
+    """
+    The current Weights for `path`, re-read whenever the file's mtime or size changes.
+    A missing or unreadable file keeps the weights already in use. Listeners added with
+    `on_change` are called with the new Weights after each swap.
+    """
+    def __init__(self, path: str = WEIGHTS_PATH, interval: float = DEFAULT_POLL_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._listeners: list[Callable[[Weights], None]] = []
+        self._signature = None
+        self._checked_at = None
+        self._current = Weights(dict(DEFAULT_WEIGHTS), "default")
+        self.swaps = 0
+        self.check()
+
+    def on_change(self, listener: Callable[[Weights], None]):
+        self._listeners.append(listener)
+
+    def get(self) -> Weights:
+        """
+        The weights to score with, checking the file first if `interval` has passed.
+        """
+        checked_at = self._checked_at
+        if checked_at is None or time.monotonic() - checked_at >= self.interval:
+            self.check()
+        return self._current
+
+    def check(self) -> bool:
+        """
+        Re-read the file if it changed since the last read. Returns True if new weights were swapped in.
+        """
+        with self._lock:
+            self._checked_at = time.monotonic()
+            try:
+                stat = os.stat(self.path)
+            except FileNotFoundError:
+                return False
+            signature = (stat.st_mtime_ns, stat.st_size)
+            if signature == self._signature:
+                return False
+            try:
+                weights = load_weights(self.path)
+            except (OSError, ValueError) as e:
+                # not recorded as read, so a file caught mid-write is retried on the next check
+                print(f"Ignoring weights file {self.path}: {e}")
+                return False
+            self._signature = signature
+            if weights.values == self._current.values:
+                return False
+            if weights.version == self._current.version:
+                # edited by hand without bumping last_updated; results under the old version would be stale
+                weights = weights._replace(version=f"{weights.version}+{self.swaps + 1}")
+            self._current = weights
+            self.swaps += 1
+            listeners = list(self._listeners)
+        print(f"Loaded weights {weights.version} from {self.path}: {weights.values}")
+        for listener in listeners:
+            listener(weights)
+        return True
+
+weights_store = WeightsStore()
@@ -408,6 +408,16 @@ exports.unfollowUser = async (req, res) => {
         },
       },
     });
+    await fetch(`${process.env.RECOMMENDATION_SERVICE_URL}/remove_follow`, {
+      method: "POST",
+      headers: {
+        "Content-Type": "application/json",
+      },
+      body: JSON.stringify({
+        followerId,
+        followingId,
+      }),
+    });
     res.json({ message: "User unfollowed" });
   } catch (error) {
     res.status(500).json({ error: "Internal Server Error" });